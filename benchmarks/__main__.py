@@ -0,0 +1,55 @@
+"""
+    Runs the benchmarks from the command line, e.g.::
+
+        python -m benchmarks
+        python -m benchmarks --pages 10000 --pages 100000 --scenario search
+        python -m benchmarks --pages 1000 --save
+
+    The process exits with 1 when a scenario regressed.
+"""
+import sys
+import tempfile
+
+import click
+
+from benchmarks.generator import create_benchmark_app
+from benchmarks.generator import generate_wiki
+from benchmarks.runner import THRESHOLD
+from benchmarks.runner import find_regressions
+from benchmarks.runner import format_results
+from benchmarks.runner import run_benchmarks
+from benchmarks.runner import save_baselines
+
+
+@click.command()
+@click.option('--pages', type=int, multiple=True, help='Wiki sizes to run, defaults to 1000.')
+@click.option('--iterations', type=int, default=50, help='Timed requests per scenario.')
+@click.option('--scenario', 'only', multiple=True, help='Scenarios to run, defaults to all.')
+@click.option('--page-size', type=int, default=1000, help='Characters per page body.')
+@click.option('--link-density', type=float, default=0.02, help='Share of the words that are links.')
+@click.option('--tags', type=int, default=50, help='Number of distinct tags.')
+@click.option('--versions', type=int, default=3, help='Maximum versions per page.')
+@click.option('--history-depth', type=int, default=50, help='Search history entries per user.')
+@click.option('--threshold', type=float, default=THRESHOLD, help='Allowed p95 slowdown against the baseline.')
+@click.option('--save', is_flag=True, help='Store the results as the new baselines.')
+def main(pages, iterations, only, page_size, link_density, tags, versions, history_depth, threshold, save):
+    """Benchmarks the wiki on synthetic wikis of several sizes."""
+    regressed = False
+    for size in pages or (1000,):
+        with tempfile.TemporaryDirectory() as root:
+            wiki = generate_wiki(root, pages=size, page_size=page_size, link_density=link_density, tags=tags,
+                                 versions=versions, history_depth=history_depth)
+            app = create_benchmark_app(wiki)
+            results = run_benchmarks(wiki, app, iterations=iterations, only=only)
+        click.echo(format_results(results, size))
+        if save:
+            save_baselines(results, size)
+            continue
+        for result, baseline in find_regressions(results, size, threshold):
+            regressed = True
+            click.echo('REGRESSION %s: p95 %.2f ms, baseline %.2f ms' % (result.name, result.p95, baseline))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
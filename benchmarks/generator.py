@@ -0,0 +1,187 @@
+"""
+    Synthetic wiki
+    ~~~~~~~~~~~~~~
+
+    Builds a wiki of any size for the benchmarks: a content directory of
+    pages, the users and a database holding the versions of the pages and
+    the search history of the users. Everything is derived from a seed,
+    so the same arguments always build the same wiki.
+"""
+import json
+import os
+import random
+import sqlite3
+from collections import namedtuple
+from datetime import datetime
+from datetime import timedelta
+
+from faker import Faker
+
+import config
+from wiki import create_app
+from wiki.core import clean_url
+
+#: the password of every generated user
+PASSWORD = '1234'
+
+SyntheticWiki = namedtuple('SyntheticWiki', ['root', 'database', 'urls', 'titles', 'tags', 'users', 'words',
+                                             'versioned'])
+
+
+def write_config(root, database):
+    with open(os.path.join(root, 'config.py'), 'w') as f:
+        f.write('# encoding: utf-8\n\n')
+        f.write('SECRET_KEY = %r\n' % 'benchmark')
+        f.write('TITLE = %r\n' % 'Benchmark')
+        f.write('DATABASE = %r\n' % database)
+        f.write('USER_DIR = %r\n' % os.path.abspath(root))
+        f.write('WTF_CSRF_ENABLED = False\n')
+
+
+def write_users(root, users):
+    accounts = {}
+    for user in users:
+        accounts[user] = {'active': True, 'authentication_method': 'cleartext', 'password': PASSWORD,
+                          'authenticated': False, 'roles': []}
+    with open(os.path.join(root, 'users.json'), 'w') as f:
+        json.dump(accounts, f)
+
+
+def make_body(rng, words, urls, titles, page_size, link_density):
+    """
+        Returns a body of about page_size characters, a share link_density
+        of its words being wikilinks to other pages.
+    """
+    parts = []
+    size = 0
+    sentence = 0
+    while size < page_size:
+        if urls and rng.random() < link_density:
+            index = rng.randrange(len(urls))
+            part = '[[%s|%s]]' % (urls[index], titles[index])
+        else:
+            part = rng.choice(words)
+        sentence += 1
+        if sentence > 12 and rng.random() < 0.2:
+            part += '.\n\n' if rng.random() < 0.2 else '.'
+            sentence = 0
+        parts.append(part)
+        size += len(part) + 1
+    return ' '.join(parts) + '.\n'
+
+
+def generate_wiki(root, pages=1000, page_size=1000, link_density=0.02, tags=50, tags_per_page=3,
+                  tag_skew=1.0, versions=3, users=20, history_depth=50, folders=0.1, seed=0):
+    """
+        Builds a synthetic wiki in root.
+
+        :param str root: the directory of the wiki, it is created if missing
+        :param int pages: the number of pages
+        :param int page_size: the size of a page body in characters
+        :param float link_density: the share of the words of a body that
+            are links to other pages
+        :param int tags: the number of distinct tags
+        :param int tags_per_page: the maximum number of tags of a page
+        :param float tag_skew: the exponent of the Zipf distribution of the
+            tags, the higher the more pages share the most common tags
+        :param int versions: the maximum number of versions of a page
+        :param int users: the number of users
+        :param int history_depth: the number of pages in the search history
+            of every user
+        :param float folders: the share of the pages in subfolders
+        :param int seed: the seed of the random data
+
+        :returns: the generated wiki
+        :rtype: SyntheticWiki
+    """
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    database = os.path.abspath(os.path.join(root, 'wiki.db'))
+
+    # faker gives the vocabulary, the bulk of the text is drawn from it
+    words = sorted(set(word.lower() for word in fake.words(2000)))
+    tag_names = sorted(set(fake.word().lower() for _ in range(tags * 4)))[:tags]
+    tag_weights = [1.0 / (rank + 1) ** tag_skew for rank in range(len(tag_names))]
+    user_names = sorted(set(fake.user_name() for _ in range(users * 2)))[:users]
+
+    # every wiki has a home page
+    urls, titles = ['home'], ['Home']
+    for number in range(1, pages):
+        title = '%s %d' % (fake.catch_phrase(), number)
+        url = clean_url(title)
+        if rng.random() < folders:
+            url = '%s/%s' % (rng.choice(tag_names), url)
+        urls.append(url)
+        titles.append(title)
+
+    write_config(root, database)
+    write_users(root, user_names)
+
+    if os.path.exists(database):
+        os.remove(database)
+    conn = sqlite3.connect(database)
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE wiki_pages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        url TEXT NOT NULL,
+                        version INTEGER,
+                        content TEXT NOT NULL,
+                        date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        author TEXT NOT NULL,
+                        approved BOOLEAN DEFAULT FALSE
+    )''')
+    cursor.execute('''CREATE TABLE user_history (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        url TEXT NOT NULL,
+                        date_last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        count_accessed INTEGER NOT NULL,
+                        user TEXT NOT NULL
+    )''')
+
+    now = datetime.now()
+    rows = []
+    versioned = []
+    for url, title in zip(urls, titles):
+        page_tags = sorted(set(rng.choices(tag_names, tag_weights, k=rng.randint(1, tags_per_page))))
+        author = rng.choice(user_names)
+        count = rng.randint(1, versions)
+        if count > 1:
+            versioned.append(url)
+        date = now - timedelta(days=rng.randint(count, 365))
+        for version in range(1, count + 1):
+            body = make_body(rng, words, urls, titles, page_size, link_density)
+            content = 'title: %s\ntags: %s\n\n%s' % (title, ', '.join(page_tags), body)
+            rows.append((url, version, content, date, author if version == 1 else rng.choice(user_names), True))
+            date += timedelta(days=1)
+        path = os.path.join(root, url + '.md')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        if len(rows) >= 10000:
+            cursor.executemany('''INSERT INTO wiki_pages (url, version, content, date_created, author, approved)
+                                  VALUES (?, ?, ?, ?, ?, ?)''', rows)
+            rows = []
+    cursor.executemany('''INSERT INTO wiki_pages (url, version, content, date_created, author, approved)
+                          VALUES (?, ?, ?, ?, ?, ?)''', rows)
+
+    rows = []
+    for user in user_names:
+        for index in rng.sample(range(len(titles)), min(history_depth, len(titles))):
+            rows.append((titles[index], now - timedelta(minutes=rng.randint(0, 90 * 24 * 60)),
+                         rng.randint(1, 20), user))
+    cursor.executemany('''INSERT INTO user_history (url, date_last_accessed, count_accessed, user)
+                          VALUES (?, ?, ?, ?)''', rows)
+    conn.commit()
+    conn.close()
+
+    return SyntheticWiki(root, database, urls, titles, tag_names, user_names, words, versioned)
+
+
+def create_benchmark_app(wiki):
+    """
+        Creates the app of a generated wiki, with its indexes and tables.
+    """
+    config.DATABASE = wiki.database
+    return create_app(wiki.root)
@@ -0,0 +1,94 @@
+"""
+    Index memory
+    ~~~~~~~~~~~~
+
+    Measures the memory the page index of a synthetic wiki takes, as page
+    records and as full pages, e.g.::
+
+        python -m benchmarks.memory --pages 10000 --pages 100000 --pages 200000
+
+    Full pages are rendered, which takes minutes for large wikis, so only a
+    sample of them is measured and the size of all of them estimated from it.
+"""
+import gc
+import tempfile
+import tracemalloc
+from collections import namedtuple
+
+import click
+
+from benchmarks.generator import create_benchmark_app
+from benchmarks.generator import generate_wiki
+from wiki.core import Page
+from wiki.core import Wiki
+from wiki.records import PageIndex
+
+#: the number of full pages measured to estimate the size of all of them
+SAMPLE = 1000
+
+MemoryResult = namedtuple('MemoryResult', ['pages', 'records', 'full_pages'])
+
+
+def traced(build):
+    """
+        Returns what build returned and the bytes allocated by it that are
+        still alive.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def measure_index(wiki, sample=SAMPLE):
+    """
+        Measures the index of a generated wiki.
+
+        :param wiki: the :class:`~benchmarks.generator.SyntheticWiki`
+        :param int sample: the number of full pages to measure
+
+        :returns: the number of pages and the bytes of the index as records
+            and, estimated from the sample, as full pages
+        :rtype: MemoryResult
+    """
+    records, records_size = traced(lambda: PageIndex(wiki.root).records())
+    paths = list(zip(range(sample), Wiki(wiki.root).walk()))
+    # pages render their links with url_for
+    with create_benchmark_app(wiki).test_request_context():
+        pages, pages_size = traced(lambda: [Page(path, url) for _, (url, path) in paths])
+    full_pages = pages_size * len(records) // max(len(pages), 1)
+    return MemoryResult(len(records), records_size, full_pages)
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.2f GiB' % size
+
+
+@click.command()
+@click.option('--pages', type=int, multiple=True, help='Wiki sizes to measure, defaults to 10000.')
+@click.option('--page-size', type=int, default=1000, help='Characters per page body.')
+@click.option('--tags', type=int, default=50, help='Number of distinct tags.')
+@click.option('--sample', type=int, default=SAMPLE, help='Full pages to measure.')
+def main(pages, page_size, tags, sample):
+    """Measures the memory of the page index of synthetic wikis."""
+    click.echo('%10s %14s %14s %10s' % ('pages', 'records', 'full pages', 'per record'))
+    for size in pages or (10000,):
+        with tempfile.TemporaryDirectory() as root:
+            wiki = generate_wiki(root, pages=size, page_size=page_size, tags=tags, versions=1, history_depth=1)
+            result = measure_index(wiki, sample)
+        click.echo('%10d %14s %14s %10s' % (result.pages, format_size(result.records),
+                                            format_size(result.full_pages),
+                                            format_size(result.records / result.pages)))
+
+
+if __name__ == '__main__':
+    main()
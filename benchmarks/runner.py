@@ -0,0 +1,167 @@
+"""
+    Benchmark runner
+    ~~~~~~~~~~~~~~~~
+
+    Drives the app of a synthetic wiki through the Flask test client and
+    reports the 50th, 95th and 99th percentile latency of every scenario.
+    Results are compared with the stored baselines of the same wiki size
+    and a scenario regresses when its p95 exceeds the baseline by more
+    than the threshold.
+"""
+import json
+import os
+import random
+import time
+from collections import namedtuple
+
+#: where the baselines are stored, by wiki size and scenario
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+#: how much slower than the baseline a scenario may get, 0.25 is 25%
+THRESHOLD = 0.25
+
+Scenario = namedtuple('Scenario', ['name', 'prepare', 'run'])
+Result = namedtuple('Result', ['name', 'p50', 'p95', 'p99'])
+
+
+def percentile(timings, percent):
+    """
+        Returns the nearest rank percentile of sorted timings.
+    """
+    index = max(0, min(len(timings) - 1, int(round(percent / 100.0 * len(timings))) - 1))
+    return timings[index]
+
+
+def make_scenarios(wiki, app, rng):
+    """
+        Returns the scenarios run against a synthetic wiki. Every scenario
+        prepares its request untimed, e.g. to pick a random page, then the
+        request is timed.
+
+        :param SyntheticWiki wiki: the wiki the app serves
+        :param app: the app of the wiki
+        :param random.Random rng: the source of the random pages and terms
+    """
+    cache = app.extensions['page_cache']
+    edits = [0]
+
+    def random_page():
+        return rng.choice(wiki.urls)
+
+    def uncached_page():
+        # the page cache would skip rendering the page
+        cache.clear()
+        return random_page()
+
+    def versioned_page():
+        # the first version of a page is shown from its second version on
+        return rng.choice(wiki.versioned or wiki.urls)
+
+    def random_word():
+        return rng.choice(wiki.words)
+
+    def random_prefix():
+        return rng.choice(wiki.titles)[:3]
+
+    def edit():
+        edits[0] += 1
+        return random_page(), {'title': 'Edited page %d' % edits[0], 'tags': rng.choice(wiki.tags),
+                               'body': ' '.join(rng.choice(wiki.words) for _ in range(150))}
+
+    return [
+        Scenario('index', lambda: None, lambda client, _: client.get('/index/')),
+        Scenario('search', random_word, lambda client, term: client.get('/search/', query_string={'term': term})),
+        Scenario('search_autocomplete', random_prefix,
+                 lambda client, query: client.get('/search_autocomplete', query_string={'query': query})),
+        Scenario('render', uncached_page, lambda client, url: client.get('/%s/' % url)),
+        Scenario('save', edit, lambda client, args: client.post('/edit/%s/' % args[0], data=args[1])),
+        Scenario('versions', versioned_page, lambda client, url: client.get('/display_version/%s/1' % url)),
+    ]
+
+
+def run_scenario(client, scenario, iterations, warmup):
+    """
+        Runs a scenario and returns its percentiles in milliseconds.
+    """
+    timings = []
+    for iteration in range(warmup + iterations):
+        argument = scenario.prepare()
+        started = time.perf_counter()
+        response = scenario.run(client, argument)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError('%s failed with %d' % (scenario.name, response.status_code))
+        if iteration >= warmup:
+            timings.append(elapsed * 1000)
+    timings.sort()
+    return Result(scenario.name, percentile(timings, 50), percentile(timings, 95), percentile(timings, 99))
+
+
+def run_benchmarks(wiki, app, iterations=50, warmup=3, only=None, seed=0):
+    """
+        Runs the scenarios against the app of a synthetic wiki.
+
+        :param SyntheticWiki wiki: the wiki the app serves
+        :param app: the app of the wiki
+        :param int iterations: the number of timed requests per scenario
+        :param int warmup: the number of untimed requests before
+        :param list only: the names of the scenarios to run, all if None
+        :param int seed: the seed of the random pages and terms
+
+        :returns: the result of every scenario
+        :rtype: list
+    """
+    rng = random.Random(seed)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = wiki.users[0]
+    results = []
+    for scenario in make_scenarios(wiki, app, rng):
+        if only and scenario.name not in only:
+            continue
+        results.append(run_scenario(client, scenario, iterations, warmup))
+    return results
+
+
+def load_baselines(path=BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, pages, path=BASELINES):
+    """
+        Stores the results as the baselines of a wiki size, keeping the
+        baselines of the other sizes.
+    """
+    baselines = load_baselines(path)
+    stored = baselines.setdefault(str(pages), {})
+    for result in results:
+        stored[result.name] = {'p50': round(result.p50, 3), 'p95': round(result.p95, 3),
+                               'p99': round(result.p99, 3)}
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def find_regressions(results, pages, threshold=THRESHOLD, path=BASELINES):
+    """
+        Returns the results whose p95 exceeds their baseline by more than
+        the threshold, with the baseline p95, scenarios without a baseline
+        are skipped.
+    """
+    baselines = load_baselines(path).get(str(pages), {})
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result.name)
+        if baseline and result.p95 > baseline['p95'] * (1 + threshold):
+            regressions.append((result, baseline['p95']))
+    return regressions
+
+
+def format_results(results, pages):
+    lines = ['%d pages' % pages, '%-22s %10s %10s %10s' % ('scenario', 'p50 ms', 'p95 ms', 'p99 ms')]
+    for result in results:
+        lines.append('%-22s %10.2f %10.2f %10.2f' % result)
+    return '\n'.join(lines)
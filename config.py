@@ -9,3 +9,30 @@ USER_DIR = 'user'
 NUMBER_OF_HISTORY = 5
 DATABASE = 'wiki.db'
 PRIVATE = True
+POPULARITY_REFRESH = 300
+AUTOCOMPLETE_LIMIT = 10
+SEARCH_PAGE_SIZE = 20
+SEARCH_REGEX_BUDGET = 2
+SEARCH_REGEX_MAX_PAGE_SIZE = 100000
+SEARCH_STREAM_BUDGET = 30
+SEARCH_STREAM_LIMIT = 500
+POPULAR_REFRESH = 60
+POPULAR_TOP = 100
+POPULAR_LIMIT = 10
+USER_VIEWS_KEEP = 100
+HISTORY_RETENTION_DAYS = 180
+HISTORY_MAX_PER_USER = 500
+HISTORY_QUERY_LIMIT = 200
+HISTORY_COMPACT_BATCH = 500
+HISTORY_COMPACT_INTERVAL = 3600
+CONTENT_WATCH_INTERVAL = 2
+CACHE_CHANGES_KEEP = 10000
+PAGE_CACHE_SIZE = 500
+METRICS_ENABLED = False
+RENDER_WAIT_TIMEOUT = 10
+FRAGMENT_CACHE_SIZE = 1000
+INCLUDE_DEPTH = 5
+ATTACHMENT_DIR = 'attachments'
+ATTACHMENT_MAX_SIZE = 50 * 1024 * 1024
+THUMBNAIL_WIDTHS = (200, 400, 800)
+THUMBNAIL_WORKERS = 2
@@ -0,0 +1,89 @@
+"""
+    Helpers shared by the tests: pages written into a content directory
+    and the app run on a temporary wiki with a database of its own.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+import config
+from wiki import create_app
+from wiki.fragments import fragments
+from wiki.records import PageIndex
+from wiki.web import initialize_db
+
+#: the users of a temporary wiki, sam logs in with 1234
+USERS = {'sam': {'active': True, 'authentication_method': 'cleartext', 'password': '1234',
+                 'authenticated': True, 'roles': []}}
+
+
+def write_page(root, url, title, body='content', tags=None):
+    """
+        Writes a page into a content directory, creating its folders.
+
+        :param str root: the content directory
+        :param str url: the url of the page
+        :param str title: the title in the header of the page
+        :param str body: the markdown of the page
+        :param str tags: the tags in the header of the page, none if None
+    """
+    path = os.path.join(root, url + '.md')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = 'title: %s\n' % title
+    if tags is not None:
+        header += 'tags: %s\n' % tags
+    with open(path, 'w') as f:
+        f.write(header + '\n' + body)
+
+
+def add_version(database, url, version, content='content', author='sam', approved=True):
+    """
+        Stores a version of a page in a wiki database.
+    """
+    conn = sqlite3.connect(database)
+    conn.execute('''INSERT INTO wiki_pages (url, version, content, date_created, author, approved)
+                    VALUES (?, ?, ?, ?, ?, ?)''', (url, version, content, datetime.now(), author, approved))
+    conn.commit()
+    conn.close()
+
+
+class WikiTestCase(unittest.TestCase):
+    """
+        Runs the app on an empty wiki in a temporary directory, with a
+        database of its own that config.DATABASE points at, and a client
+        logged in as sam.
+    """
+
+    #: config of the app on top of the directories and the database
+    settings = {}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.database = os.path.join(self.root, 'wiki.db')
+        with open(os.path.join(self.root, 'users.json'), 'w') as f:
+            json.dump(USERS, f)
+        self.app = create_app(os.path.dirname(os.getcwd()))
+        self.patcher = patch.object(config, 'DATABASE', self.database)
+        self.patcher.start()
+        self.app.config.update(CONTENT_DIR=self.root, USER_DIR=self.root, DATABASE=self.database, **self.settings)
+        initialize_db(self.app)
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = 'sam'
+
+    def tearDown(self):
+        self.patcher.stop()
+        fragments.clear()
+        PageIndex._indexes.pop((PageIndex, os.path.abspath(self.root)), None)
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title, body='content', tags=None):
+        write_page(self.root, url, title, body, tags)
+
+    def add_version(self, url, version, content='content', author='sam', approved=True):
+        add_version(self.database, url, version, content, author, approved)
@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from wiki import create_app
+from wiki.queries import record_queries
+from wiki.web import current_users, current_wiki, get_users, get_wiki, initialize_db
+
+
+class TestAppScope(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write_users({'sam': {'active': True, 'authentication_method': 'cleartext', 'password': '1234',
+                                  'authenticated': True, 'roles': []}})
+        self.app = create_app(os.path.dirname(os.getcwd()))
+        self.app.config.update(CONTENT_DIR=self.root, USER_DIR=self.root,
+                               DATABASE=os.path.join(self.root, 'wiki.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_users(self, users):
+        with open(os.path.join(self.root, 'users.json'), 'w') as f:
+            json.dump(users, f)
+
+    def test_shared_between_requests(self):
+        with self.app.test_request_context():
+            wiki, users = get_wiki(), get_users()
+            self.assertEqual(current_wiki.root, self.root)
+        with self.app.test_request_context():
+            self.assertIs(get_wiki(), wiki)
+            self.assertIs(get_users(), users)
+            self.app.config['CONTENT_DIR'] = os.path.dirname(self.root)
+            self.assertIsNot(get_wiki(), wiki)
+
+    def test_users_read_once(self):
+        with self.app.test_request_context():
+            with patch.object(current_users, 'read', wraps=current_users.read) as read:
+                self.assertEqual(current_users.get_user('sam').name, 'sam')
+                current_users.get_user('sam').data['roles'].append('admin')
+                self.assertEqual(current_users.get_user('sam').get('roles'), [])
+                self.assertEqual(read.call_count, 1)
+                self.write_users({'alex': {'active': True}})
+                self.assertIsNone(current_users.get_user('sam'))
+                self.assertEqual(read.call_count, 2)
+
+    def test_initialized_once(self):
+        initialize_db(self.app)
+        with record_queries() as queries:
+            initialize_db(self.app)
+        self.assertEqual(queries.statements, ['PRAGMA user_version'])
+
+
+if __name__ == "__main__":
+    unittest.main()
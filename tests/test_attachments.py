@@ -0,0 +1,138 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config
+from tests import WikiTestCase
+from wiki import attachments
+from wiki.attachments import AttachmentStore
+from wiki.attachments import Thumbnailer
+from wiki.fragments import fragments
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'pixels' * 100
+
+
+def fake_variant(source, target, width):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(b'variant %d' % width)
+
+
+class TestAttachmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = AttachmentStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_stores_by_hash_once(self):
+        digest, size = self.store.store(io.BytesIO(IMAGE))
+        self.assertEqual((digest, size), (hashlib.sha256(IMAGE).hexdigest(), len(IMAGE)))
+        self.assertEqual(self.store.path(digest),
+                         os.path.join(self.root, 'objects', digest[:2], digest[2:4], digest))
+        self.assertEqual(self.store.store(io.BytesIO(IMAGE)), (digest, size))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'objects', digest[:2], digest[2:4])), [digest])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'tmp')), [])
+
+    def test_limit(self):
+        with self.assertRaises(ValueError):
+            self.store.store(io.BytesIO(IMAGE), limit=100)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'objects')))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'tmp')), [])
+
+    def test_thumbnailer(self):
+        digest, _ = self.store.store(io.BytesIO(IMAGE))
+        thumbnails = Thumbnailer(2)
+        with patch.object(attachments, 'Image', None):
+            self.assertIsNone(thumbnails.variant(self.store, digest, 200))
+        with patch.object(attachments, 'Image', object()), \
+                patch.object(attachments, 'make_variant', fake_variant):
+            thumbnails.submit(self.store, digest, 200).result()
+        self.assertEqual(thumbnails.variant(self.store, digest, 200), self.store.variant_path(digest, 200))
+        self.assertEqual(thumbnails.pending, set())
+
+
+class TestAttachmentRoutes(WikiTestCase):
+
+    settings = {'WTF_CSRF_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['ATTACHMENT_DIR'] = os.path.join(self.root, 'attachments')
+
+    def upload(self, data, filename, name=''):
+        with patch.object(attachments, 'Image', None):
+            return self.client.post('/attachments/', data={'file': (io.BytesIO(data), filename), 'name': name},
+                                    content_type='multipart/form-data', follow_redirects=True)
+
+    def test_upload_and_serve(self):
+        response = self.upload(IMAGE, 'My Diagram.png')
+        self.assertIn(b'![[My_Diagram.png]]', response.data)
+        digest = hashlib.sha256(IMAGE).hexdigest()
+        response = self.client.get('/attachments/%s/My_Diagram.png' % digest)
+        self.assertEqual(response.data, IMAGE)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(response.cache_control.max_age, 365 * 24 * 3600)
+        self.assertEqual(response.headers['Content-Security-Policy'], 'sandbox')
+        response = self.client.get('/attachments/%s/My_Diagram.png' % digest, headers={'Range': 'bytes=0-7'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, IMAGE[:8])
+        self.assertEqual(self.client.get('/attachments/../My_Diagram.png').status_code, 404)
+        self.assertEqual(self.client.get('/attachments/%s/x.png' % ('0' * 64)).status_code, 404)
+
+    def test_body_limit(self):
+        self.assertEqual(self.app.config['MAX_CONTENT_LENGTH'], config.ATTACHMENT_MAX_SIZE + 64 * 1024)
+        self.app.config['MAX_CONTENT_LENGTH'] = 100
+        self.assertEqual(self.upload(IMAGE, 'photo.png').status_code, 413)
+        self.assertEqual(sorted(os.listdir(self.root)), ['users.json', 'wiki.db'])
+
+    def test_variant_falls_back_to_original(self):
+        self.upload(IMAGE, 'photo.png')
+        digest = hashlib.sha256(IMAGE).hexdigest()
+        with patch.object(attachments, 'Image', None):
+            response = self.client.get('/attachments/%s/200/photo.png' % digest)
+        self.assertEqual(response.data, IMAGE)
+        self.assertTrue(response.cache_control.no_cache)
+        self.assertEqual(self.client.get('/attachments/%s/123/photo.png' % digest).status_code, 404)
+        fake_variant(None, AttachmentStore(self.app.config['ATTACHMENT_DIR']).variant_path(digest, 200), 200)
+        response = self.client.get('/attachments/%s/200/photo.png' % digest)
+        self.assertEqual(response.data, b'variant 200')
+        self.assertTrue(response.cache_control.immutable)
+
+    def test_embeds(self):
+        self.upload(IMAGE, 'photo.png')
+        self.upload(b'%PDF-1.4', 'manual.pdf')
+        self.write_page('gallery', 'gallery', '![[photo.png]] ![[photo.png|300]] ![[manual.pdf]] ![[missing.png]] [[home]]')
+        response = self.client.get('/gallery/')
+        digest = hashlib.sha256(IMAGE).hexdigest()
+        self.assertIn(("<img src='/attachments/%s/photo.png' alt='photo.png'>" % digest).encode(), response.data)
+        self.assertIn(("<img src='/attachments/%s/400/photo.png' alt='photo.png' width='300'>" % digest).encode(),
+                      response.data)
+        self.assertIn(b">manual.pdf</a>", response.data)
+        self.assertIn(b"<a href='/attachments/' class='missing'>missing.png</a>", response.data)
+        self.assertIn(b"<a href='/home/' class='missing'>home</a>", response.data)
+        etag = response.headers['ETag']
+        self.upload(IMAGE + b'changed', 'photo.png')
+        response = self.client.get('/gallery/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(hashlib.sha256(IMAGE + b'changed').hexdigest().encode(), response.data)
+
+    def test_included_embeds(self):
+        self.upload(IMAGE, 'logo.png')
+        self.write_page('header', 'header', '![[logo.png]]')
+        self.write_page('runbook', 'runbook', '{{include:header}}')
+        response = self.client.get('/runbook/')
+        self.assertIn(("<img src='/attachments/%s/logo.png'" % hashlib.sha256(IMAGE).hexdigest()).encode(),
+                      response.data)
+        self.assertIn('![[logo.png]]', ''.join(fragments.entries.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config
+from benchmarks.generator import create_benchmark_app, generate_wiki
+from benchmarks.runner import Result, find_regressions, percentile, run_benchmarks, save_baselines
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, 'wiki')
+        self.patcher = patch.object(config, 'DATABASE', config.DATABASE)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def test_generate(self):
+        wiki = generate_wiki(self.root, pages=30, versions=2, users=3, history_depth=5, seed=1)
+        self.assertEqual(len(wiki.urls), 30)
+        self.assertEqual(len(set(wiki.urls)), 30)
+        self.assertTrue(os.path.exists(os.path.join(self.root, wiki.urls[-1] + '.md')))
+        conn = sqlite3.connect(wiki.database)
+        self.assertEqual(conn.execute('SELECT COUNT(DISTINCT url) FROM wiki_pages').fetchone()[0], 30)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM user_history').fetchone()[0], 15)
+        conn.close()
+        other = generate_wiki(os.path.join(self.directory.name, 'other'), pages=30, versions=2, users=3,
+                              history_depth=5, seed=1)
+        self.assertEqual(other.urls, wiki.urls)
+
+    def test_run(self):
+        wiki = generate_wiki(self.root, pages=20, page_size=200, users=2, history_depth=3)
+        app = create_benchmark_app(wiki)
+        results = run_benchmarks(wiki, app, iterations=2, warmup=0)
+        self.assertEqual([result.name for result in results],
+                         ['index', 'search', 'search_autocomplete', 'render', 'save', 'versions'])
+        for result in results:
+            self.assertLessEqual(result.p50, result.p99)
+
+    def test_regressions(self):
+        baselines = os.path.join(self.directory.name, 'baselines.json')
+        save_baselines([Result('index', 1.0, 2.0, 3.0), Result('render', 1.0, 2.0, 3.0)], 1000, baselines)
+        results = [Result('index', 1.0, 2.4, 3.0), Result('render', 1.0, 2.6, 3.0), Result('save', 9.0, 9.0, 9.0)]
+        regressions = find_regressions(results, 1000, 0.25, baselines)
+        self.assertEqual(regressions, [(results[1], 2.0)])
+        self.assertEqual(find_regressions(results, 10000, 0.25, baselines), [])
+
+    def test_percentile(self):
+        timings = list(range(1, 101))
+        self.assertEqual(percentile(timings, 50), 50)
+        self.assertEqual(percentile(timings, 99), 99)
+        self.assertEqual(percentile([5], 95), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
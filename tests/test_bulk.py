@@ -0,0 +1,86 @@
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+from tests import WikiTestCase
+from wiki.bulk import approve_pending, delete_pages, retag_pages, retag_page, select_pages
+from wiki.core import Wiki
+
+PAGES = (('animals/lions', 'big cats, africa'), ('animals/zebras', 'africa'), ('animals/cats/tigers', 'big cats'),
+         ('plants/ferns', 'green'))
+
+
+class TestBulk(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for url, tags in PAGES:
+            self.write_page(url, url, 'Body of [[%s]].\n' % url, tags=tags)
+            for version, approved in ((1, True), (2, False)):
+                self.add_version(url, version, approved=approved)
+        self.wiki = Wiki(self.root)
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.database)
+        rows = conn.execute(sql).fetchall()
+        conn.close()
+        return rows
+
+    def test_select(self):
+        self.assertEqual(select_pages(self.wiki, tag='africa'), ['animals/lions', 'animals/zebras'])
+        self.assertEqual(select_pages(self.wiki, prefix='animals/cats'), ['animals/cats/tigers'])
+        self.assertEqual(select_pages(self.wiki, urls=['plants/ferns', 'missing'], tag='big cats'),
+                         ['animals/cats/tigers', 'animals/lions', 'plants/ferns'])
+        self.assertEqual(len(select_pages(self.wiki, prefix='/')), 0)
+
+    def test_delete(self):
+        calls = []
+        with patch('wiki.bulk.BATCH', 2):
+            result = delete_pages(self.wiki, select_pages(self.wiki, prefix='animals') + ['missing'],
+                                  lambda done, total: calls.append((done, total)))
+        self.assertEqual(result, (3, 1))
+        self.assertEqual(calls, [(2, 4), (4, 4)])
+        self.assertFalse(self.wiki.exists('animals/lions'))
+        self.assertEqual(self.query("SELECT DISTINCT url FROM wiki_pages WHERE url LIKE '%/%'"),
+                         [('plants/ferns',)])
+        self.assertIsNone(self.wiki.children('animals'))
+
+    def test_retag(self):
+        urls = select_pages(self.wiki, tag='big cats')
+        result = retag_pages(self.wiki, urls + ['missing'], 'alex', add=['felines'], remove=['big cats'])
+        self.assertEqual(result, (2, 1))
+        with open(self.wiki.path('animals/lions')) as f:
+            self.assertEqual(f.read(), 'title: animals/lions\ntags: africa, felines\n\nBody of [[animals/lions]].\n')
+        self.assertEqual(select_pages(self.wiki, tag='felines'), ['animals/cats/tigers', 'animals/lions'])
+        self.assertEqual(select_pages(self.wiki, tag='big cats'), [])
+        self.assertEqual(self.query("SELECT version, author, approved FROM wiki_pages WHERE url = 'animals/lions' "
+                                    "ORDER BY version DESC LIMIT 1"), [(3, 'alex', 1)])
+        self.assertIsNone(retag_page('title: A\ntags: a, b\n\nbody', ['a'], ['c']))
+
+    def test_failed_retag_keeps_files(self):
+        urls = select_pages(self.wiki, tag='big cats')
+        self.query('DROP TABLE wiki_pages')
+        with self.assertRaises(sqlite3.OperationalError):
+            retag_pages(self.wiki, urls, 'alex', add=['felines'])
+        with open(self.wiki.path('animals/lions')) as f:
+            self.assertIn('tags: big cats, africa\n', f.read())
+
+    def test_approve(self):
+        result = approve_pending(self.wiki, select_pages(self.wiki, tag='africa') + ['missing'])
+        self.assertEqual(result, (2, 1))
+        self.assertEqual(self.query('SELECT url FROM wiki_pages WHERE NOT approved ORDER BY url'),
+                         [('animals/cats/tigers',), ('plants/ferns',)])
+
+    def test_commands(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['pages', 'tag', '--prefix', 'plants', '--add', 'leafy', '--author', 'sam'])
+        self.assertIn('Retagged 1 pages, 0 were unchanged.', result.output)
+        result = runner.invoke(args=['pages', 'approve', '--url', 'plants/ferns'])
+        self.assertIn('Approved the edits of 1 pages', result.output)
+        result = runner.invoke(args=['pages', 'delete', '--tag', 'leafy', '--yes'])
+        self.assertIn('Deleted 1 pages, 0 were missing.', result.output)
+        self.assertFalse(self.wiki.exists('plants/ferns'))
+
+
+if __name__ == "__main__":
+    unittest.main()
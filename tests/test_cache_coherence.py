@@ -0,0 +1,183 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config
+from tests import WikiTestCase
+from tests import write_page
+from wiki.coherence import RESET, CacheCoherence, create_change_log
+from wiki.core import Wiki
+from wiki.signals import page_changed, pages_reset
+from wiki.web.search.Manifest import TitleManifest
+
+
+class TestCacheCoherence(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'wiki.db')
+        self.patcher = patch.object(config, 'DATABASE', self.database)
+        self.patcher.start()
+        self.conn = sqlite3.connect(self.database)
+        create_change_log(self.conn.cursor())
+        self.conn.commit()
+        self.root = tempfile.mkdtemp()
+        self.write_page('lions', 'Lions')
+        self.log = CacheCoherence.for_database(self.database)
+        self.log.sync()
+        self.received = []
+        page_changed.connect(self.receiver)
+
+    def tearDown(self):
+        page_changed.disconnect(self.receiver)
+        CacheCoherence._logs.pop(self.database, None)
+        TitleManifest._manifests.pop(os.path.abspath(self.root), None)
+        self.conn.close()
+        self.patcher.stop()
+        self.directory.cleanup()
+        shutil.rmtree(self.root)
+
+    def receiver(self, sender, url, event):
+        if sender is self.log:
+            self.received.append((event, url))
+
+    def write_page(self, url, title):
+        write_page(self.root, url, title, tags='test')
+
+    def other_worker(self, url, event='modified'):
+        self.conn.execute('INSERT INTO cache_changes (url, event, origin) VALUES (?, ?, ?)',
+                          (url, event, os.getpid() + 1))
+        self.conn.commit()
+
+    def test_own_changes_not_applied(self):
+        with patch('wiki.core.delete_from_db'):
+            Wiki(self.root).delete('lions')
+        self.assertEqual(self.conn.execute('SELECT url, event FROM cache_changes').fetchall(),
+                         [('lions', 'deleted')])
+        self.assertEqual(self.log.sync(), 0)
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.log.generation, 1)
+
+    def test_other_workers_changes(self):
+        self.other_worker('lions')
+        self.other_worker('zebras', 'created')
+        self.assertEqual(self.log.sync(), 2)
+        self.assertEqual(self.received, [('modified', 'lions'), ('created', 'zebras')])
+        self.assertEqual(self.log.sync(), 0)
+
+    def test_manifest_evicted(self):
+        manifest = TitleManifest.for_root(self.root)
+        self.assertEqual(manifest.title('lions'), 'Lions')
+        self.write_page('lions', 'Big Cats')
+        self.other_worker('lions')
+        self.log.sync()
+        self.assertEqual(manifest.title('lions'), 'Big Cats')
+
+    def test_locked_database(self):
+        blocker = sqlite3.connect(self.database)
+        blocker.execute('BEGIN IMMEDIATE')
+        with patch.object(CacheCoherence, 'TIMEOUT', 0.05):
+            log = CacheCoherence(self.database)
+            with self.assertLogs('wiki.coherence', 'ERROR'):
+                log.publish('lions', 'modified')
+            self.assertTrue(log.lost)
+            blocker.rollback()
+            blocker.close()
+            # the next request tells the other workers
+            log.sync()
+        self.assertFalse(log.lost)
+        self.assertEqual(self.conn.execute('SELECT url, event FROM cache_changes').fetchall(),
+                         [('', RESET)])
+
+    def test_batch_holds_no_lock(self):
+        with self.log.batch():
+            self.log.publish('lions', 'deleted')
+            with self.log.batch():
+                self.log.publish('big_cats', 'created')
+            # other writers are not kept waiting while receivers run
+            writer = sqlite3.connect(self.database, timeout=0)
+            writer.execute('BEGIN IMMEDIATE')
+            writer.rollback()
+            writer.close()
+            self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM cache_changes').fetchone()[0], 0)
+        self.assertEqual(self.conn.execute('SELECT url, event FROM cache_changes').fetchall(),
+                         [('lions', 'deleted'), ('big_cats', 'created')])
+
+    def test_no_change_log(self):
+        self.conn.execute('DROP TABLE cache_changes')
+        self.conn.commit()
+        CacheCoherence(self.database).publish('lions', 'modified')
+
+    def test_missed_changes_reset(self):
+        resets = []
+
+        def reset(sender):
+            resets.append(sender)
+
+        self.other_worker('lions')
+        self.other_worker('zebras')
+        self.conn.execute('DELETE FROM cache_changes WHERE generation = 1')
+        self.conn.commit()
+        pages_reset.connect(reset)
+        try:
+            self.assertEqual(self.log.sync(), 0)
+        finally:
+            pages_reset.disconnect(reset)
+        self.assertEqual(resets, [self.log])
+        self.assertEqual(self.log.generation, 2)
+
+    def test_lost_changes_reset(self):
+        resets = []
+
+        def reset(sender):
+            resets.append(sender)
+
+        self.other_worker('lions')
+        self.other_worker('', RESET)
+        self.other_worker('zebras')
+        pages_reset.connect(reset)
+        try:
+            self.assertEqual(self.log.sync(), 1)
+        finally:
+            pages_reset.disconnect(reset)
+        self.assertEqual(resets, [self.log])
+        self.assertEqual(self.log.generation, 3)
+
+
+class LockedConnection(object):
+
+    def execute(self, *args):
+        raise sqlite3.OperationalError('database is locked')
+
+    executemany = execute
+
+
+class TestLockedChangeLog(WikiTestCase):
+
+    settings = {'WTF_CSRF_ENABLED': False}
+
+    def tearDown(self):
+        CacheCoherence._logs.pop(self.database, None)
+        super().tearDown()
+
+    def test_save_survives(self):
+        self.write_page('a', 'A', 'old')
+        self.add_version('a', 1)
+        self.assertIn(b'old', self.client.get('/a/').data)
+        with patch.object(CacheCoherence, 'connection', return_value=LockedConnection()), \
+                self.assertLogs('wiki.coherence', 'ERROR'):
+            response = self.client.post('/edit/a/', data={'title': 'A', 'body': 'new', 'tags': ''})
+        self.assertEqual(response.status_code, 302)
+        # the receivers after the change log still evicted the page
+        self.assertIn(b'new', self.client.get('/a/').data)
+        conn = sqlite3.connect(self.database)
+        events = [event for event, in conn.execute('SELECT event FROM cache_changes')]
+        conn.close()
+        self.assertEqual(events, [RESET])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import gzip
+import unittest
+from unittest.mock import patch
+
+from tests import WikiTestCase
+
+
+class TestConditionalGet(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_page('lions', 'Lions', 'Lions hunt at night.', tags='test')
+        self.add_version('lions', 1)
+
+    def test_not_modified(self):
+        response = self.client.get('/lions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Lions hunt at night.', response.data)
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('Last-Modified', response.headers)
+        with patch('wiki.core.Processor') as processor:
+            response = self.client.get('/lions/', headers={'If-None-Match': etag})
+            self.assertFalse(processor.called)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_content_change(self):
+        etag = self.client.get('/lions/').headers['ETag']
+        self.write_page('lions', 'Lions', 'Lions sleep all day.', tags='test')
+        response = self.client.get('/lions/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Lions sleep all day.', response.data)
+
+    def test_pending_edit_changes_etag(self):
+        etag = self.client.get('/lions/').headers['ETag']
+        self.add_version('lions', 2, author='alex', approved=False)
+        response = self.client.get('/lions/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Pending Edit', response.data)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get('/lions/').headers['Last-Modified']
+        response = self.client.get('/lions/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_precompressed_and_cached(self):
+        # make the page big enough to be compressed
+        self.write_page('lions', 'Lions', 'Lions hunt at night. ' * 100, tags='test')
+        response = self.client.get('/lions/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertIn(b'Lions hunt at night.', gzip.decompress(response.data))
+        etag = response.headers['ETag']
+        with patch('wiki.core.Processor') as processor:
+            response = self.client.get('/lions/', headers={'Accept-Encoding': 'gzip'})
+            self.assertFalse(processor.called)
+            self.assertEqual(response.headers['ETag'], etag)
+            response = self.client.get('/lions/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tests import write_page
+from wiki.core import Wiki
+from wiki.signals import page_changed
+from wiki.watcher import ContentEvent, ContentWatcher
+
+
+class TestContentWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write_page('lions', 'Lions')
+        self.write_page('animals/zebras', 'Zebras')
+        self.watcher = ContentWatcher(self.root, interval=0.05, use_inotify=False)
+        self.watcher.scan()
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title, body='content'):
+        write_page(self.root, url, title, body, tags='test')
+        path = os.path.join(self.root, url + '.md')
+        # make sure the change is visible even on coarse file systems
+        later = time.time() + 5
+        os.utime(path, (later, later))
+
+    def test_no_changes(self):
+        self.assertEqual(self.watcher.scan(), [])
+
+    def test_events(self):
+        self.write_page('lions', 'Lions', body='changed')
+        self.write_page('animals/pandas', 'Pandas')
+        os.remove(os.path.join(self.root, 'animals', 'zebras.md'))
+        events = self.watcher.scan()
+        self.assertEqual(sorted(events), [ContentEvent('created', 'animals/pandas'),
+                                          ContentEvent('deleted', 'animals/zebras'),
+                                          ContentEvent('modified', 'lions')])
+
+    def test_directories(self):
+        self.write_page('birds/owls', 'Owls')
+        shutil.rmtree(os.path.join(self.root, 'animals'))
+        events = self.watcher.scan()
+        self.assertEqual(sorted(events), [ContentEvent('created', 'birds/owls'),
+                                          ContentEvent('deleted', 'animals/zebras')])
+
+    def test_signal(self):
+        received = []
+
+        def receiver(sender, url, event):
+            received.append((event, url))
+
+        page_changed.connect(receiver)
+        try:
+            self.write_page('pandas', 'Pandas')
+            self.watcher.scan()
+        finally:
+            page_changed.disconnect(receiver)
+        self.assertEqual(received, [('created', 'pandas')])
+
+    def test_own_changes_not_repeated(self):
+        page = Wiki(self.root).get('lions')
+        page.body = 'edited through the wiki'
+        page.save(save_db=False)
+        self.assertEqual(self.watcher.scan(), [])
+
+    def test_background(self):
+        for use_inotify in (False, True):
+            watcher = ContentWatcher(self.root, interval=0.05, use_inotify=use_inotify)
+            seen = threading.Event()
+
+            def receiver(sender, url, event):
+                if sender is watcher and url == 'birds/owls':
+                    seen.set()
+
+            page_changed.connect(receiver)
+            try:
+                watcher.start()
+                self.write_page('birds/owls', 'Owls')
+                self.assertTrue(seen.wait(5))
+            finally:
+                page_changed.disconnect(receiver)
+                watcher.stop()
+                shutil.rmtree(os.path.join(self.root, 'birds'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config
+from benchmarks.generator import create_benchmark_app, generate_wiki
+from tests import WikiTestCase
+from wiki.export import MANIFEST, export_site
+from wiki.signals import page_changed
+
+
+class TestExport(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.mkdtemp()
+        self.write_page('home', 'Home', 'Welcome, see [[lions|Lions]].', tags='big cats')
+        self.write_page('lions', 'Lions', 'Lions hunt at night.', tags='big cats, africa')
+        self.write_page('animals/zebras', 'Zebras', 'Zebras have stripes.', tags='africa')
+        for version, approved in ((1, True), (2, True), (3, False)):
+            self.add_version('lions', version, 'title: Lions\n\nLions, version %d.' % version, approved=approved)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.output)
+
+    def read(self, *path):
+        with open(os.path.join(self.output, *path), encoding='utf-8') as f:
+            return f.read()
+
+    def export(self, **kwargs):
+        with self.app.app_context():
+            return export_site(self.app, self.output, workers=1, **kwargs)
+
+    def test_export(self):
+        result = self.export(versions=True)
+        self.assertEqual(result, (5, 0, 0))
+        self.assertIn('Lions hunt at night.', self.read('lions', 'index.html'))
+        self.assertIn('Zebras have stripes.', self.read('animals', 'zebras', 'index.html'))
+        self.assertIn("href='/lions/'", self.read('index.html'))
+        # versions 1 and 2 are approved and older than the newest
+        self.assertIn('Lions, version 1.', self.read('display_version', 'lions', '1', 'index.html'))
+        self.assertIn('Lions, version 2.', self.read('display_version', 'lions', '2', 'index.html'))
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'display_version', 'lions', '3')))
+        lions = self.read('lions', 'index.html')
+        self.assertIn('href="/display_version/lions/2"', lions)
+        self.assertNotIn('/display_version/lions/3', lions)
+        self.assertIn('/animals/zebras/', self.read('index', 'index.html'))
+        self.assertIn('/lions/', self.read('tag', 'africa', 'index.html'))
+        self.assertIn('/tag/big%20cats/', self.read('tags', 'index.html'))
+        self.assertEqual(len(json.loads(self.read('search_manifest'))['pages']), 3)
+        asset = self.app.extensions['assets'].assets['bootstrap.css']
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'assets', asset.fingerprint, 'bootstrap.css')))
+
+    def test_incremental(self):
+        self.export()
+        self.assertEqual(self.export(), (0, 3, 0))
+        self.write_page('lions', 'Lions', 'Lions sleep all day.', tags='big cats')
+        os.remove(os.path.join(self.root, 'animals', 'zebras.md'))
+        self.assertEqual(self.export(), (1, 1, 1))
+        self.assertIn('Lions sleep all day.', self.read('lions', 'index.html'))
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'animals', 'zebras', 'index.html')))
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'tag', 'africa', 'index.html')))
+        self.assertEqual(self.export(force=True), (2, 0, 0))
+
+    def test_new_link_target_renders_versions(self):
+        conn = sqlite3.connect(self.database)
+        conn.execute('''UPDATE wiki_pages SET content = 'title: Lions\n\nSee [[cubs]].' WHERE version = 1''')
+        conn.commit()
+        conn.close()
+        self.export(versions=True)
+        self.assertIn("class='missing'", self.read('display_version', 'lions', '1', 'index.html'))
+        self.write_page('cubs', 'Cubs', 'Small lions.', tags='big cats')
+        page_changed.send(self, url='cubs', event='created')
+        # the new page and the version linking to it
+        self.assertEqual(self.export(versions=True), (2, 4, 0))
+        self.assertNotIn("class='missing'", self.read('display_version', 'lions', '1', 'index.html'))
+
+    def test_no_version_links_without_versions(self):
+        self.export()
+        self.assertNotIn('/display_version/', self.read('lions', 'index.html'))
+        # exporting the versions links them from the pages
+        self.assertEqual(self.export(versions=True), (3, 2, 0))
+
+    def test_process_pool(self):
+        with patch('wiki.export.BATCH', 1), self.app.app_context():
+            result = export_site(self.app, self.output, workers=2)
+        self.assertEqual(result, (3, 0, 0))
+        self.assertIn('Lions hunt at night.', self.read('lions', 'index.html'))
+
+    def test_command(self):
+        result = self.app.test_cli_runner().invoke(args=['export', self.output, '--workers', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Rendered 3, kept 0 and removed 0 pages.', result.output)
+        self.assertTrue(os.path.exists(os.path.join(self.output, MANIFEST)))
+
+
+class TestExportDefaultAttachments(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.patcher = patch.object(config, 'DATABASE', config.DATABASE)
+        self.patcher.start()
+        # the config.py of a generated wiki sets no ATTACHMENT_DIR
+        self.wiki = generate_wiki(os.path.join(self.directory.name, 'wiki'), pages=5, page_size=50, users=1,
+                                  history_depth=1)
+        self.app = create_benchmark_app(self.wiki)
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def test_export(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = self.wiki.users[0]
+        response = client.post('/attachments/', data={'file': (io.BytesIO(b'notes'), 'notes.txt')},
+                               content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 302)
+        stored = os.path.join(self.wiki.root, 'attachments', 'objects')
+        self.assertTrue(os.path.isdir(stored))
+        output = os.path.join(self.directory.name, 'site')
+        with self.app.app_context():
+            result = export_site(self.app, output, workers=1)
+        self.assertEqual(result.rendered, 5)
+        self.assertEqual(len(os.listdir(os.path.join(output, 'attachments'))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
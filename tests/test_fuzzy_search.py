@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from wiki.web.search.DropdownSearch import SuggestionSearch
+from wiki.web.search.FuzzyMatcher import FuzzyMatcher, bounded_levenshtein
+from wiki.web.search.Popularity import PopularityTable
+
+
+class FakePage:
+    def __init__(self, title):
+        self.title = title
+
+
+class TestFuzzySearch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'history.db')
+        self.conn = sqlite3.connect(self.database)
+        self.conn.execute('''CREATE TABLE user_history (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                url TEXT NOT NULL,
+                                date_last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                count_accessed INTEGER NOT NULL,
+                                user TEXT NOT NULL
+            )''')
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.directory.cleanup()
+
+    def insert_data(self, url, count, user='name'):
+        self.conn.execute('''INSERT INTO user_history (url, date_last_accessed, count_accessed, user)
+                            VALUES (?, ?, ?, ?)''', (url, datetime.now(), count, user))
+        self.conn.commit()
+
+    def test_bounded_levenshtein(self):
+        self.assertEqual(bounded_levenshtein('pnda', 'panda', 2), 1)
+        self.assertEqual(bounded_levenshtein('kitten', 'sitting', 3), 3)
+        self.assertEqual(bounded_levenshtein('kitten', 'sitting', 1), 2)
+        self.assertEqual(bounded_levenshtein('same', 'same', 0), 0)
+
+    def test_typo_matches(self):
+        matcher = FuzzyMatcher(['panda', 'apple', 'Testing'])
+        self.assertEqual(matcher.match('pnda'), ['panda'])
+        self.assertEqual(matcher.match('tesitng'), ['Testing'])
+
+    def test_substring_matches(self):
+        matcher = FuzzyMatcher(['Testing', 'Test Page', 'apple'])
+        self.assertEqual(matcher.match('stin'), ['Testing'])
+        self.assertEqual(matcher.match('test pa'), ['Test Page'])
+        self.assertEqual(matcher.match('xyz'), [])
+
+    def test_quality_ranking(self):
+        matcher = FuzzyMatcher(['Contest', 'Testing', 'Test'])
+        self.assertEqual(matcher.match('test'), ['Test', 'Testing', 'Contest'])
+
+    def test_popularity_ranking(self):
+        self.insert_data('Test Beta', 50)
+        self.insert_data('Test Beta', 20, user='sam')
+        self.insert_data('Test Alpha', 1)
+        popularity = PopularityTable(self.database, refresh=300)
+        search = SuggestionSearch([FakePage('Test Alpha'), FakePage('Test Beta')], popularity)
+        self.assertEqual(search.render('test'), ['Test Beta', 'Test Alpha'])
+
+    def test_popularity_refresh(self):
+        popularity = PopularityTable(self.database, refresh=300)
+        self.assertEqual(popularity.get('panda'), 0)
+        self.insert_data('panda', 3)
+        # cached until the refresh interval has passed
+        self.assertEqual(popularity.get('panda'), 0)
+        popularity.refresh()
+        self.assertEqual(popularity.get('Panda'), 1)
+
+    def test_limit(self):
+        search = SuggestionSearch([FakePage('page %d' % i) for i in range(20)], limit=5)
+        self.assertEqual(len(search.search('page')), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
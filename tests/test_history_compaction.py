@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import config
+from wiki.history import HistoryCompactor, claim_compaction, compact_history, create_compaction_table, \
+    create_history_indexes
+
+
+class TestHistoryCompaction(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'wiki.db')
+        self.conn = sqlite3.connect(self.database)
+        self.conn.execute('''CREATE TABLE wiki_pages (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                url TEXT NOT NULL,
+                                version INTEGER,
+                                content TEXT NOT NULL,
+                                date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                author TEXT NOT NULL,
+                                approved BOOLEAN DEFAULT FALSE
+                                    )''')
+        self.conn.execute('''CREATE TABLE user_history (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                url TEXT NOT NULL,
+                                date_last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                count_accessed INTEGER NOT NULL,
+                                user TEXT NOT NULL
+                                    )''')
+        create_history_indexes(self.conn.cursor())
+        create_compaction_table(self.conn.cursor())
+        self.conn.commit()
+        self.now = datetime(2026, 6, 1)
+        self.titles = {'lions': 'Lions', 'zebras': 'Zebras'}
+
+    def tearDown(self):
+        self.conn.close()
+        self.directory.cleanup()
+
+    def add_history(self, title, user='sam', count=1, days_ago=0):
+        self.conn.execute('''INSERT INTO user_history (url, date_last_accessed, count_accessed, user)
+                                VALUES (?, ?, ?, ?)''', (title, self.now - timedelta(days=days_ago), count, user))
+        self.conn.commit()
+
+    def add_version(self, url, title):
+        self.conn.execute('''INSERT INTO wiki_pages (url, version, content, author)
+                                VALUES (?, 1, ?, 'sam')''', (url, 'title: %s\ntags: test\n\nbody' % title))
+        self.conn.commit()
+
+    def history(self):
+        return self.conn.execute('''SELECT user, url, count_accessed FROM user_history
+                                    ORDER BY user, url''').fetchall()
+
+    def compact(self, **kwargs):
+        kwargs.setdefault('retention_days', 30)
+        kwargs.setdefault('keep', 100)
+        return compact_history(self.database, self.titles, now=self.now, **kwargs)
+
+    def test_expire(self):
+        self.add_history('Lions', days_ago=1)
+        self.add_history('Zebras', days_ago=60)
+        result = self.compact()
+        self.assertEqual(result.expired, 1)
+        self.assertEqual(self.history(), [('sam', 'Lions', 1)])
+
+    def test_merge_renamed(self):
+        # lions was called Big Cats before
+        self.add_version('lions', 'Big Cats')
+        self.add_history('Big Cats', count=2)
+        self.add_history('Lions', count=3)
+        result = self.compact()
+        self.assertEqual(result.merged, 1)
+        self.assertEqual(self.history(), [('sam', 'Lions', 5)])
+
+    def test_drop_deleted(self):
+        self.add_history('Gone')
+        self.add_history('Zebras', user='alex')
+        result = self.compact()
+        self.assertEqual(result.dropped, 1)
+        self.assertEqual(self.history(), [('alex', 'Zebras', 1)])
+
+    def test_trim_small_batches(self):
+        self.titles = {'p%d' % i: 'P%d' % i for i in range(5)}
+        for i in range(5):
+            self.add_history('P%d' % i, days_ago=i)
+        self.add_history('P4', user='alex')
+        result = self.compact(keep=2, batch=1)
+        self.assertEqual(result.trimmed, 3)
+        self.assertEqual(self.history(), [('alex', 'P4', 1), ('sam', 'P0', 1), ('sam', 'P1', 1)])
+
+    def test_titles_resolved_before_writing(self):
+        self.add_version('lions', 'Big Cats')
+        self.add_history('Big Cats')
+        self.add_history('Gone')
+        resolved = []
+
+        def resolve(conn, title, titles):
+            self.assertFalse(conn.in_transaction)
+            resolved.append(title)
+            return 'Lions' if title == 'Big Cats' else None
+
+        with patch('wiki.history.resolve_title', side_effect=resolve):
+            result = self.compact()
+        self.assertEqual(sorted(resolved), ['Big Cats', 'Gone'])
+        self.assertEqual(result.dropped, 1)
+        self.assertEqual(self.history(), [('sam', 'Lions', 1)])
+
+    def test_claim(self):
+        self.assertFalse(claim_compaction(self.database, 60, now=1000))
+        self.assertFalse(claim_compaction(self.database, 60, now=1030))
+        self.assertTrue(claim_compaction(self.database, 60, now=1060))
+        self.assertFalse(claim_compaction(self.database, 60, now=1061))
+
+    def test_one_worker_compacts(self):
+        self.add_history('Gone')
+        claim_compaction(self.database, 60, now=0)
+        # two processes, each with a compactor of its own
+        workers = [HistoryCompactor(self.database), HistoryCompactor(self.database)]
+        with patch.object(config, 'HISTORY_COMPACT_INTERVAL', 60):
+            results = [worker.run(lambda: self.titles) for worker in workers]
+        self.assertEqual(results[0].dropped, 1)
+        self.assertIsNone(results[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
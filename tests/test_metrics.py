@@ -0,0 +1,78 @@
+import os
+import unittest
+
+from tests import WikiTestCase
+from wiki import create_app
+from wiki import metrics
+from wiki.core import Processor
+
+
+class TestMetricTypes(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1))
+        histogram.observe(0.05, route='a "b"')
+        histogram.observe(0.5, route='a "b"')
+        histogram.observe(3, route='a "b"')
+        self.assertEqual(histogram.render(), [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{route="a \\"b\\"",le="0.1"} 1',
+            'latency_seconds_bucket{route="a \\"b\\"",le="1"} 2',
+            'latency_seconds_bucket{route="a \\"b\\"",le="+Inf"} 3',
+            'latency_seconds_sum{route="a \\"b\\""} 3.55',
+            'latency_seconds_count{route="a \\"b\\""} 3',
+        ])
+
+    def test_counter(self):
+        counter = metrics.Counter('queries_total', 'Queries.')
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(counter.render()[-1], 'queries_total 3')
+
+
+class TestMetricsEndpoint(WikiTestCase):
+
+    settings = {'METRICS_ENABLED': True}
+
+    def setUp(self):
+        super().setUp()
+        self.write_page('lions', 'Lions', 'Lions hunt at night.', tags='test')
+        self.add_version('lions', 1)
+        metrics.init_app(self.app)
+        metrics.registry.clear()
+
+    def tearDown(self):
+        metrics.registry.enabled = False
+        metrics.registry.clear()
+        super().tearDown()
+
+    def test_request_metrics(self):
+        self.client.get('/lions/')
+        etag = self.client.get('/lions/').headers['ETag']
+        self.client.get('/lions/', headers={'If-None-Match': etag})
+        self.assertEqual(metrics.REQUEST_DURATION.count(endpoint='wiki.display', method='GET'), 3)
+        self.assertEqual(metrics.RENDER_STAGE_DURATION.count(stage='markdown'), 1)
+        self.assertEqual(metrics.REQUEST_QUERIES.count(endpoint='wiki.display'), 3)
+        self.assertGreater(metrics.QUERIES.get(), 0)
+        self.assertEqual(metrics.CACHE_REQUESTS.get(cache='page', result='hit'), 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.get(cache='conditional', result='hit'), 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('riki_request_duration_seconds_count{endpoint="wiki.display",method="GET"} 3', text)
+        self.assertIn('riki_render_stage_duration_seconds_count{stage="post"} 1', text)
+        self.assertIn('riki_cache_hit_ratio{cache="page"} 0.5', text)
+
+    def test_disabled(self):
+        metrics.registry.enabled = False
+        Processor('title: Lions\n\nLions hunt at night.').process()
+        self.assertEqual(metrics.RENDER_STAGE_DURATION.values, {})
+        app = create_app(os.path.dirname(os.getcwd()))
+        self.assertNotIn('metrics', app.view_functions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from tests import WikiTestCase
+from wiki.core import Wiki
+from wiki.rollups import record_view
+
+URLS = ('animals', 'animals/lions', 'animals/cats/tigers', 'animals2/owls', 'animalsfarm')
+
+
+class TestMoveTree(WikiTestCase):
+
+    settings = {'WTF_CSRF_ENABLED': False}
+
+    def setUp(self):
+        super().setUp()
+        for url in URLS:
+            self.write_page(url, url)
+            for version in (1, 2):
+                self.add_version(url, version)
+        conn = sqlite3.connect(self.database)
+        for url in URLS:
+            conn.execute('''INSERT INTO user_history (url, date_last_accessed, count_accessed, user)
+                            VALUES (?, ?, ?, ?)''', (url, datetime.now(), 1, 'sam'))
+        conn.commit()
+        conn.close()
+        for url in URLS:
+            record_view(url, 'sam')
+        self.wiki = Wiki(self.root)
+
+    def urls(self, table):
+        conn = sqlite3.connect(self.database)
+        urls = sorted(set(row[0] for row in conn.execute('SELECT url FROM %s' % table)) - {'home', 'testing'})
+        conn.close()
+        return urls
+
+    def test_move_tree(self):
+        self.wiki.children()
+        moved = self.wiki.move_tree('animals', 'zoo/animals')
+        self.assertEqual(sorted(moved), ['zoo/animals', 'zoo/animals/cats/tigers', 'zoo/animals/lions'])
+        expected = ['animals2/owls', 'animalsfarm', 'zoo/animals', 'zoo/animals/cats/tigers', 'zoo/animals/lions']
+        for table in ('wiki_pages', 'user_history', 'page_views_total', 'user_page_views', 'page_views_daily'):
+            self.assertEqual(self.urls(table), expected, table)
+        self.assertTrue(self.wiki.exists('zoo/animals/cats/tigers'))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'animals')))
+        self.assertEqual([entry.url for entry in self.wiki.children('zoo')], ['zoo/animals'])
+        self.assertEqual(self.wiki.children('zoo')[0].count, 2)
+        self.assertIsNone(self.wiki.children('animals'))
+
+    def test_rollback(self):
+        rename = os.rename
+
+        def fail_on_folder(source, target):
+            if os.path.isdir(source):
+                raise OSError('disk full')
+            rename(source, target)
+
+        with patch('os.rename', side_effect=fail_on_folder), self.assertRaises(OSError):
+            self.wiki.move_tree('animals', 'zoo')
+        self.assertTrue(self.wiki.exists('animals'))
+        self.assertTrue(self.wiki.exists('animals/lions'))
+        self.assertFalse(self.wiki.exists('zoo'))
+        self.assertEqual(self.urls('wiki_pages'), sorted(URLS))
+        self.assertEqual(self.urls('page_views_total'), sorted(URLS))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.wiki.move_tree('animals', 'animals/cats/animals')
+        with self.assertRaises(ValueError):
+            self.wiki.move_tree('fungi', 'zoo')
+        with self.assertRaises(FileExistsError):
+            self.wiki.move_tree('animals', 'animalsfarm')
+        with self.assertRaises(RuntimeError):
+            self.wiki.move_tree('animals', '../animals')
+        self.assertEqual(self.urls('wiki_pages'), sorted(URLS))
+
+    def test_invalid_move_form(self):
+        os.makedirs(os.path.join(self.root, 'zoo'))
+        for newurl, message in (('animals/old', b'Cannot move'), ('zoo', b'&#34;zoo&#34; exists already.')):
+            response = self.client.post('/move/animals/', data={'url': newurl, 'subpages': 'y'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(message, response.data)
+        self.assertEqual(self.urls('wiki_pages'), sorted(URLS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import WikiTestCase
+from tests import write_page
+from wiki.core import Wiki
+from wiki.records import PageIndex
+from wiki.signals import page_changed
+
+
+class TestNamespaces(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for url in ('home', 'animals', 'animals/lions', 'animals/cats/tigers', 'animals/cats/lynx',
+                    'plants/ferns'):
+            self.write_page(url, url.split('/')[-1].title())
+        self.wiki = Wiki(self.root)
+
+    def tearDown(self):
+        PageIndex._indexes.pop((PageIndex, os.path.abspath(self.root)), None)
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title):
+        write_page(self.root, url, title)
+
+    def listing(self, prefix=''):
+        return [(entry.url, entry.page is not None, entry.count) for entry in self.wiki.children(prefix)]
+
+    def test_children(self):
+        self.assertEqual(self.listing(), [('animals', True, 3), ('home', True, 0), ('plants', False, 1)])
+        self.assertEqual(self.listing('animals'), [('animals/cats', False, 2), ('animals/lions', True, 0)])
+        self.assertEqual(self.listing('/animals/cats/'), [('animals/cats/lynx', True, 0),
+                                                          ('animals/cats/tigers', True, 0)])
+        self.assertIsNone(self.wiki.children('fungi'))
+        self.assertIsNone(self.wiki.children('animals/lions'))
+        self.assertEqual(PageIndex.for_root(self.root).namespace('').count, 6)
+
+    def test_tree(self):
+        tree = self.wiki.tree('animals', depth=2)
+        self.assertEqual([(entry.name, children) for entry, children in tree if not entry.count],
+                         [('lions', None)])
+        cats = tree[0][1]
+        self.assertEqual([entry.name for entry, _ in cats], ['lynx', 'tigers'])
+        self.assertIsNone(self.wiki.tree('animals')[0][1])
+        self.assertIsNone(self.wiki.tree('fungi'))
+
+    def test_counts_kept_up_to_date(self):
+        self.wiki.children()
+        self.wiki.move('plants/ferns', 'animals/cats/ferns')
+        self.wiki.delete('animals/lions')
+        self.write_page('animals/birds/owls', 'Owls')
+        page_changed.send(self, url='animals/birds/owls', event='created')
+        self.assertEqual(self.listing(), [('animals', True, 4), ('home', True, 0)])
+        self.assertEqual(self.listing('animals'), [('animals/birds', False, 1), ('animals/cats', False, 3)])
+        self.wiki.delete('animals/birds/owls')
+        self.assertIsNone(self.wiki.children('animals/birds'))
+
+
+class TestBrowse(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_page('animals/lions', 'Lions')
+        self.write_page('animals/cats/tigers', 'Tigers')
+
+    def test_browse(self):
+        response = self.client.get('/browse/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'href="/browse/animals/">animals/</a>', response.data)
+        response = self.client.get('/browse/animals/')
+        self.assertIn(b'href="/browse/animals/cats/">cats/</a>', response.data)
+        self.assertIn(b'href="/animals/lions/">Lions</a>', response.data)
+        self.assertEqual(self.client.get('/browse/fungi/').status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
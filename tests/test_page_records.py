@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import write_page
+from wiki import create_app
+from wiki.core import Page, Wiki
+from wiki.records import PageIndex, PageRecord, split_tags
+from wiki.signals import page_changed
+
+
+class TestPageRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write_page('lions', 'Lions', 'big cats, africa')
+        self.write_page('zebras', 'Zebras', 'africa, africa')
+        self.write_page('cats/tigers', 'Tigers', 'big cats, asia')
+        self.write_page('untitled', '', '')
+        self.wiki = Wiki(self.root)
+
+    def tearDown(self):
+        PageIndex._indexes.pop((PageIndex, os.path.abspath(self.root)), None)
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title, tags, body='content'):
+        write_page(self.root, url, title, body, tags)
+
+    def test_index(self):
+        records = self.wiki.index()
+        self.assertEqual([record.url for record in records], ['lions', 'cats/tigers', 'untitled', 'zebras'])
+        self.assertIsInstance(records[0], PageRecord)
+        self.assertFalse(hasattr(records[0], '__dict__'))
+        self.assertEqual(records[0].tags, 'big cats, africa')
+        self.assertEqual(records[2].title, 'untitled')
+
+    def test_tags_shared(self):
+        lions, tigers, _, zebras = self.wiki.index()
+        self.assertEqual(zebras.tag_names, ('africa',))
+        self.assertIs(lions.tag_names[1], zebras.tag_names[0])
+        self.assertEqual(lions.tag_ids[0], tigers.tag_ids[0])
+        self.assertEqual(split_tags(' a, b,,a '), ['a', 'b'])
+
+    def test_tags(self):
+        tags = self.wiki.get_tags()
+        self.assertEqual(sorted(tags), ['africa', 'asia', 'big cats'])
+        self.assertEqual([record.url for record in tags['big cats']], ['lions', 'cats/tigers'])
+        self.assertEqual([record.url for record in self.wiki.index_by_tag('africa')], ['lions', 'zebras'])
+        # tags match whole, not as part of other tags
+        self.assertEqual(self.wiki.index_by_tag('cats'), [])
+        self.assertEqual(self.wiki.index_by_tag('unknown'), [])
+
+    def test_kept_up_to_date(self):
+        self.wiki.index()
+        self.wiki.move('zebras', 'africa/zebras')
+        self.wiki.delete('lions')
+        self.write_page('hippos', 'Hippos', 'africa')
+        page_changed.send(self, url='hippos', event='created')
+        self.assertEqual([record.url for record in self.wiki.index_by_tag('africa')],
+                         ['hippos', 'africa/zebras'])
+
+    def test_promote(self):
+        app = create_app(os.path.dirname(os.getcwd()))
+        record = PageIndex.for_root(self.root).get('lions')
+        with app.test_request_context():
+            page = record.promote(self.wiki)
+        self.assertIsInstance(page, Page)
+        self.assertIn('content', page.html)
+        self.wiki.delete('lions')
+        self.assertIsNone(record.promote(self.wiki))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config
+from wiki.core import Wiki
+from wiki.rollups import DAY, HOUR, PopularPages, create_rollup_tables, move_views, prune_rollups, record_view, \
+    top_pages, user_top_pages
+
+
+class TestPopularityRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'wiki.db')
+        self.patcher = patch.object(config, 'DATABASE', self.database)
+        self.patcher.start()
+        self.conn = sqlite3.connect(self.database)
+        self.cursor = self.conn.cursor()
+        create_rollup_tables(self.cursor)
+        self.conn.commit()
+        self.now = 1000 * DAY
+
+    def tearDown(self):
+        PopularPages._rankings.pop(self.database, None)
+        self.cursor.close()
+        self.conn.close()
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def views(self, url, count, user='sam', ago=0):
+        for _ in range(count):
+            record_view(url, user, now=self.now - ago)
+
+    def test_windows(self):
+        self.views('home', 2)
+        self.views('lions', 3, ago=2 * HOUR)
+        self.views('zebras', 4, ago=3 * DAY)
+        self.assertEqual(top_pages(self.cursor, 'hour', 10, self.now), [('home', 2)])
+        self.assertEqual(top_pages(self.cursor, 'day', 10, self.now), [('lions', 3), ('home', 2)])
+        self.assertEqual(top_pages(self.cursor, 'week', 10, self.now), [('zebras', 4), ('lions', 3), ('home', 2)])
+        self.assertEqual(top_pages(self.cursor, 'all', 1, self.now), [('zebras', 4)])
+
+    def test_user_top_pages(self):
+        self.views('home', 1, user='sam')
+        self.views('lions', 2, user='sam')
+        self.views('home', 5, user='alex')
+        self.assertEqual(user_top_pages('sam'), [('lions', 2), ('home', 1)])
+        self.assertEqual(user_top_pages('alex', limit=1), [('home', 5)])
+
+    def test_prune(self):
+        self.views('old', 1, ago=60 * DAY)
+        self.views('home', 1)
+        self.cursor.execute('SELECT url FROM page_views_hourly')
+        self.assertEqual(self.cursor.fetchall(), [('home',)])
+        self.assertEqual(top_pages(self.cursor, 'all', 10, self.now), [('home', 1), ('old', 1)])
+
+    def test_prune_trims_users(self):
+        self.views('home', 3, user='sam')
+        self.views('lions', 2, user='sam')
+        self.views('zebras', 1, user='sam')
+        self.views('home', 1, user='alex')
+        with patch.object(config, 'USER_VIEWS_KEEP', 2):
+            prune_rollups(self.cursor, self.now)
+        self.conn.commit()
+        self.assertEqual(user_top_pages('sam'), [('home', 3), ('lions', 2)])
+        self.assertEqual(user_top_pages('alex'), [('home', 1)])
+
+    def test_move_merges_views(self):
+        self.views('lions', 2)
+        self.views('cats/lions', 1)
+        move_views('lions', 'cats/lions')
+        self.assertEqual(top_pages(self.cursor, 'all', 10, self.now), [('cats/lions', 3)])
+        self.assertEqual(user_top_pages('sam'), [('cats/lions', 3)])
+
+    def test_wiki_popular(self):
+        with tempfile.TemporaryDirectory() as root:
+            for url in ('home', 'lions'):
+                with open(os.path.join(root, url + '.md'), 'w') as f:
+                    f.write('title: %s\n\ncontent' % url)
+            for url, count in (('gone', 5), ('lions', 3), ('home', 1)):
+                for _ in range(count):
+                    record_view(url, 'sam')
+            popular = Wiki(root).popular('day', limit=1)
+            self.assertEqual([page.url for page in popular], ['lions'])
+            with self.assertRaises(ValueError):
+                Wiki(root).popular('decade')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from tests import WikiTestCase
+from wiki.queries import QueryBudgetExceeded, record_queries, statement_shape
+
+
+class TestQueryRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'wiki.db')
+        conn = sqlite3.connect(self.database)
+        conn.execute('CREATE TABLE pages (url TEXT, version INTEGER)')
+        conn.executemany('INSERT INTO pages VALUES (?, ?)', [('lions', 1), ('lions', 2), ('zebras', 1)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_shape(self):
+        self.assertEqual(statement_shape("SELECT *\n  FROM pages WHERE url = 'it''s' AND version = 12"),
+                         'SELECT * FROM pages WHERE url = ? AND version = ?')
+
+    def test_records_statements(self):
+        with record_queries() as queries:
+            conn = sqlite3.connect(self.database)
+            conn.execute('SELECT * FROM pages WHERE url = ?', ('lions',)).fetchall()
+            conn.execute('UPDATE pages SET version = 3 WHERE url = ?', ('zebras',))
+            conn.commit()
+            conn.close()
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(queries.connections, 1)
+        queries.check(max_queries=2, max_connections=1)
+        with self.assertRaises(QueryBudgetExceeded):
+            queries.check(max_queries=1)
+
+    def test_repeated_statements(self):
+        with record_queries() as queries:
+            conn = sqlite3.connect(self.database)
+            for version in (1, 2):
+                conn.execute('SELECT url FROM pages WHERE version = ?', (version,)).fetchall()
+            conn.close()
+        self.assertEqual(queries.repeated(), {'SELECT url FROM pages WHERE version = ?': 2})
+        with self.assertRaises(QueryBudgetExceeded):
+            queries.check()
+        queries.check(allow_repeated=True)
+
+    def test_other_threads_ignored(self):
+        with record_queries() as queries:
+            thread = threading.Thread(target=lambda: sqlite3.connect(self.database).execute('SELECT 1'))
+            thread.start()
+            thread.join()
+        self.assertEqual((len(queries), queries.connections), (0, 0))
+
+
+class TestRouteQueryBudgets(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_page('lions', 'Lions', 'Lions hunt at night.', tags='test')
+        for version in range(1, 6):
+            self.add_version('lions', version, 'title: Lions\n\nVersion %d' % version)
+        # the first request of a worker sets up its caches
+        self.client.get('/lions/')
+
+    def test_display(self):
+        with record_queries() as queries:
+            self.assertEqual(self.client.get('/lions/').status_code, 200)
+        # the revision, and the user history with the view rollups
+        queries.check(max_queries=6, max_connections=2)
+
+    def test_display_version(self):
+        with record_queries() as queries:
+            response = self.client.get('/display_version/lions/2')
+        self.assertIn(b'Version 2', response.data)
+        queries.check(max_queries=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
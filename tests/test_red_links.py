@@ -0,0 +1,80 @@
+import os
+import unittest
+
+from tests import WikiTestCase
+from wiki.core import link_targets
+from wiki.core import wikilink
+from wiki.signals import page_changed
+from wiki.web.cache import PageCache
+
+
+def formatter(endpoint, url):
+    return '/%s/' % url
+
+
+class TestWikilinks(unittest.TestCase):
+
+    def test_missing_links_are_marked(self):
+        html = wikilink('<p>[[lions]] and [[tigers|Tigers]]</p>', formatter, lambda url: url == 'lions')
+        self.assertEqual(html, "<p><a href='/lions/'>lions</a> and "
+                               "<a href='/tigers/' class='missing'>Tigers</a></p>")
+
+    def test_link_targets(self):
+        self.assertEqual(link_targets('[[tigers|Tigers]], [[lions]] and [[lions]] again'), ['lions', 'tigers'])
+
+
+class TestLinkDependencies(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PageCache(10)
+
+    def test_evict_linking(self):
+        self.cache.put('lions', 'a', {}, ['tigers'])
+        self.cache.put('cats', 'b', {}, ['tigers', 'lynx'])
+        self.cache.put('home', 'c', {}, ['cats'])
+        self.cache.evict_linking('tigers')
+        self.assertEqual(list(self.cache.entries), [('home', 'c')])
+        self.assertEqual(self.cache.linked_from, {'cats': {'home'}})
+
+    def test_only_created_and_deleted_pages_evict_links(self):
+        self.cache.put('lions', 'a', {}, ['tigers'])
+        page_changed.send(self, url='tigers', event='modified')
+        self.assertIn(('lions', 'a'), self.cache.entries)
+        page_changed.send(self, url='tigers', event='created')
+        self.assertNotIn(('lions', 'a'), self.cache.entries)
+
+    def test_links_of_dropped_pages_are_forgotten(self):
+        cache = PageCache(1)
+        cache.put('lions', 'a', {}, ['tigers'])
+        cache.put('cats', 'b', {}, [])
+        self.assertEqual(cache.linked_from, {})
+
+
+class TestRedLinks(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_page('lions', 'Lions', 'Lions chase [[tigers|Tigers]].')
+
+    def test_created_page_turns_link_blue(self):
+        response = self.client.get('/lions/')
+        self.assertIn(b"<a href='/tigers/' class='missing'>Tigers</a>", response.data)
+        etag = response.headers['ETag']
+        self.write_page('tigers', 'Tigers', 'Tigers swim.')
+        page_changed.send(self, url='tigers', event='created')
+        response = self.client.get('/lions/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"<a href='/tigers/'>Tigers</a>", response.data)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_deleted_page_turns_link_red(self):
+        self.write_page('tigers', 'Tigers', 'Tigers swim.')
+        page_changed.send(self, url='tigers', event='created')
+        self.assertNotIn(b"class='missing'", self.client.get('/lions/').data)
+        os.remove(os.path.join(self.root, 'tigers.md'))
+        page_changed.send(self, url='tigers', event='deleted')
+        self.assertIn(b"class='missing'", self.client.get('/lions/').data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import write_page
+from wiki import create_app
+from wiki.core import Wiki
+from wiki.web.search.Manifest import TitleManifest
+
+
+class TestSearchManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write_page('panda', 'Panda')
+        self.write_page('apple', 'Apple')
+        self.manifest = TitleManifest.for_root(self.root)
+
+    def tearDown(self):
+        TitleManifest._manifests.pop(os.path.abspath(self.root), None)
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title, body='content'):
+        write_page(self.root, url, title, body, tags='test')
+
+    def test_entries(self):
+        entries = self.manifest.entries()
+        self.assertEqual([entry.title for entry in entries], ['Apple', 'Panda'])
+        self.assertEqual(entries[0].url, 'apple')
+
+    def test_version_ignores_edits(self):
+        _, version = self.manifest.serialize()
+        self.write_page('panda', 'Panda', body='new content')
+        self.manifest.update('panda')
+        self.assertEqual(self.manifest.serialize()[1], version)
+
+    def test_version_changes_on_delete(self):
+        _, version = self.manifest.serialize()
+        Wiki(self.root).delete('panda')
+        body, new_version = self.manifest.serialize()
+        self.assertNotEqual(new_version, version)
+        self.assertNotIn('Panda', body)
+
+    def test_version_changes_on_move(self):
+        _, version = self.manifest.serialize()
+        Wiki(self.root).move('panda', 'bears/panda')
+        body, new_version = self.manifest.serialize()
+        self.assertNotEqual(new_version, version)
+        self.assertIn('"bears/panda"', body)
+
+    def test_matcher_kept_until_titles_change(self):
+        matcher = self.manifest.matcher()
+        self.assertEqual(matcher.match('pnda'), ['Panda'])
+        self.write_page('panda', 'Panda', body='new content')
+        self.manifest.update('panda')
+        self.assertIs(self.manifest.matcher(), matcher)
+        self.write_page('panda', 'Giant Panda')
+        self.manifest.update('panda')
+        self.assertIsNot(self.manifest.matcher(), matcher)
+        self.assertEqual(self.manifest.matcher().match('pnda'), ['Giant Panda'])
+
+    def test_not_modified(self):
+        app = create_app(os.path.dirname(os.getcwd()))
+        app.config['PRIVATE'] = False
+        client = app.test_client()
+        response = client.get('/search_manifest')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"version"', response.get_data(as_text=True))
+        etag = response.headers['ETag']
+        response = client.get('/search_manifest', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
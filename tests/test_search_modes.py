@@ -0,0 +1,103 @@
+import os
+import re
+import shutil
+import tempfile
+import time
+import unittest
+
+from tests import write_page
+from wiki import create_app
+from wiki.core import Wiki
+from wiki.search import RegexSearch, RootIndex
+
+
+class TestSearchModes(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write_page('zebra', 'Zebra', 'stripes', 'A zebra has black and white stripes.')
+        self.write_page('lion', 'Lion', 'cats', 'Lions hunt the Zebra at night.')
+        self.write_page('stripes', 'Stripes', 'patterns', 'Nothing about animals.')
+        self.wiki = Wiki(self.root)
+
+    def tearDown(self):
+        RootIndex._indexes.clear()
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title, tags, body):
+        write_page(self.root, url, title, body, tags)
+
+    def test_literal_field_order(self):
+        results = self.wiki.search('stripes', mode='literal')
+        self.assertEqual([hit.url for hit in results], ['stripes', 'zebra'])
+        self.assertEqual(results.total, 2)
+
+    def test_literal_case(self):
+        self.assertEqual(self.wiki.search('the zebra', mode='literal').total, 1)
+        self.assertEqual(self.wiki.search('the zebra', mode='literal', ignore_case=False).total, 0)
+        self.assertEqual(self.wiki.search('the Zebra', mode='literal', ignore_case=False).total, 1)
+
+    def test_literal_not_across_fields(self):
+        self.assertEqual(self.wiki.search('Zebra stripes', mode='literal').total, 0)
+
+    def test_literal_paging(self):
+        first = self.wiki.search('a', mode='literal', offset=0, limit=2)
+        second = self.wiki.search('a', mode='literal', offset=2, limit=2)
+        self.assertEqual(len(first), 2)
+        self.assertTrue(first.has_next)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(second.has_next)
+
+    def test_literal_update(self):
+        self.assertEqual(self.wiki.search('giraffe', mode='literal').total, 0)
+        self.write_page('giraffe', 'Giraffe', 'tall', 'Long neck.')
+        RootIndex._indexes.clear()
+        self.assertEqual(self.wiki.search('neck', mode='literal')[0].url, 'giraffe')
+
+    def test_regex(self):
+        results = self.wiki.search(r'black\s+and', mode='regex')
+        self.assertEqual([hit.url for hit in results], ['zebra'])
+        self.assertFalse(results.partial)
+        self.assertIn('<strong>black and</strong>', results[0].snippet)
+
+    def test_invalid_regex(self):
+        with self.assertRaises(re.error):
+            self.wiki.search('(unclosed', mode='regex')
+
+    def test_regex_budget(self):
+        self.write_page('slow', 'Slow', '', 'a' * 40 + 'b')
+        started = time.monotonic()
+        search = RegexSearch(self.root, r'(a+)+c', budget=0.5)
+        results = search.search()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(results.partial)
+        self.assertIsNone(results.total)
+
+    def test_stream(self):
+        search = self.wiki.search_stream('zebra')
+        self.assertEqual(sorted(hit.url for hit in search.stream()), ['lion', 'zebra'])
+        self.assertFalse(search.partial)
+        self.assertFalse(search.more)
+
+    def test_stream_limit(self):
+        search = self.wiki.search_stream('e')
+        self.assertEqual(len(list(search.stream(limit=2))), 2)
+        self.assertTrue(search.more)
+
+    def test_stream_route(self):
+        app = create_app(os.path.dirname(os.getcwd()))
+        app.config['PRIVATE'] = False
+        app.config['WTF_CSRF_ENABLED'] = False
+        client = app.test_client()
+        response = client.get('/search/?term=t.st&mode=regex')
+        # streamed responses are sent without knowing their length
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<ul class="unstyled">', response.data)
+        response = client.get('/search/?term=(unclosed&mode=regex')
+        self.assertIn('Content-Length', response.headers)
+        self.assertIn(b'Invalid regular expression', response.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import write_page
+from wiki.core import Wiki
+from wiki.search import SearchIndex, make_snippet, terms_pattern
+
+
+class TestSearchRanking(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write_page('zebra', 'Zebra', 'stripes', 'A zebra has stripes. Lions hunt them.')
+        self.write_page('lion', 'Lion', 'cats', 'Lions are big cats. They sometimes hunt a zebra.')
+        self.write_page('notes', 'Notes', 'misc', 'Nothing to see here.')
+        self.wiki = Wiki(self.root)
+
+    def tearDown(self):
+        SearchIndex._indexes.pop(os.path.abspath(self.root), None)
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, title, tags, body):
+        write_page(self.root, url, title, body, tags)
+
+    def test_title_boost(self):
+        results = self.wiki.search_ranked('zebra')
+        self.assertEqual([hit.url for hit in results], ['zebra', 'lion'])
+        self.assertEqual(results.total, 2)
+
+    def test_no_match(self):
+        results = self.wiki.search_ranked('giraffe')
+        self.assertEqual(results.total, 0)
+        self.assertEqual(len(results), 0)
+
+    def test_paging(self):
+        for i in range(5):
+            self.write_page('page%d' % i, 'Page %d' % i, '', 'common word ' * (i + 1))
+        SearchIndex.for_root(self.root).load()
+        first = self.wiki.search_ranked('common', offset=0, limit=2)
+        second = self.wiki.search_ranked('common', offset=2, limit=2)
+        last = self.wiki.search_ranked('common', offset=4, limit=2)
+        urls = [hit.url for hit in first] + [hit.url for hit in second] + [hit.url for hit in last]
+        self.assertEqual(len(set(urls)), 5)
+        self.assertTrue(first.has_next)
+        self.assertFalse(first.has_prev)
+        self.assertFalse(last.has_next)
+
+    def test_snippet(self):
+        hit = self.wiki.search_ranked('stripes')[0]
+        self.assertIn('<strong>stripes</strong>', hit.snippet)
+
+    def test_snippet_escapes_markup(self):
+        snippet = make_snippet('<script>alert(1)</script> zebra', terms_pattern(['zebra']))
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('<strong>zebra</strong>', snippet)
+
+    def test_incremental_update(self):
+        self.assertEqual(self.wiki.search_ranked('giraffe').total, 0)
+        self.write_page('giraffe', 'Giraffe', 'tall', 'Long neck.')
+        SearchIndex.for_root(self.root).update('giraffe')
+        self.assertEqual(self.wiki.search_ranked('giraffe')[0].url, 'giraffe')
+        os.remove(os.path.join(self.root, 'giraffe.md'))
+        SearchIndex.for_root(self.root).update('giraffe')
+        self.assertEqual(self.wiki.search_ranked('giraffe').total, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from wiki.core import Page, render_content
+from wiki.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, result='html'):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_concurrently(self, function, callers=4, timeout=None):
+        results = []
+
+        def call():
+            try:
+                results.append(self.flight.do('lions', function, timeout))
+            except Exception as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        threads[0].start()
+        while self.flight.waiting('lions') is None:
+            time.sleep(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        while self.flight.waiting('lions') < callers - 1:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_shared_result(self):
+        self.assertEqual(self.run_concurrently(self.slow), ['html'] * 4)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(self.flight.waiting('lions'))
+        self.assertEqual(self.flight.do('lions', lambda: 'again'), 'again')
+
+    def test_shared_error(self):
+        error = ValueError('broken page')
+        results = self.run_concurrently(lambda: self.slow(error))
+        self.assertEqual(results, [error] * 4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.do('lions', lambda: 'fixed'), 'fixed')
+
+    def test_timeout(self):
+        leader = threading.Thread(target=self.flight.do, args=('lions', self.slow))
+        leader.start()
+        while self.flight.waiting('lions') is None:
+            time.sleep(0.001)
+        with self.assertRaises(TimeoutError):
+            self.flight.do('lions', self.slow, timeout=0.01)
+        # other keys are not held up
+        self.assertEqual(self.flight.do('zebras', lambda: 'stripes'), 'stripes')
+        self.release.set()
+        leader.join()
+        self.assertEqual(self.calls, 1)
+
+
+class TestRenderContent(unittest.TestCase):
+
+    def test_page_render(self):
+        page = Page(None, 'lions', new=True)
+        page.load_content('title: Lions\n\nLions hunt at night.')
+        page.render()
+        self.assertIn('Lions hunt at night.', page.html)
+        page.meta['title'] = 'Tigers'
+        self.assertEqual(render_content('lions', page.content)[2]['title'], 'Lions')
+
+    def test_timeout_renders(self):
+        with patch('wiki.core._renders.do', side_effect=TimeoutError):
+            html = render_content('lions', 'title: Lions\n\nLions hunt at night.')[0]
+        self.assertIn('Lions hunt at night.', html)
+
+
+if __name__ == "__main__":
+    unittest.main()
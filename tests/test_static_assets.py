@@ -0,0 +1,71 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask, url_for
+
+from wiki.web.assets import StaticAssets
+
+
+class TestStaticAssets(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.write('site.css', 'body { color: black; }\n' * 100)
+        self.write('tiny.js', 'var a = 1;')
+        self.app = Flask(__name__)
+        self.assets = StaticAssets(self.folder)
+        self.assets.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        with open(os.path.join(self.folder, name), 'w') as f:
+            f.write(content)
+
+    def url(self, filename):
+        with self.app.test_request_context():
+            return url_for('asset', filename=filename)
+
+    def test_fingerprinted_url(self):
+        url = self.url('site.css')
+        self.assertRegex(url, r'^/assets/[0-9a-f]{12}/site\.css$')
+        self.write('site.css', 'body { color: red; }')
+        self.assertNotEqual(StaticAssets(self.folder).assets['site.css'].fingerprint,
+                            self.assets.assets['site.css'].fingerprint)
+
+    def test_immutable(self):
+        response = self.client.get(self.url('site.css'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(response.cache_control.max_age, StaticAssets.MAX_AGE)
+
+    def test_outdated_url(self):
+        response = self.client.get('/assets/000000000000/site.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.cache_control.no_cache)
+        self.assertIsNone(response.cache_control.max_age)
+
+    def test_precompressed(self):
+        response = self.client.get(self.url('site.css'), headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), b'body { color: black; }\n' * 100)
+        response = self.client.get(self.url('site.css'))
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_small_files_not_compressed(self):
+        response = self.client.get(self.url('tiny.js'), headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, b'var a = 1;')
+
+    def test_missing(self):
+        self.assertEqual(self.client.get('/assets/x/missing.css').status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
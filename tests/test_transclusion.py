@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config
+from tests import WikiTestCase
+from tests import write_page
+from wiki import create_app
+from wiki.core import Page
+from wiki.core import Processor
+from wiki.core import included_pages
+from wiki.fragments import FragmentCache
+from wiki.fragments import fragments
+from wiki.records import PageIndex
+from wiki.signals import page_changed
+
+
+class TestFragmentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FragmentCache(10)
+
+    def test_evicts_includers(self):
+        self.cache.put('oncall', 'a', '<p>oncall</p>')
+        self.cache.put('header', 'b', '<p>header</p>', includes=['oncall'])
+        self.cache.put('runbook', 'c', '<p>runbook</p>', includes=['header'])
+        self.cache.put('footer', 'd', '<p>footer</p>')
+        self.cache.evict('oncall')
+        self.assertEqual(list(self.cache.entries), [('footer', 'd')])
+
+    def test_evicts_linking_only_if_asked(self):
+        self.cache.put('header', 'a', '<p>header</p>', links=['lions'])
+        self.cache.evict('lions')
+        self.assertEqual(self.cache.get('header', 'a'), '<p>header</p>')
+        self.cache.evict('lions', linking=True)
+        self.assertIsNone(self.cache.get('header', 'a'))
+
+    def test_new_content_replaces_fragment(self):
+        self.cache.put('header', 'a', '<p>old</p>')
+        self.cache.put('header', 'b', '<p>new</p>')
+        self.assertEqual(list(self.cache.entries), [('header', 'b')])
+
+
+class TestTransclusion(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.app = create_app(os.path.dirname(os.getcwd()))
+        self.app.config.update(CONTENT_DIR=self.root)
+        self.context = self.app.test_request_context()
+        self.context.push()
+        fragments.clear()
+
+    def tearDown(self):
+        self.context.pop()
+        fragments.clear()
+        PageIndex._indexes.pop((PageIndex, os.path.abspath(self.root)), None)
+        shutil.rmtree(self.root)
+
+    def write_page(self, url, body):
+        write_page(self.root, url, url, body)
+
+    def render(self, url):
+        with open(os.path.join(self.root, url + '.md')) as f:
+            page = Page(None, url, new=True)
+            page.load_content(f.read())
+        page.render()
+        return page.html
+
+    def test_includes_rendered_body(self):
+        self.write_page('header', 'Call **ops** first.')
+        self.write_page('runbook', '{{include:header}}\n\nRestart the server.')
+        html = self.render('runbook')
+        self.assertIn('<div class="include">\n<p>Call <strong>ops</strong> first.</p>\n</div>', html)
+        self.assertIn('<p>Restart the server.</p>', html)
+
+    def test_fragments_rendered_once(self):
+        self.write_page('header', 'Call ops first.')
+        self.write_page('runbook', '\n\n'.join(['{{include:header}}'] * 20))
+        self.render('runbook')
+        with patch.object(Processor, 'process', autospec=True, side_effect=Processor.process) as process:
+            self.assertEqual(self.render('runbook').count('Call ops first.'), 20)
+        self.assertEqual(process.call_count, 1)
+
+    def test_changed_fragment_evicts_includers(self):
+        self.write_page('oncall', 'Sam is on call.')
+        self.write_page('header', '{{include:oncall}}')
+        self.write_page('runbook', '{{include:header}}')
+        self.render('runbook')
+        self.write_page('oncall', 'Kim is on call.')
+        page_changed.send(self, url='oncall', event='modified')
+        self.assertIn('Kim is on call.', self.render('runbook'))
+
+    def test_cycles_and_depth(self):
+        self.write_page('a', '{{include:b}}')
+        self.write_page('b', '{{include:a}}')
+        self.assertIn('Cannot include a: it includes itself', self.render('a'))
+        for level in range(config.INCLUDE_DEPTH + 2):
+            self.write_page('level%d' % level, '{{include:level%d}}' % (level + 1))
+        self.assertIn('includes are nested too deeply', self.render('level0'))
+        html, _, _ = Processor('title: x\n\n{{include:missing}}').process()
+        self.assertIn('Cannot include missing: there is no such page', html)
+
+    def test_code_blocks_not_included(self):
+        self.write_page('header', 'Call ops first.')
+        self.write_page('docs', 'Write\n\n```\n{{include:header}}\n```\n\n    {{include:header}}\n\n'
+                                '~~~~\n```\n{{include:header}}\n~~~~\n\n{{include:header}}')
+        html = self.render('docs')
+        self.assertEqual(html.count('Call ops first.'), 1)
+        self.assertEqual(html.count('<div class="codehilite">'), 3)
+        self.assertEqual(list(included_pages('```\n{{include:header}}\n```')), [])
+
+    def test_included_pages(self):
+        self.write_page('oncall', 'Sam is on call.')
+        self.write_page('header', '{{include:oncall}}\n\n{{include:header}}')
+        self.assertEqual(list(included_pages('{{include:header}}\n{{include:missing}}')), ['header', 'oncall'])
+        self.assertEqual(included_pages('{{include:../outside}}'), {})
+
+
+class TestIncludingPageDisplay(WikiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_page('header', 'header', 'Sam is on call.')
+        self.write_page('runbook', 'runbook', '{{include:header}}')
+
+    def test_edited_fragment_changes_includers(self):
+        response = self.client.get('/runbook/')
+        self.assertIn(b'Sam is on call.', response.data)
+        etag = response.headers['ETag']
+        cache = self.app.extensions['page_cache']
+        self.assertEqual(cache.included_from, {'header': {'runbook'}})
+        self.write_page('header', 'header', 'Kim is on call.')
+        page_changed.send(self, url='header', event='modified')
+        self.assertEqual(cache.entries, {})
+        response = self.client.get('/runbook/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Kim is on call.', response.data)
+
+    def test_edited_fragment_is_newer(self):
+        last_modified = self.client.get('/runbook/').headers['Last-Modified']
+        path = os.path.join(self.root, 'header.md')
+        os.utime(path, (os.path.getmtime(path) + 60,) * 2)
+        response = self.client.get('/runbook/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['Last-Modified'], last_modified)
+
+
+if __name__ == '__main__':
+    unittest.main()
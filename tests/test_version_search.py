@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+import config
+from wiki.core import create_version_index, delete_from_db, search_versions
+
+
+class TestVersionSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'wiki.db')
+        self.patcher = patch.object(config, 'DATABASE', self.database)
+        self.patcher.start()
+        self.conn = sqlite3.connect(self.database)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS wiki_pages (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                url TEXT NOT NULL,
+                                version INTEGER,
+                                content TEXT NOT NULL,
+                                date_created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                author TEXT NOT NULL,
+                                approved BOOLEAN DEFAULT FALSE
+                                    )''')
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+        self.patcher.stop()
+        self.directory.cleanup()
+
+    def insert_data(self, url, version, content, author='author'):
+        self.cursor.execute('''INSERT INTO wiki_pages (url, version, content, date_created, author, approved)
+                                    VALUES (?, ?, ?, ?, ?, ?)''', (url, version, content, datetime.now(), author, True))
+        self.conn.commit()
+
+    def test_existing_versions_indexed(self):
+        self.insert_data('runbook', 1, 'restart the primary database')
+        create_version_index(self.cursor)
+        self.conn.commit()
+        hits, total = search_versions('primary database')
+        self.assertEqual(total, 1)
+        self.assertEqual((hits[0].url, hits[0].version, hits[0].author), ('runbook', 1, 'author'))
+        self.assertIn('<strong>primary database</strong>', hits[0].snippet)
+
+    def test_incremental_insert_and_delete(self):
+        create_version_index(self.cursor)
+        self.insert_data('runbook', 1, 'restart the primary database')
+        self.insert_data('runbook', 2, 'restart the replica', author='sam')
+        self.insert_data('runbook', 3, 'restart the primary database again')
+        hits, total = search_versions('primary database')
+        self.assertEqual([hit.version for hit in hits], [1, 3])
+
+        delete_from_db('runbook', version_num=3, version=True)
+        hits, total = search_versions('primary database')
+        self.assertEqual([hit.version for hit in hits], [1])
+
+    def test_phrase_and_url_filter(self):
+        create_version_index(self.cursor)
+        self.insert_data('a', 1, 'database primary')
+        self.insert_data('b', 1, 'primary database')
+        self.insert_data('c', 1, 'the primary database')
+        self.assertEqual(search_versions('primary database')[1], 2)
+        hits, total = search_versions('primary database', url='c')
+        self.assertEqual([hit.url for hit in hits], ['c'])
+
+    def test_paging(self):
+        create_version_index(self.cursor)
+        for version in range(1, 6):
+            self.insert_data('page', version, 'common phrase %d' % version)
+        hits, total = search_versions('common phrase', offset=2, limit=2)
+        self.assertEqual(total, 5)
+        self.assertEqual([hit.version for hit in hits], [3, 4])
+
+    def test_snippet_escaped(self):
+        create_version_index(self.cursor)
+        self.insert_data('page', 1, '<script>alert(1)</script> needle')
+        hits, _ = search_versions('needle')
+        self.assertNotIn('<script>', hits[0].snippet)
+
+
+if __name__ == "__main__":
+    unittest.main()
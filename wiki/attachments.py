@@ -0,0 +1,295 @@
+"""
+    Attachments
+    ~~~~~~~~~~~
+
+    Files uploaded to the wiki, e.g. images, stored under the sha256 hash
+    of their content: a file uploaded twice, under any name, is stored
+    once. Files are spread over two levels of directories named after the
+    start of their hash, so no directory grows too big. A stored file never
+    changes, so it is served under a url containing its hash that clients
+    may cache forever. Pages embed attachments by name with ``![[name]]``,
+    the attachments table maps the names to the hashes; uploading a file
+    under a taken name points the name at the new file.
+
+    Images get smaller variants for ``![[name|width]]``, made in the
+    background by a pool of threads if Pillow is installed. Until a
+    variant is made the original is sent in its place.
+"""
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+import config
+from wiki.core import EMBED_RE
+from wiki.core import connect_to_db
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#: the bytes read and written at once
+CHUNK = 64 * 1024
+
+Attachment = namedtuple('Attachment', ['name', 'digest', 'size', 'mimetype', 'date_uploaded', 'author'])
+
+
+def create_attachment_table(cursor):
+    """
+        Creates the table of the attachment names if it does not exist yet.
+
+        :param cursor: cursor of the wiki database
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS attachments (
+                        name TEXT PRIMARY KEY,
+                        digest TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        mimetype TEXT NOT NULL,
+                        date_uploaded TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        author TEXT NOT NULL
+    )''')
+
+
+def attachment_name(name):
+    """
+        Cleans the name of an attachment, the same way for uploads and
+        embeds, so it is safe as the last part of a url and a file name.
+
+        :param str name: the name of the uploaded file or of the embed
+    """
+    return secure_filename(name)
+
+
+def guess_mimetype(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def is_image(mimetype):
+    return mimetype.startswith('image/')
+
+
+def variant_width(width):
+    """
+        Returns the width of the smallest variant at least as wide as
+        asked for, the widest one if none is.
+
+        :param int width: the width an image is shown at
+    """
+    widths = sorted(config.THUMBNAIL_WIDTHS)
+    return next((variant for variant in widths if variant >= width), widths[-1])
+
+
+def attachment_dir(settings):
+    """
+        Returns the directory of the attachments of an app, a relative
+        ATTACHMENT_DIR is taken to be inside the content directory.
+
+        :param settings: the config of the app
+    """
+    return os.path.join(settings['CONTENT_DIR'], settings['ATTACHMENT_DIR'])
+
+
+class AttachmentStore(object):
+    """
+        The stored files and their variants in a directory.
+
+        :param str root: the directory of the attachments
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:4], digest)
+
+    def variant_path(self, digest, width):
+        return os.path.join(self.root, 'variants', digest[:2], digest[2:4], '%s-%d' % (digest, width))
+
+    def store(self, stream, limit=None):
+        """
+            Stores the content of a stream, read in chunks, unless the same
+            content is stored already.
+
+            :param stream: a binary file like object
+            :param int limit: the maximum number of bytes
+
+            :raises ValueError: if the stream holds more than limit bytes
+
+            :returns: the hash and the size of the content
+            :rtype: tuple
+        """
+        folder = os.path.join(self.root, 'tmp')
+        os.makedirs(folder, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=folder)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(descriptor, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK), b''):
+                    size += len(chunk)
+                    if limit is not None and size > limit:
+                        raise ValueError('The file is larger than %d bytes.' % limit)
+                    digest.update(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            path = self.path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return digest, size
+
+
+def save_attachment(name, digest, size, mimetype, author):
+    """
+        Points the name of an attachment at a stored file.
+
+        :param str name: the cleaned name, see :func:`attachment_name`
+        :param str digest: the hash of the stored file
+        :param int size: the number of bytes of the file
+        :param str mimetype: the mimetype of the file
+        :param str author: the name of the uploading user
+    """
+    conn, cursor = connect_to_db()
+    try:
+        cursor.execute('''INSERT INTO attachments (name, digest, size, mimetype, author)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT (name) DO UPDATE SET
+                                digest = excluded.digest, size = excluded.size, mimetype = excluded.mimetype,
+                                date_uploaded = CURRENT_TIMESTAMP, author = excluded.author''',
+                       (name, digest, size, mimetype, author))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def find_attachments(names=None):
+    """
+        Returns the attachments of some names, or all of them.
+
+        :param names: the cleaned names, every attachment if None
+
+        :returns: the attachments by name, in the order of their names
+        :rtype: dict
+    """
+    query = 'SELECT name, digest, size, mimetype, date_uploaded, author FROM attachments'
+    names = None if names is None else sorted(names)
+    if names is not None:
+        query += ' WHERE name IN (%s)' % ', '.join('?' * len(names))
+    conn, cursor = connect_to_db()
+    try:
+        rows = cursor.execute(query + ' ORDER BY name', names or ()).fetchall()
+    except sqlite3.OperationalError:
+        # the database has no attachments yet
+        rows = []
+    finally:
+        conn.close()
+    return {row[0]: Attachment(*row) for row in rows}
+
+
+def embedded_names(text):
+    """
+        Returns the cleaned names of the attachments text embeds.
+    """
+    return set(attachment_name(match.group(1)) for match in EMBED_RE.finditer(text))
+
+
+def attachment_digests(text):
+    """
+        Returns what the attachments raw content embeds currently are, to
+        tell whether a page shows other files without rendering it. The
+        database is only asked if there are embeds.
+
+        :param str text: the raw content of a page
+
+        :returns: the names and hashes of the embedded attachments
+        :rtype: list
+    """
+    names = embedded_names(text)
+    if not names:
+        return []
+    return [(name, attachment.digest) for name, attachment in find_attachments(names).items()]
+
+
+def make_variant(source, target, width):
+    """
+        Writes a copy of an image at most width pixels wide, atomically.
+    """
+    with Image.open(source) as image:
+        image.thumbnail((width, image.height))
+        temporary = target + '.tmp'
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        image.save(temporary, format=image.format)
+    os.replace(temporary, target)
+
+
+class Thumbnailer(object):
+    """
+        Makes the variants of images in the background, in a pool of
+        threads started for the first image. Variants that cannot be made,
+        e.g. of broken images, are not tried again.
+
+        :param int workers: the number of threads
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pending = set()
+        self.failed = set()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def submit(self, store, digest, width):
+        """
+            Makes a variant of a stored image unless it exists or is being
+            made already.
+
+            :param AttachmentStore store: the store of the image
+            :param str digest: the hash of the image
+            :param int width: one of THUMBNAIL_WIDTHS
+
+            :returns: the future of the variant, None if there is nothing
+                to do
+        """
+        target = store.variant_path(digest, width)
+        if Image is None or os.path.exists(target):
+            return None
+        with self._lock:
+            if target in self.pending or target in self.failed:
+                return None
+            self.pending.add(target)
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='thumbnails')
+            future = self._pool.submit(make_variant, store.path(digest), target, width)
+        future.add_done_callback(lambda done: self.finished(target, done))
+        return future
+
+    def finished(self, target, future):
+        with self._lock:
+            self.pending.discard(target)
+            if future.exception() is not None:
+                self.failed.add(target)
+
+    def variant(self, store, digest, width):
+        """
+            Returns the path of a variant of a stored image, None if it is
+            not made yet, it is then made in the background.
+        """
+        path = store.variant_path(digest, width)
+        if os.path.exists(path):
+            return path
+        self.submit(store, digest, width)
+        return None
+
+
+#: the variant pool of this process
+thumbnails = Thumbnailer(config.THUMBNAIL_WORKERS)
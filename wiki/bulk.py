@@ -0,0 +1,217 @@
+"""
+    Bulk operations
+    ~~~~~~~~~~~~~~~
+
+    Deletes, retags and approves many pages at once, e.g. every page of a
+    tag or a namespace. Pages are handled in batches of :data:`BATCH`,
+    each in one transaction, and only page headers are rewritten, no page
+    is rendered. The caches learn about every changed page as usual, the
+    change log for the other workers is written once per batch.
+"""
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import config
+from wiki.coherence import CacheCoherence
+from wiki.core import connect_to_db
+from wiki.core import split_meta
+from wiki.records import PageIndex
+from wiki.records import split_tags
+from wiki.signals import page_changed
+
+#: the number of pages changed per transaction
+BATCH = 500
+
+BulkResult = namedtuple('BulkResult', ['changed', 'skipped'])
+
+
+def select_pages(wiki, urls=(), tag=None, prefix=None):
+    """
+        Selects the existing pages matching any of the criteria.
+
+        :param wiki: the :class:`~wiki.core.Wiki` of the pages
+        :param urls: explicit urls of pages
+        :param str tag: selects the pages having this tag
+        :param str prefix: selects the page of this url and every page
+            below it, never the whole wiki
+
+        :returns: the selected urls, sorted
+        :rtype: list
+    """
+    index = PageIndex.for_root(wiki.root)
+    selected = set(url for url in urls if index.get(url) is not None)
+    if tag:
+        selected.update(record.url for record in index.tagged(tag))
+    if prefix and prefix.strip('/'):
+        selected.update(index.below(prefix))
+    return sorted(selected)
+
+
+def batches(urls):
+    for start in range(0, len(urls), BATCH):
+        yield urls[start:start + BATCH]
+
+
+def announce(wiki, urls, event):
+    with CacheCoherence.for_database(config.DATABASE).batch():
+        for url in urls:
+            page_changed.send(wiki, url=url, event=event)
+
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def write_page_file(path, content):
+    """
+        Replaces a page file atomically.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temporary, path)
+
+
+def delete_pages(wiki, urls, progress=None):
+    """
+        Deletes pages along with all their versions.
+
+        :param wiki: the :class:`~wiki.core.Wiki` of the pages
+        :param list urls: the urls of the pages
+        :param progress: called with the number of handled pages and the
+            number of pages after every batch
+
+        :returns: the number of deleted pages and of pages that did not
+            exist
+        :rtype: BulkResult
+    """
+    deleted = skipped = done = 0
+    for batch in batches(urls):
+        removed = []
+        conn, cursor = connect_to_db()
+        try:
+            for url in batch:
+                try:
+                    os.remove(wiki.path(url))
+                except FileNotFoundError:
+                    skipped += 1
+                    continue
+                removed.append(url)
+        finally:
+            # the versions of every removed file go, even if one failed
+            cursor.execute('DELETE FROM wiki_pages WHERE url IN (%s)' % placeholders(removed), removed)
+            conn.commit()
+            conn.close()
+            announce(wiki, removed, 'deleted')
+        deleted += len(removed)
+        done += len(batch)
+        if progress:
+            progress(done, len(urls))
+    return BulkResult(deleted, skipped)
+
+
+def retag_page(content, add, remove):
+    """
+        Returns the content of a page with tags added and removed, the
+        body is left as it is, or None if the tags do not change.
+    """
+    meta, body = split_meta(content)
+    tags = split_tags(meta.get('tags', ''))
+    retagged = [tag for tag in tags if tag not in remove]
+    retagged.extend(tag for tag in add if tag not in retagged)
+    if retagged == tags:
+        return None
+    meta['tags'] = ', '.join(retagged)
+    header = ''.join('%s: %s\n' % (key, value) for key, value in meta.items())
+    return header + '\n' + body
+
+
+def retag_pages(wiki, urls, author, add=(), remove=(), progress=None):
+    """
+        Adds and removes tags of pages. Every changed page gets a new
+        approved version by the author, like an edit of its author. The
+        versions of a batch are committed before its files are rewritten,
+        so a failed commit leaves every file as it was. A batch is not
+        atomic otherwise: a file that cannot be written keeps its old
+        content though its new version is recorded.
+
+        :param wiki: the :class:`~wiki.core.Wiki` of the pages
+        :param list urls: the urls of the pages
+        :param str author: the name of the user retagging the pages
+        :param add: the tags to add
+        :param remove: the tags to remove
+        :param progress: called with the number of handled pages and the
+            number of pages after every batch
+
+        :returns: the number of changed pages and of pages left as they
+            were or missing
+        :rtype: BulkResult
+    """
+    changed = done = 0
+    for batch in batches(urls):
+        retagged = []
+        for url in batch:
+            try:
+                with open(wiki.path(url), 'r', encoding='utf-8') as f:
+                    content = retag_page(f.read(), add, remove)
+            except FileNotFoundError:
+                continue
+            if content is not None:
+                retagged.append((url, content))
+        conn, cursor = connect_to_db()
+        try:
+            last = dict(cursor.execute('''SELECT url, MAX(version) FROM wiki_pages
+                                          WHERE url IN (%s) GROUP BY url''' % placeholders(batch), batch))
+            cursor.executemany('''INSERT INTO wiki_pages (url, version, content, date_created, author, approved)
+                                  VALUES (?, ?, ?, ?, ?, ?)''',
+                               [(url, (last.get(url) or 0) + 1, content, datetime.now(), author, True)
+                                for url, content in retagged])
+            conn.commit()
+        finally:
+            conn.close()
+        written = []
+        try:
+            for url, content in retagged:
+                write_page_file(wiki.path(url), content)
+                written.append(url)
+        finally:
+            announce(wiki, written, 'modified')
+        changed += len(written)
+        done += len(batch)
+        if progress:
+            progress(done, len(urls))
+    return BulkResult(changed, len(urls) - changed)
+
+
+def approve_pending(wiki, urls, progress=None):
+    """
+        Approves every pending edit of pages.
+
+        :param wiki: the :class:`~wiki.core.Wiki` of the pages
+        :param list urls: the urls of the pages
+        :param progress: called with the number of handled pages and the
+            number of pages after every batch
+
+        :returns: the number of pages with approved edits and of pages
+            without pending edits
+        :rtype: BulkResult
+    """
+    approved = done = 0
+    for batch in batches(urls):
+        conn, cursor = connect_to_db()
+        try:
+            pending = [row[0] for row in cursor.execute('''SELECT DISTINCT url FROM wiki_pages
+                                                          WHERE NOT approved AND url IN (%s)'''
+                                                       % placeholders(batch), batch)]
+            cursor.execute('UPDATE wiki_pages SET approved = ? WHERE NOT approved AND url IN (%s)'
+                           % placeholders(pending), [True] + pending)
+            conn.commit()
+        finally:
+            conn.close()
+        announce(wiki, pending, 'modified')
+        approved += len(pending)
+        done += len(batch)
+        if progress:
+            progress(done, len(urls))
+    return BulkResult(approved, len(urls) - approved)
@@ -0,0 +1,243 @@
+"""
+    Cache coherence
+    ~~~~~~~~~~~~~~~
+
+    Keeps the in-process caches of several worker processes in step.
+    Every page change made through the wiki is appended to the
+    cache_changes table of the shared database, whose ever increasing
+    generation numbers tell each worker which changes it has not seen yet.
+    At the start of a request a worker compares the latest generation with
+    the last one it has seen, a single indexed lookup, and only if they
+    differ reads the new changes and sends
+    :data:`~wiki.signals.page_changed` for the pages other workers changed,
+    so exactly those are evicted from its caches.
+
+    Changes the watcher finds on disk are not written to the log, as the
+    watcher of every worker finds them itself. A change that cannot be
+    logged, e.g. as the database stays locked, is logged as an error but
+    does not fail the request that made it, which is saved already.
+    Instead the next change this process logs is preceded by a reset
+    marker, on which the other workers reset all their pages.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import config
+from wiki.signals import page_changed
+from wiki.signals import pages_reset
+from wiki.watcher import ContentWatcher
+
+logger = logging.getLogger(__name__)
+
+#: the event of the marker telling the other workers to reset all pages
+RESET = 'reset'
+
+
+def create_change_log(cursor):
+    """
+        Creates the table logging page changes for the other workers.
+
+        :param cursor: cursor of the wiki database
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS cache_changes (
+                        generation INTEGER PRIMARY KEY AUTOINCREMENT,
+                        url TEXT NOT NULL,
+                        event TEXT NOT NULL,
+                        origin INTEGER NOT NULL
+    )''')
+
+
+class CacheCoherence(object):
+    """
+        The change log of a database, as seen by the current process.
+
+        :param str database: the path of the wiki database
+    """
+
+    _logs = {}
+    _logs_lock = threading.Lock()
+
+    #: publishing every this many changes trims the log
+    TRIM_EVERY = 1000
+
+    #: seconds a statement waits for a locked database
+    TIMEOUT = 5.0
+
+    #: how often a change is tried to be logged while the database is locked
+    PUBLISH_ATTEMPTS = 3
+
+    @classmethod
+    def for_database(cls, database):
+        """
+            Returns the shared change log of a database, so every process
+            only reads each change once.
+
+            :param str database: the path of the wiki database
+        """
+        with cls._logs_lock:
+            log = cls._logs.get(database)
+            if log is None:
+                log = cls._logs[database] = cls(database)
+            return log
+
+    def __init__(self, database):
+        self.database = database
+        #: the last generation whose change this process has applied
+        self.generation = None
+        #: whether changes of this process could not be logged, so the
+        #: other workers are owed a reset
+        self.lost = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """
+            Returns a connection of the current thread, connections are
+            kept between requests but never shared with forked workers.
+        """
+        pid, conn = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            conn = sqlite3.connect(self.database, timeout=self.TIMEOUT, isolation_level=None)
+            self._local.connection = (os.getpid(), conn)
+        return conn
+
+    def latest(self):
+        return self.connection().execute('SELECT MAX(generation) FROM cache_changes').fetchone()[0] or 0
+
+    def publish(self, url, event):
+        """
+            Logs a change of a page for the other workers, at the end of
+            the batch if the current thread is in one.
+
+            :param str url: the url of the changed page
+            :param str event: ``'created'``, ``'modified'`` or ``'deleted'``
+        """
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append((url, event))
+        else:
+            self.publish_many([(url, event)])
+
+    def publish_many(self, changes):
+        """
+            Logs changes of pages in a single short transaction, after a
+            reset marker if earlier changes were lost. While the database
+            is locked they are tried PUBLISH_ATTEMPTS times, then they are
+            lost too.
+
+            :param list changes: ``(url, event)`` tuples
+        """
+        rows = [(url, event, os.getpid()) for url, event in changes]
+        if self.lost:
+            rows.insert(0, ('', RESET, os.getpid()))
+        if not rows:
+            return
+        conn = self.connection()
+        for attempt in range(1, self.PUBLISH_ATTEMPTS + 1):
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.executemany('''INSERT INTO cache_changes (url, event, origin)
+                                        VALUES (?, ?, ?)''', rows)
+                    generation = conn.execute('SELECT MAX(generation) FROM cache_changes').fetchone()[0]
+                    if generation // self.TRIM_EVERY != (generation - len(rows)) // self.TRIM_EVERY:
+                        conn.execute('DELETE FROM cache_changes WHERE generation <= ?',
+                                     (generation - config.CACHE_CHANGES_KEEP,))
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                self.lost = False
+                return
+            except sqlite3.OperationalError as error:
+                if 'no such table' in str(error):
+                    # the database has no change log, nothing to keep in step
+                    return
+                if attempt == self.PUBLISH_ATTEMPTS:
+                    logger.error('Could not log %d changes for the other workers, they will reset all pages: %s',
+                                 len(rows), error)
+                    self.lost = True
+                    return
+                logger.warning('Logging %d changes failed, trying again: %s', len(rows), error)
+
+    @contextmanager
+    def batch(self):
+        """
+            Collects the changes published meanwhile by the current thread
+            and logs them at the end with a single insert, e.g. the
+            hundreds of a moved namespace. No transaction is open while
+            the changes are announced, so the receivers of
+            :data:`~wiki.signals.page_changed` never hold the write lock.
+        """
+        if getattr(self._local, 'pending', None) is not None:
+            # the changes go with the enclosing batch
+            yield
+            return
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            changes, self._local.pending = self._local.pending, None
+            self.publish_many(changes)
+
+    def sync(self):
+        """
+            Applies the changes other workers made since the last call.
+            The first call only remembers the latest generation, as
+            nothing can have been cached before it.
+
+            If the log no longer holds every change this process has
+            missed, or another worker lost some of its changes, all pages
+            are reset instead.
+
+            :returns: the number of changes applied
+        """
+        if self.lost:
+            # the reset marker is owed even if nothing else changes
+            self.publish_many([])
+        try:
+            latest = self.latest()
+        except sqlite3.OperationalError:
+            return 0
+        if latest == self.generation:
+            return 0
+        with self._lock:
+            if self.generation is None or latest < self.generation:
+                # first request, or the database was replaced
+                self.generation = latest
+                return 0
+            if latest == self.generation:
+                return 0
+            rows = self.connection().execute('''SELECT generation, url, event, origin FROM cache_changes
+                                                WHERE generation > ?
+                                                ORDER BY generation''', (self.generation,)).fetchall()
+            if not rows or rows[0][0] != self.generation + 1:
+                self.generation = latest
+                pages_reset.send(self)
+                return 0
+            applied = 0
+            pid = os.getpid()
+            for generation, url, event, origin in rows:
+                if origin != pid and event == RESET:
+                    self.generation = latest
+                    pages_reset.send(self)
+                    return applied
+                if origin != pid:
+                    page_changed.send(self, url=url, event=event)
+                    applied += 1
+                self.generation = generation
+            return applied
+
+
+@page_changed.connect
+def publish_change(sender, url, event):
+    """
+        Logs every page change made through the wiki in this process.
+        It never raises, the receivers after it still have to run.
+    """
+    if isinstance(sender, (CacheCoherence, ContentWatcher)):
+        return
+    CacheCoherence.for_database(config.DATABASE).publish(url, event)
@@ -3,20 +3,31 @@
     ~~~~~~~~~
 """
 import copy
+import hashlib
+from contextlib import contextmanager
+import itertools
 import sqlite3
 from collections import OrderedDict
+from collections import namedtuple
 from io import open
 import os
 import re
+import threading
 
 from flask import abort
 from flask import url_for
 from flask import current_app
+from flask import has_app_context
 from flask_login import current_user
-import markdown
+from markupsafe import Markup
+from markupsafe import escape
 from datetime import datetime
 
 import config
+from wiki import metrics
+from wiki.fragments import fragments
+from wiki.signals import page_changed
+from wiki.singleflight import SingleFlight
 
 
 def clean_url(url):
@@ -38,7 +49,79 @@ def clean_url(url):
     return url
 
 
-def wikilink(text, url_formatter=None):
+LINK_RE = re.compile(
+    r"((?<!\<code\>)(?<!!)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
+    re.X | re.U
+)
+
+EMBED_RE = re.compile(r'!\[\[\s*([^\]|]+?)\s*(?:\|\s*(\d+)\s*)?\]\]')
+
+# indented by four spaces or more the line is a code block
+INCLUDE_RE = re.compile(r'^ {0,3}\{\{include:[ \t]*(.+?)[ \t]*\}\}[ \t]*$', re.M)
+
+FENCE_RE = re.compile(r'^((`|~)\2{2,})[^\n]*\n.*?(?:^\1\2*[ \t]*$|\Z)', re.M | re.S)
+
+
+def split_code(text):
+    """
+        Splits raw page content at its fenced code blocks, which are
+        shown as they are.
+
+        :param str text: the raw content of a page
+
+        :returns: the parts of the text, starting with one outside of
+            code, every other part is a code block
+        :rtype: list
+    """
+    parts = []
+    start = 0
+    for fence in FENCE_RE.finditer(text):
+        parts.extend([text[start:fence.start()], fence.group(0)])
+        start = fence.end()
+    parts.append(text[start:])
+    return parts
+
+
+def link_targets(text):
+    """
+        Finds the urls wikilinks of raw page content point to, without
+        rendering it. Links inside code are found as well, so there may
+        be more urls than rendered links.
+
+        :param str text: the raw content of a page
+
+        :returns: the distinct urls, sorted
+        :rtype: list
+    """
+    return sorted(set(clean_url(match[1]) for match in LINK_RE.findall(text)))
+
+
+def known_urls():
+    """
+        Returns the function telling whether a page exists, from the page
+        index of the wiki of the current app, None outside of an app.
+    """
+    if not has_app_context() or 'CONTENT_DIR' not in current_app.config:
+        return None
+    # wiki.records builds on this module
+    from wiki.records import PageIndex
+    return PageIndex.for_root(current_app.config['CONTENT_DIR']).exists
+
+
+def missing_targets(text):
+    """
+        Returns the urls wikilinks of raw page content point to that have
+        no page, as far as the page index of the current app knows.
+
+        :param str text: the raw content of a page
+    """
+    exists = known_urls()
+    if exists is None:
+        return []
+    return [url for url in link_targets(text) if not exists(url)]
+
+
+def wikilink(text, url_formatter=None, exists=None):
     """
         Processes Wikilink syntax "[[Link]]" within the html body.
         This is intended to be run after content has been processed
@@ -47,6 +130,9 @@ def wikilink(text, url_formatter=None):
         :param str text: the html to highlight wiki links in.
         :param function url_formatter: which URL formatter to use,
             will by default use the flask url formatter
+        :param function exists: tells whether the page of a url exists,
+            links to missing pages get the ``missing`` class; by default
+            the page index of the current app is asked
 
         Syntax:
             This accepts Wikilink syntax in the form of [[WikiLink]] or
@@ -59,21 +145,248 @@ def wikilink(text, url_formatter=None):
     """
     if url_formatter is None:
         url_formatter = url_for
-    link_regex = re.compile(
-        r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
-        re.X | re.U
-    )
-    for i in link_regex.findall(text):
+    if exists is None:
+        exists = known_urls()
+    for i in LINK_RE.findall(text):
         title = [i[-1] if i[-1] else i[1]][0]
         url = clean_url(i[1])
-        html_url = "<a href='{0}'>{1}</a>".format(
+        missing = exists is not None and not exists(url)
+        html_url = "<a href='{0}'{1}>{2}</a>".format(
             url_formatter('wiki.display', url=url),
+            " class='missing'" if missing else '',
             title
         )
-        text = re.sub(link_regex, html_url, text, count=1)
+        text = re.sub(LINK_RE, html_url, text, count=1)
     return text
 
 
+def embed(text):
+    """
+        Processes the attachment syntax "![[name]]" within the html body:
+        images are shown, other files linked. "![[name|width]]" shows an
+        image at that width, from its smallest variant at least as wide.
+        Embeds of missing attachments link to the upload page.
+
+        Fragments leave their embeds to the page including them, so the
+        fragment cache does not depend on the attachments. Outside of an
+        app nothing is embedded.
+
+        :param str text: the html to embed attachments in
+
+        :returns: the processed html
+        :rtype: str
+    """
+    if getattr(_local, 'fragments', 0) or not has_app_context() or not EMBED_RE.search(text):
+        return text
+    # wiki.attachments builds on this module
+    from wiki.attachments import attachment_name, embedded_names, find_attachments, is_image, variant_width
+    attachments = find_attachments(embedded_names(text))
+
+    def replace(match):
+        name = attachment_name(match.group(1))
+        attachment = attachments.get(name)
+        if attachment is None:
+            return "<a href='{0}' class='missing'>{1}</a>".format(url_for('wiki.attachments'), escape(name))
+        url = url_for('wiki.attachment', digest=attachment.digest, name=name)
+        if not is_image(attachment.mimetype):
+            return "<a href='{0}'>{1}</a>".format(url, escape(name))
+        if match.group(2) is None:
+            return "<img src='{0}' alt='{1}'>".format(url, escape(name))
+        width = int(match.group(2))
+        source = url_for('wiki.attachment_variant', digest=attachment.digest, width=variant_width(width), name=name)
+        return "<a href='{0}'><img src='{1}' alt='{2}' width='{3}'></a>".format(url, source, escape(name), width)
+
+    return EMBED_RE.sub(replace, text)
+
+
+def split_meta(text):
+    """
+        Splits raw page content into its meta data and markdown body
+        without rendering anything. This is a lot cheaper than running
+        the :class:`Processor` when only the title or tags are needed.
+
+        :param str text: the raw content of a page file
+
+        :returns: the meta data and the markdown body
+        :rtype: tuple
+    """
+    meta_raw, _, body = text.replace('\r\n', '\n').partition('\n\n')
+    meta = OrderedDict()
+    for line in meta_raw.split('\n'):
+        key, sep, value = line.partition(':')
+        if sep:
+            meta[key.strip().lower()] = value.strip()
+    return meta, body
+
+
+_local = threading.local()
+
+
+def get_markdown():
+    """
+        Returns the markdown converter of the current thread, reset for a
+        new text. Markdown and its extensions, pygments included, are only
+        imported and set up when the first page is rendered, not when the
+        app starts, and then reused for every page.
+    """
+    md = getattr(_local, 'markdown', None)
+    if md is None:
+        import markdown
+        md = _local.markdown = markdown.Markdown(extensions=[
+            'codehilite',
+            'fenced_code',
+            'meta',
+            'tables'
+        ])
+    return md.reset()
+
+
+def include_targets(text):
+    """
+        Finds the urls of the pages raw page content includes, in their
+        order, without rendering it. Includes in code are shown as they
+        are and not found.
+
+        :param str text: the raw content of a page
+
+        :returns: the distinct urls
+        :rtype: list
+    """
+    urls = []
+    for part in split_code(text)[::2]:
+        for url in INCLUDE_RE.findall(part):
+            url = clean_url(url)
+            if url not in urls:
+                urls.append(url)
+    return urls
+
+
+def read_page(url):
+    """
+        Returns the raw content of a page of the wiki of the current app,
+        None if there is no such page or no app.
+
+        :param str url: the url of the page
+    """
+    if not has_app_context() or 'CONTENT_DIR' not in current_app.config:
+        return None
+    wiki = Wiki(current_app.config['CONTENT_DIR'])
+    path = wiki.path(url)
+    if not wiki.inside_root(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def included_pages(text, read=None):
+    """
+        Returns the raw content of every page raw page content includes,
+        directly or through the pages it includes, down to INCLUDE_DEPTH
+        levels. Nothing is rendered, so this tells cheaply whether what a
+        page shows has changed.
+
+        :param str text: the raw content of a page
+        :param function read: returns the raw content of a page by url,
+            None if there is no such page; by default the pages of the
+            wiki of the current app are read
+
+        :returns: the contents by url, without the missing pages
+        :rtype: OrderedDict
+    """
+    read = read or read_page
+    pages = OrderedDict()
+    seen = set()
+    level = include_targets(text)
+    for _ in range(config.INCLUDE_DEPTH):
+        below = []
+        for url in level:
+            if url in seen:
+                continue
+            seen.add(url)
+            content = read(url)
+            if content is not None:
+                pages[url] = content
+                below.extend(include_targets(content))
+        level = below
+    return pages
+
+
+@contextmanager
+def including(url):
+    """
+        Marks a page as being rendered by the current thread while its
+        includes are rendered.
+    """
+    stack = _local.__dict__.setdefault('including', [])
+    stack.append(url)
+    try:
+        yield stack
+    finally:
+        stack.pop()
+
+
+def include_error(url, reason):
+    _local.refused = getattr(_local, 'refused', 0) + 1
+    return '\n\n<div class="include-error">%s</div>\n\n' % escape('Cannot include %s: %s' % (url, reason))
+
+
+def render_include(url):
+    """
+        Returns the rendered body of an included page, from the fragment
+        cache if its content did not change.
+
+        :param str url: the url of the included page
+    """
+    stack = getattr(_local, 'including', [])
+    if url in stack:
+        return include_error(url, 'it includes itself')
+    if len(stack) > config.INCLUDE_DEPTH:
+        return include_error(url, 'includes are nested too deeply')
+    content = read_page(url)
+    if content is None:
+        return include_error(url, 'there is no such page')
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    html = fragments.get(url, digest)
+    if html is None:
+        refused = getattr(_local, 'refused', 0)
+        # the page including the fragment embeds its attachments
+        _local.fragments = getattr(_local, 'fragments', 0) + 1
+        try:
+            with including(url):
+                html = Processor(content).process()[0]
+        finally:
+            _local.fragments -= 1
+        # what was refused depends on the includes around the fragment
+        if getattr(_local, 'refused', 0) == refused:
+            fragments.put(url, digest, html, include_targets(content), link_targets(content))
+    return '\n\n<div class="include">\n%s\n</div>\n\n' % html
+
+
+def include(text):
+    """
+        Replaces every ``{{include:url}}`` standing on a line of its own
+        with the rendered body of that page, e.g. a header shared by many
+        pages. A page including itself, directly or not, or includes
+        nested deeper than INCLUDE_DEPTH are shown as an error instead.
+        Includes in code blocks are left as they are, and outside of an
+        app nothing is included.
+
+        :param str text: the raw content of a page
+
+        :returns: the content with the includes rendered
+        :rtype: str
+    """
+    if not has_app_context() or 'CONTENT_DIR' not in current_app.config:
+        return text
+    parts = split_code(text)
+    for position in range(0, len(parts), 2):
+        parts[position] = INCLUDE_RE.sub(lambda match: render_include(clean_url(match.group(1))), parts[position])
+    return ''.join(parts)
+
+
 class Processor(object):
     """
         The processor handles the processing of file content into
@@ -83,8 +396,8 @@ class Processor(object):
         cases.
     """
 
-    preprocessors = []
-    postprocessors = [wikilink]
+    preprocessors = [include]
+    postprocessors = [embed, wikilink]
 
     def __init__(self, text):
         """
@@ -92,12 +405,7 @@ class Processor(object):
 
             :param str text: the text to process
         """
-        self.md = markdown.Markdown(extensions=[
-            'codehilite',
-            'fenced_code',
-            'meta',
-            'tables'
-        ])
+        self.md = None
         self.input = text
         self.markdown = None
         self.meta_raw = None
@@ -120,6 +428,7 @@ class Processor(object):
         """
             Convert to HTML.
         """
+        self.md = get_markdown()
         self.html = self.md.convert(self.pre)
 
 
@@ -162,22 +471,59 @@ class Processor(object):
             pre and post processing, markdown rendering and meta data
             handling.
         """
-        self.process_pre()
-        self.process_markdown()
-        self.split_raw()
-        self.process_meta()
-        self.process_post()
+        stages = (('pre', self.process_pre), ('markdown', self.process_markdown),
+                  ('split_raw', self.split_raw), ('meta', self.process_meta),
+                  ('post', self.process_post))
+        if metrics.registry.enabled:
+            for name, stage in stages:
+                with metrics.timed(metrics.RENDER_STAGE_DURATION, stage=name):
+                    stage()
+        else:
+            for _, stage in stages:
+                stage()
 
         return self.final, self.markdown, self.meta
 
 
+_renders = SingleFlight()
+
+
+def render_content(url, content):
+    """
+        Renders the content of a page. Concurrent renders of the same
+        content of a page share a single render, e.g. when every reader of
+        a popular page asks for it right after it changed. A waiting render
+        renders on its own after RENDER_WAIT_TIMEOUT seconds.
+
+        :param str url: the url of the page
+        :param str content: the raw content of the page
+
+        :returns: the html, the markdown and the meta data
+    """
+    def render():
+        with including(url):
+            return Processor(content).process()
+
+    key = (url, hashlib.sha1(content.encode('utf-8')).hexdigest())
+    try:
+        return _renders.do(key, render, timeout=config.RENDER_WAIT_TIMEOUT)
+    except TimeoutError:
+        return render()
+
+
+Revision = namedtuple('Revision', ['approved', 'count', 'created', 'author', 'pending'])
+
+
 def connect_to_db():
     '''
     This method makes a connection to the sqlite3 database used in our system.
 
     :returns: a connection and cursor to use for query execution
     '''
-    connection = sqlite3.connect(config.DATABASE)
+    if metrics.registry.enabled:
+        connection = sqlite3.connect(config.DATABASE, factory=metrics.TimedConnection)
+    else:
+        connection = sqlite3.connect(config.DATABASE)
     cursor = connection.cursor()
 
     return connection, cursor
@@ -200,8 +546,16 @@ class Page(object):
             self.content = f.read()
 
     def render(self):
-        processor = Processor(self.content)
-        self._html, self.body, self._meta = processor.process()
+        self._html, self.body, meta = render_content(self.url, self.content)
+        # the meta data may be shared with concurrent renders
+        self._meta = OrderedDict(meta)
+
+    def load_meta(self):
+        """
+            Reads the meta data of the loaded content without rendering
+            it, e.g. to check whether a cached copy is still valid first.
+        """
+        self._meta = OrderedDict(split_meta(self.content)[0])
 
     def save(self, update=True, save_db=True):
         folder = os.path.dirname(self.path)
@@ -217,6 +571,8 @@ class Page(object):
             self.load()
             self.save_to_db(update=update)
         self.render()
+        page_changed.send(self, url=self.url,
+                          event='modified' if update else 'created')
 
 
     def save_to_db(self, update):
@@ -287,14 +643,14 @@ class Page(object):
         conn, cursor = connect_to_db()
         pages = []
 
-        query = '''SELECT content
+        # every version but the newest, in a single query
+        query = '''SELECT version, content
                     FROM wiki_pages
-                    WHERE url = ? AND version = ?'''
+                    WHERE url = ? AND version < (SELECT COUNT(*) FROM wiki_pages WHERE url = ?)
+                    ORDER BY version'''
 
-        for i in range(self.get_version_count()-1):
-            cursor.execute(query, (self.url, i + 1))
-            content = cursor.fetchone()[0]
-            page = Page(self.path, self.url + f"/{i + 1}")
+        for version, content in cursor.execute(query, (self.url, self.url)).fetchall():
+            page = Page(self.path, self.url + f"/{version}")
             page.load_content(content)
             page.render()
             pages.append(page)
@@ -303,6 +659,26 @@ class Page(object):
 
         return pages
 
+    def get_revision(self):
+        '''
+        This method returns what identifies the stored versions of the page, in a single query.
+
+        :returns: a Revision of the latest approved version, the number of versions, the creation date of the
+            newest version, the author of the page and the versions pending approval
+        '''
+        conn, cursor = connect_to_db()
+        query = '''SELECT MAX(CASE WHEN approved THEN version END), COUNT(*), MAX(date_created),
+                          MAX(CASE WHEN version = 1 THEN author END),
+                          GROUP_CONCAT(CASE WHEN NOT approved THEN version END)
+                    FROM wiki_pages
+                    WHERE url = ?'''
+        cursor.execute(query, (self.url,))
+        approved, count, created, author, pending = cursor.fetchone()
+        conn.close()
+
+        pending = sorted(int(version) for version in pending.split(',')) if pending else []
+        return Revision(approved, count, created, author, pending)
+
     def get_pending_edits(self):
         '''
         This method is used to return the version numbers of edits that have not been reviewed by the page author yet.
@@ -355,6 +731,7 @@ class Page(object):
         cursor.execute(query, (status, self.url, version,))
         conn.commit()
         conn.close()
+        page_changed.send(self, url=self.url, event='modified')
 
     def get_approval(self, version):
         '''
@@ -481,6 +858,121 @@ def update_url_db(url, newurl):
     conn.close()
 
 
+def tree_range(prefix):
+    """
+    Returns the bounds of the urls below a prefix, for a range condition that can use an index instead of a LIKE
+    pattern that would need escaping: every url starting with ``prefix/`` sorts from ``prefix/`` and before
+    ``prefix0``.
+
+    :prefix: url of the namespace
+    """
+    return prefix + '/', prefix + '0'
+
+
+def update_tree_urls_db(cursor, prefix, newprefix):
+    """
+    This method rewrites the urls stored in the database for the versions of a page and every page below it when
+    they are moved together, without committing, so the caller can do it in one transaction with the rename of the
+    files. History entries of pages without a title hold the url and are rewritten too.
+
+    :cursor: cursor of the transaction
+    :prefix: url of the namespace being moved
+    :newprefix: url the namespace is moved to
+    """
+    low, high = tree_range(prefix)
+    for table in ('wiki_pages', 'user_history'):
+        cursor.execute('''UPDATE %s
+                            SET url = ? || substr(url, ?)
+                            WHERE url = ? OR (url >= ? AND url < ?)''' % table,
+                       (newprefix, len(prefix) + 1, prefix, low, high))
+
+
+VersionHit = namedtuple('VersionHit', ['url', 'version', 'author', 'date_created', 'snippet'])
+
+
+def create_version_index(cursor):
+    """
+    This method creates the full-text index over the content of all stored page versions. Triggers keep it up to
+    date whenever save_to_db inserts a version or delete_from_db removes one. An existing database is indexed
+    once when the index is first created.
+
+    :cursor: cursor of the database holding the wiki_pages table
+    """
+    cursor.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='wiki_pages_fts\'''')
+    exists = cursor.fetchone() is not None
+    try:
+        cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS wiki_pages_fts
+                            USING fts5(content, content='wiki_pages', content_rowid='id')''')
+    except sqlite3.OperationalError:
+        # sqlite was built without fts5, search_versions falls back to a table scan
+        return
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS wiki_pages_fts_insert AFTER INSERT ON wiki_pages BEGIN
+                        INSERT INTO wiki_pages_fts (rowid, content) VALUES (new.id, new.content);
+                    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS wiki_pages_fts_delete AFTER DELETE ON wiki_pages BEGIN
+                        INSERT INTO wiki_pages_fts (wiki_pages_fts, rowid, content)
+                            VALUES ('delete', old.id, old.content);
+                    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS wiki_pages_fts_update AFTER UPDATE OF content ON wiki_pages BEGIN
+                        INSERT INTO wiki_pages_fts (wiki_pages_fts, rowid, content)
+                            VALUES ('delete', old.id, old.content);
+                        INSERT INTO wiki_pages_fts (rowid, content) VALUES (new.id, new.content);
+                    END''')
+    if not exists:
+        cursor.execute('''INSERT INTO wiki_pages_fts (wiki_pages_fts) VALUES ('rebuild')''')
+
+
+def search_versions(term, url=None, offset=0, limit=20):
+    """
+    This method searches the content of every stored version of every page for a phrase, so it can be found out
+    when the phrase was added or removed. Hits are ordered by url and version.
+
+    :term: the phrase to search for
+    :url: only search the versions of this page if given
+    :offset: the number of hits to skip
+    :limit: the maximum number of hits to return
+
+    :returns: a list of VersionHit for the requested page of hits and the total number of hits
+    """
+    conn, cursor = connect_to_db()
+    # the markers are replaced after escaping the snippet
+    start, end = '\x02', '\x03'
+    url_filter = 'AND p.url = ?' if url else ''
+    url_args = (url,) if url else ()
+    cursor.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='wiki_pages_fts\'''')
+    if cursor.fetchone() is not None:
+        phrase = '"%s"' % term.replace('"', '""')
+        cursor.execute('''SELECT COUNT(*)
+                            FROM wiki_pages_fts f JOIN wiki_pages p ON p.id = f.rowid
+                            WHERE wiki_pages_fts MATCH ? %s''' % url_filter, (phrase,) + url_args)
+        total = cursor.fetchone()[0]
+        cursor.execute('''SELECT p.url, p.version, p.author, p.date_created,
+                                snippet(wiki_pages_fts, 0, ?, ?, '...', 16)
+                            FROM wiki_pages_fts f JOIN wiki_pages p ON p.id = f.rowid
+                            WHERE wiki_pages_fts MATCH ? %s
+                            ORDER BY p.url, p.version
+                            LIMIT ? OFFSET ?''' % url_filter,
+                       (start, end, phrase) + url_args + (limit, offset))
+    else:
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        cursor.execute('''SELECT COUNT(*) FROM wiki_pages p
+                            WHERE p.content LIKE ? ESCAPE '\\' %s''' % url_filter, (pattern,) + url_args)
+        total = cursor.fetchone()[0]
+        cursor.execute('''SELECT p.url, p.version, p.author, p.date_created, SUBSTR(p.content, 1, 120)
+                            FROM wiki_pages p
+                            WHERE p.content LIKE ? ESCAPE '\\' %s
+                            ORDER BY p.url, p.version
+                            LIMIT ? OFFSET ?''' % url_filter, (pattern,) + url_args + (limit, offset))
+    rows = cursor.fetchall()
+    conn.close()
+
+    hits = []
+    for page_url, version, author, date_created, snippet in rows:
+        snippet = escape(snippet).replace(start, Markup('<strong>')).replace(end, Markup('</strong>'))
+        hits.append(VersionHit(page_url, version, author, date_created, snippet))
+    return hits, total
+
+
 class Wiki(object):
     def __init__(self, root):
         self.root = root
@@ -505,15 +997,27 @@ class Wiki(object):
             return page
         abort(404)
 
+    def get_unrendered_or_404(self, url):
+        """
+            Loads a page and its meta data without rendering it, call
+            :meth:`Page.render` before showing it.
+
+            :param str url: the url of the page
+        """
+        if not self.exists(url):
+            abort(404)
+        page = Page(self.path(url), url, new=True)
+        page.load()
+        page.load_meta()
+        return page
+
     def get_bare(self, url):
         path = self.path(url)
         if self.exists(url):
             return False
         return Page(path, url, new=True)
 
-    def move(self, url, newurl):
-        source = os.path.join(self.root, url) + '.md'
-        target = os.path.join(self.root, newurl) + '.md'
+    def inside_root(self, target):
         # normalize root path (just in case somebody defined it absolute,
         # having some '../' inside) to correctly compare it to the target
         root = os.path.normpath(self.root)
@@ -522,7 +1026,12 @@ class Wiki(object):
         # common prefix length must be at least as root length is
         # otherwise there are probably some '..' links in target path leading
         # us outside defined root directory
-        if len(common) < len(root):
+        return len(common) >= len(root)
+
+    def move(self, url, newurl):
+        source = os.path.join(self.root, url) + '.md'
+        target = os.path.join(self.root, newurl) + '.md'
+        if not self.inside_root(target):
             raise RuntimeError(
                 'Possible write attempt outside content directory: '
                 '%s' % newurl)
@@ -533,6 +1042,81 @@ class Wiki(object):
         os.rename(source, target)
         # change url references in database
         update_url_db(url, newurl)
+        from wiki.rollups import move_views
+        move_views(url, newurl)
+        page_changed.send(self, url=url, event='deleted')
+        page_changed.send(self, url=newurl, event='created')
+
+    def move_tree(self, prefix, newprefix):
+        """
+            Moves a page and every page below it, e.g. ``animals`` along
+            with ``animals/lions``, with a single rename of their folder.
+            The urls in the database are rewritten in one transaction,
+            which is rolled back, and the files moved back, if anything
+            fails.
+
+            :param str prefix: the url of the page or namespace to move
+            :param str newprefix: the url to move it to
+
+            :returns: the new urls of the moved pages
+            :rtype: list
+
+            :raises ValueError: if there is nothing to move or the target
+                is inside the moved namespace
+            :raises FileExistsError: if the target page or namespace
+                exists already
+            :raises RuntimeError: if the target is outside the content
+                directory
+        """
+        prefix, newprefix = prefix.strip('/'), newprefix.strip('/')
+        if not prefix or not newprefix or newprefix == prefix or newprefix.startswith(prefix + '/'):
+            raise ValueError('Cannot move "%s" to "%s".' % (prefix, newprefix))
+        folder = os.path.join(self.root, prefix)
+        target = os.path.join(self.root, newprefix)
+        if not self.inside_root(target):
+            raise RuntimeError(
+                'Possible write attempt outside content directory: '
+                '%s' % newprefix)
+        moves, urls = [], []
+        if self.exists(prefix):
+            moves.append((self.path(prefix), self.path(newprefix)))
+            urls.append(prefix)
+        if os.path.isdir(folder):
+            moves.append((folder, target))
+            urls.extend('%s/%s' % (prefix, url) for url, _ in Wiki(folder).walk())
+        if not urls:
+            raise ValueError('There is no page "%s".' % prefix)
+        for _, path in moves:
+            if os.path.exists(path):
+                raise FileExistsError('"%s" exists already.' % newprefix)
+
+        from wiki.rollups import move_tree_views
+        conn, cursor = connect_to_db()
+        renamed = []
+        try:
+            update_tree_urls_db(cursor, prefix, newprefix)
+            move_tree_views(cursor, prefix, newprefix)
+            for source, path in moves:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.rename(source, path)
+                renamed.append((source, path))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            for source, path in reversed(renamed):
+                os.rename(path, source)
+            raise
+        finally:
+            conn.close()
+
+        newurls = [newprefix + url[len(prefix):] for url in urls]
+        # a single insert into the change log for all of them
+        from wiki.coherence import CacheCoherence
+        with CacheCoherence.for_database(config.DATABASE).batch():
+            for url, newurl in zip(urls, newurls):
+                page_changed.send(self, url=url, event='deleted')
+                page_changed.send(self, url=newurl, event='created')
+        return newurls
 
     def delete(self, url):
         path = self.path(url)
@@ -540,29 +1124,74 @@ class Wiki(object):
             return False
         os.remove(path)
         delete_from_db(url)
+        page_changed.send(self, url=url, event='deleted')
         return True
 
-    def index(self):
+    def walk(self):
         """
-            Builds up a list of all the available pages.
+            Walks the content directory without loading any page.
 
-            :returns: a list of all the wiki pages
-            :rtype: list
+            :returns: the url and path of every page file
+            :rtype: generator
         """
         # make sure we always have the absolute path for fixing the
         # walk path
-        pages = []
         root = os.path.abspath(self.root)
         for cur_dir, _, files in os.walk(root):
             # get the url of the current directory
             cur_dir_url = cur_dir[len(root)+1:]
             for cur_file in files:
-                path = os.path.join(cur_dir, cur_file)
                 if cur_file.endswith('.md'):
+                    path = os.path.join(cur_dir, cur_file)
                     url = clean_url(os.path.join(cur_dir_url, cur_file[:-3]))
-                    page = Page(path, url)
-                    pages.append(page)
-        return sorted(pages, key=lambda x: x.title.lower())
+                    yield url, path
+
+    def index(self):
+        """
+            Builds up a list of all the available pages. Pages are listed
+            as compact records, nothing is loaded or rendered.
+
+            :returns: a list of all the wiki pages sorted by title
+            :rtype: list of :class:`~wiki.records.PageRecord`
+        """
+        # wiki.records builds on this module
+        from wiki.records import PageIndex
+        return PageIndex.for_root(self.root).records()
+
+    def children(self, prefix=''):
+        """
+            Lists one level of a namespace, e.g. ``animals`` for the pages
+            ``animals/lions`` and ``animals/cats/tigers``. The cost depends
+            on the number of entries of the namespace only.
+
+            :param str prefix: the url of the namespace, the empty prefix
+                lists the top level of the wiki
+
+            :returns: the pages and namespaces in the namespace sorted by
+                name, None if there is no page in it
+            :rtype: list of :class:`~wiki.records.NamespaceEntry`
+        """
+        from wiki.records import PageIndex
+        return PageIndex.for_root(self.root).children(prefix)
+
+    def tree(self, prefix='', depth=1):
+        """
+            Lists a namespace and the namespaces below it, down to a depth.
+
+            :param str prefix: the url of the namespace
+            :param int depth: the number of levels to list, 1 only lists
+                the namespace itself
+
+            :returns: the entries of the namespace, each with the list of
+                its own entries if it is a namespace within the depth, None
+                otherwise; None if there is no page in the namespace
+            :rtype: list of tuple
+        """
+        children = self.children(prefix)
+        if children is None:
+            return None
+        return [(entry, self.tree(entry.url, depth - 1) if entry.count and depth > 1 else None)
+                for entry in children]
 
     def index_by(self, key):
         """
@@ -589,35 +1218,93 @@ class Wiki(object):
         return pages.get(title)
 
     def get_tags(self):
-        pages = self.index()
-        tags = {}
-        for page in pages:
-            pagetags = page.tags.split(',')
-            for tag in pagetags:
-                tag = tag.strip()
-                if tag == '':
-                    continue
-                elif tags.get(tag):
-                    tags[tag].append(page)
-                else:
-                    tags[tag] = [page]
-        return tags
+        from wiki.records import PageIndex
+        return PageIndex.for_root(self.root).by_tag()
 
     def index_by_tag(self, tag):
-        pages = self.index()
-        tagged = []
-        for page in pages:
-            if tag in page.tags:
-                tagged.append(page)
-        return sorted(tagged, key=lambda x: x.title.lower())
-
-    def search(self, term, ignore_case=True, attrs=['title', 'tags', 'body']):
-        pages = self.index()
-        regex = re.compile(term, re.IGNORECASE if ignore_case else 0)
-        matched = []
-        for page in pages:
-            for attr in attrs:
-                if regex.search(getattr(page, attr)):
-                    matched.append(page)
-                    break
-        return matched
+        from wiki.records import PageIndex
+        return PageIndex.for_root(self.root).tagged(tag)
+
+    def popular(self, window='week', limit=10):
+        """
+            Returns the most viewed pages of a time window, from the view
+            rollups. Rankings are kept in memory and only refreshed every
+            POPULAR_REFRESH seconds, so recent views may be missing.
+
+            :param str window: ``'hour'``, ``'day'``, ``'week'``,
+                ``'month'`` or ``'all'``
+            :param int limit: the maximum number of pages, at most
+                POPULAR_TOP
+
+            :returns: the url and number of views of existing pages
+            :rtype: list of :class:`~wiki.rollups.PopularPage`
+
+            :raises ValueError: if the window is unknown
+        """
+        from wiki.rollups import PopularPages
+        pages = PopularPages.for_database(config.DATABASE).get(window, config.POPULAR_TOP)
+        # deleted pages stay in the rollups
+        return list(itertools.islice((page for page in pages if self.exists(page.url)), limit))
+
+    def search_ranked(self, term, offset=0, limit=20):
+        """
+            Searches title, tags and body for the words of the term and
+            ranks the matching pages by relevance. Nothing is rendered,
+            each hit carries a highlighted snippet of the raw markdown.
+
+            :param str term: the words to search for
+            :param int offset: the number of best hits to skip
+            :param int limit: the maximum number of hits to return
+
+            :returns: the requested page of the ranked results
+            :rtype: :class:`~wiki.search.SearchResults`
+        """
+        # wiki.search builds on this module
+        from wiki.search import SearchIndex
+        return SearchIndex.for_root(self.root).search(term, offset, limit)
+
+    def search(self, term, mode='word', ignore_case=True, offset=0, limit=20):
+        """
+            Searches title, tags and body of all pages.
+
+            :param str term: the term to search for
+            :param str mode: how to interpret the term, ``'word'`` ranks
+                pages by relevance to the words of the term, ``'literal'``
+                finds the exact text and ``'regex'`` runs a regular
+                expression in a worker process with a time budget
+            :param bool ignore_case: whether to ignore the case, word
+                searches always do
+            :param int offset: the number of hits to skip
+            :param int limit: the maximum number of hits to return
+
+            :returns: the requested page of the results
+            :rtype: :class:`~wiki.search.SearchResults`
+
+            :raises re.error: if a regex search term is invalid
+        """
+        from wiki.search import RegexSearch
+        from wiki.search import SubstringIndex
+        if mode == 'literal':
+            return SubstringIndex.for_root(self.root).search(
+                term, ignore_case, offset, limit)
+        if mode == 'regex':
+            return RegexSearch(self.root, term, ignore_case).search(offset, limit)
+        return self.search_ranked(term, offset, limit)
+
+    def search_stream(self, term, ignore_case=True):
+        """
+            Prepares a regex search whose hits are yielded while the pages
+            are still being searched, instead of waiting for a complete
+            page of results. Nothing runs before the search is iterated.
+
+            :param str term: the regular expression
+            :param bool ignore_case: whether to ignore the case
+
+            :returns: the prepared search, iterate it or its
+                :meth:`~wiki.search.RegexSearch.stream`
+            :rtype: :class:`~wiki.search.RegexSearch`
+
+            :raises re.error: if the term is invalid
+        """
+        from wiki.search import RegexSearch
+        return RegexSearch(self.root, term, ignore_case, budget=config.SEARCH_STREAM_BUDGET)
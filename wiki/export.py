@@ -0,0 +1,328 @@
+"""
+    Static export
+    ~~~~~~~~~~~~~
+
+    Writes the wiki as static html files, so a read only mirror can be
+    served by any web server: every page, optionally every approved
+    earlier version, the index, the tag pages, the search manifest, the
+    attachments and the static assets. Every url gets an ``index.html`` in its folder,
+    e.g. with nginx ``try_files $uri $uri/index.html =404;``.
+
+    Pages are rendered by a pool of processes, one per core, and only
+    pages whose content, included pages, embedded attachments, exported
+    versions, missing link targets or templates changed since the last
+    export are rendered again. Attachments never change under their urls,
+    so only new ones are copied.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import render_template
+
+import config
+from wiki.attachments import AttachmentStore
+from wiki.attachments import attachment_dir
+from wiki.attachments import attachment_digests
+from wiki.attachments import find_attachments
+from wiki.attachments import is_image
+from wiki.core import Page
+from wiki.core import Revision
+from wiki.core import Wiki
+from wiki.core import connect_to_db
+from wiki.core import included_pages
+from wiki.core import link_targets
+from wiki.core import split_meta
+
+#: the state of the last export, kept in the output directory
+MANIFEST = '.export.json'
+
+#: the number of pages a worker renders per task
+BATCH = 50
+
+ExportResult = namedtuple('ExportResult', ['rendered', 'kept', 'removed'])
+ExportedPage = namedtuple('ExportedPage', ['url', 'title', 'tags'])
+
+# the app of a worker process
+_app = None
+
+
+def write_file(output, path, data):
+    """
+        Writes a file of the export atomically, so the web server never
+        sends a partly written file.
+
+        :param str output: the output directory
+        :param str path: the path of the file in the export, with slashes
+        :param data: the content, str or bytes
+    """
+    target = os.path.join(output, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    temporary = target + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, target)
+
+
+def remove_file(output, path):
+    try:
+        os.remove(os.path.join(output, *path.split('/')))
+    except FileNotFoundError:
+        pass
+
+
+def page_file(url):
+    return '%s/index.html' % url
+
+
+def version_file(url, version):
+    return 'display_version/%s/%d/index.html' % (url, version)
+
+
+def content_hash(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(b'\0' + str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def init_worker(directory, settings):
+    """
+        Sets up the app of a worker process.
+
+        :param str directory: the directory the app was created for
+        :param dict settings: the config of the exporting app to apply
+    """
+    global _app
+    from wiki import create_app
+    config.DATABASE = settings['DATABASE']
+    _app = create_app(directory)
+    _app.config.update(settings)
+
+
+def render_batch(output, tasks, app=None):
+    """
+        Renders a batch of pages and versions into the output directory.
+
+        :param str output: the output directory
+        :param list tasks: ``(path, url, content, versions, version)``
+            tuples, versions being the exported version numbers of a
+            current page and version None for it
+        :param app: the app to render with, the app of the worker if None
+    """
+    app = app or _app
+    with app.test_request_context():
+        for path, url, content, versions, version in tasks:
+            page = Page(None, url if version is None else '%s/%d' % (url, version), new=True)
+            page.load_content(content)
+            page.render()
+            if version is None:
+                # only the exported versions are linked, under their numbers
+                html = render_template('page.html', page=page, author=False,
+                                       revision=Revision(None, 0, None, None, []), versions=versions)
+            else:
+                html = render_template('version.html', page=page, author=False, version=version)
+            write_file(output, path, html)
+    return len(tasks)
+
+
+def read_pages(root):
+    """
+        Returns the content of every page by url.
+    """
+    pages = OrderedDict()
+    for url, path in sorted(Wiki(root).walk()):
+        with open(path, 'r', encoding='utf-8') as f:
+            pages[url] = f.read()
+    return pages
+
+
+def read_versions():
+    """
+        Returns the content of the approved versions before the newest.
+    """
+    conn, cursor = connect_to_db()
+    versions = cursor.execute('''SELECT w.url, w.version, w.content
+                                  FROM wiki_pages AS w
+                                  JOIN (SELECT url, COUNT(*) AS count FROM wiki_pages GROUP BY url) AS c
+                                    ON c.url = w.url
+                                  WHERE w.approved AND w.version < c.count
+                                  ORDER BY w.url, w.version''').fetchall()
+    conn.close()
+    return versions
+
+
+def export_site(app, output, versions=False, workers=None, force=False, progress=None):
+    """
+        Exports the wiki of an app, to be called in its app context.
+
+        :param app: the app of the wiki
+        :param str output: the output directory, it is created if missing
+        :param bool versions: whether to export the approved earlier
+            versions of every page too
+        :param int workers: the number of rendering processes, the number
+            of cores if None, 1 renders in this process
+        :param bool force: whether to render unchanged pages too
+        :param progress: called with the number of rendered pages and the
+            number of pages to render after every batch
+
+        :returns: the number of rendered, kept and removed pages
+        :rtype: ExportResult
+    """
+    from wiki.web.routes import template_version
+    from wiki.web.search.Manifest import TitleManifest
+
+    os.makedirs(output, exist_ok=True)
+    root = app.config['CONTENT_DIR']
+    previous = load_manifest(output)
+    old_files = previous.get('files', {})
+    templates = template_version()
+    # changed templates change every page
+    current = {} if force or previous.get('templates') != templates else old_files
+
+    pages = read_pages(root)
+    history = read_versions() if versions else []
+    exported = {}
+    for url, version, _ in history:
+        exported.setdefault(url, []).append(version)
+    files, tasks = {}, []
+    for url, content in pages.items():
+        path = page_file(url)
+        included = included_pages(content, pages.get)
+        # links to missing pages are shown differently
+        shown = '\n'.join([content] + list(included.values()))
+        missing = [target for target in link_targets(shown) if target not in pages]
+        files[path] = content_hash(content, exported.get(url, []), missing, list(included.items()),
+                                   attachment_digests(shown))
+        if current.get(path) != files[path]:
+            tasks.append((path, url, content, exported.get(url, []), None))
+    for url, version, content in history:
+        path = version_file(url, version)
+        included = included_pages(content, pages.get)
+        shown = '\n'.join([content] + list(included.values()))
+        missing = [target for target in link_targets(shown) if target not in pages]
+        files[path] = content_hash(content, missing, list(included.items()), attachment_digests(shown))
+        if current.get(path) != files[path]:
+            tasks.append((path, url, content, None, version))
+    removed = [path for path in old_files if path not in files]
+    for path in removed:
+        remove_file(output, path)
+
+    batches = [tasks[start:start + BATCH] for start in range(0, len(tasks), BATCH)]
+    rendered = 0
+    if workers == 1 or len(batches) <= 1:
+        for batch in batches:
+            rendered += render_batch(output, batch, app)
+            if progress:
+                progress(rendered, len(tasks))
+    else:
+        settings = {key: app.config[key] for key in ('CONTENT_DIR', 'USER_DIR', 'DATABASE') if key in app.config}
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(app.config['APP_DIR'], settings)) as pool:
+            for count in pool.map(render_batch, [output] * len(batches), batches):
+                rendered += count
+                if progress:
+                    progress(rendered, len(tasks))
+
+    home = os.path.join(output, 'home', 'index.html')
+    if 'home' in pages and os.path.exists(home):
+        shutil.copyfile(home, os.path.join(output, 'index.html'))
+    export_index(app, output, pages)
+    tags = export_tags(app, output, pages, previous.get('tags', []))
+    body, _ = TitleManifest.for_root(root).serialize()
+    write_file(output, 'search_manifest', body)
+    export_assets(app, output)
+    export_attachments(app, output)
+
+    with open(os.path.join(output, MANIFEST), 'w') as f:
+        json.dump({'templates': templates, 'files': files, 'tags': tags}, f)
+    return ExportResult(rendered, len(files) - len(tasks), len(removed))
+
+
+def listing(pages):
+    """
+        Returns the pages to list, from their meta data only.
+    """
+    listed = []
+    for url, content in pages.items():
+        meta = dict(split_meta(content)[0])
+        listed.append(ExportedPage(url, meta.get('title', ''), meta.get('tags', '')))
+    return sorted(listed, key=lambda page: page.title.lower())
+
+
+def export_index(app, output, pages):
+    with app.test_request_context():
+        write_file(output, 'index/index.html', render_template('index.html', pages=listing(pages)))
+
+
+def export_tags(app, output, pages, old_tags):
+    """
+        Writes the tag list and a page per tag, removing the pages of tags
+        no longer used.
+
+        :returns: the exported tags
+    """
+    tags = {}
+    for page in listing(pages):
+        for tag in page.tags.split(','):
+            tag = tag.strip()
+            # tags become folders of the export
+            if tag and '/' not in tag and not tag.startswith('.'):
+                tags.setdefault(tag, []).append(page)
+    with app.test_request_context():
+        write_file(output, 'tags/index.html', render_template('tags.html', tags=tags))
+        for tag, tagged in tags.items():
+            write_file(output, 'tag/%s/index.html' % tag, render_template('tag.html', pages=tagged, tag=tag))
+    for tag in old_tags:
+        if tag not in tags:
+            remove_file(output, 'tag/%s/index.html' % tag)
+    return sorted(tags)
+
+
+def export_assets(app, output):
+    """
+        Copies the static assets under their fingerprinted urls.
+    """
+    assets = app.extensions['assets']
+    folder = os.path.join(output, 'assets')
+    shutil.rmtree(folder, ignore_errors=True)
+    for filename, asset in assets.assets.items():
+        write_file(output, 'assets/%s/%s' % (asset.fingerprint, filename), asset.data)
+
+
+def export_attachments(app, output):
+    """
+        Copies the attachments not exported yet under their urls, images
+        with their variants, or the original where a variant is missing.
+    """
+    store = AttachmentStore(attachment_dir(app.config))
+    for attachment in find_attachments().values():
+        copies = [(store.path(attachment.digest), '')]
+        if is_image(attachment.mimetype):
+            for width in config.THUMBNAIL_WIDTHS:
+                variant = store.variant_path(attachment.digest, width)
+                copies.append((variant if os.path.exists(variant) else copies[0][0], '%d/' % width))
+        for source, folder in copies:
+            target = os.path.join(output, 'attachments', attachment.digest, *(folder + attachment.name).split('/'))
+            if not os.path.exists(source):
+                continue
+            # a variant made since the last export replaces the original
+            if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(source):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target + '.tmp')
+            os.replace(target + '.tmp', target)
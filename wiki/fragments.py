@@ -0,0 +1,125 @@
+"""
+    Fragment cache
+    ~~~~~~~~~~~~~~
+
+    Keeps the rendered bodies of included pages, by url and content hash,
+    so a page including the same fragments is rendered without rendering
+    each of them again. A fragment may include other pages and link to
+    others, which are part of its html: when a page changes, its fragment
+    is evicted along with every fragment including it, directly or not,
+    and when a page is created or deleted, along with every fragment
+    linking to it.
+"""
+import threading
+from collections import OrderedDict
+
+import config
+from wiki.metrics import cache_lookup
+from wiki.signals import page_changed
+from wiki.signals import pages_reset
+
+
+class FragmentCache(object):
+    """
+        A least recently used cache of rendered page bodies.
+
+        :param int size: the maximum number of fragments
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        #: the urls the fragments include and link to, and the other way round
+        self.includes = {}
+        self.included_from = {}
+        self.links = {}
+        self.linked_from = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, digest):
+        """
+            Returns the html of a fragment, None if it is not cached.
+
+            :param str url: the url of the included page
+            :param str digest: the hash of the content of the page
+        """
+        with self._lock:
+            html = self.entries.get((url, digest))
+            if html is not None:
+                self.entries.move_to_end((url, digest))
+        cache_lookup('fragment', html is not None)
+        return html
+
+    def put(self, url, digest, html, includes=(), links=()):
+        """
+            Caches the html of a fragment, replacing the fragments of other
+            contents of the page.
+
+            :param includes: the urls of the pages the fragment includes
+            :param links: the urls the fragment links to
+        """
+        with self._lock:
+            self.remove(url)
+            self.entries[(url, digest)] = html
+            for targets, sources, urls in ((self.includes, self.included_from, includes),
+                                           (self.links, self.linked_from, links)):
+                targets[url] = tuple(urls)
+                for target in targets[url]:
+                    sources.setdefault(target, set()).add(url)
+            while len(self.entries) > self.size:
+                (old, _), _ = self.entries.popitem(last=False)
+                self.remove(old)
+
+    def remove(self, url):
+        for key in [key for key in self.entries if key[0] == url]:
+            del self.entries[key]
+        for targets, sources in ((self.includes, self.included_from), (self.links, self.linked_from)):
+            for target in targets.pop(url, ()):
+                urls = sources.get(target)
+                if urls is not None:
+                    urls.discard(url)
+                    if not urls:
+                        del sources[target]
+
+    def evict(self, url, linking=False):
+        """
+            Removes the fragment of a page and every fragment including it.
+
+            :param bool linking: whether to remove the fragments linking to
+                the page and those including them as well
+        """
+        with self._lock:
+            pending = [url]
+            if linking:
+                pending.extend(self.linked_from.get(url, ()))
+            seen = set()
+            while pending:
+                url = pending.pop()
+                if url in seen:
+                    continue
+                seen.add(url)
+                pending.extend(self.included_from.get(url, ()))
+                self.remove(url)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            for dependencies in (self.includes, self.included_from, self.links, self.linked_from):
+                dependencies.clear()
+
+
+#: the fragments of this process
+fragments = FragmentCache(config.FRAGMENT_CACHE_SIZE)
+
+
+@page_changed.connect
+def evict_fragments(sender, url, event):
+    """
+        Evicts the fragments depending on a changed page.
+    """
+    fragments.evict(url, linking=event != 'modified')
+
+
+@pages_reset.connect
+def clear_fragments(sender):
+    fragments.clear()
@@ -0,0 +1,311 @@
+"""
+    History compaction
+    ~~~~~~~~~~~~~~~~~~
+
+    Keeps the user_history table small. Entries that have not been
+    accessed within the retention period expire, entries left behind by
+    renamed pages are merged into the entries of the new title, and every
+    user keeps at most a fixed number of entries.
+
+    All work is done in small batches, each in a transaction of its own,
+    so the database write lock is never held for long and pages can still
+    be viewed while a compaction runs. The time of the last compaction is
+    kept in the database, so of several worker processes sharing it only
+    one compacts per interval.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from datetime import timedelta
+
+import config
+from wiki.core import split_meta
+
+logger = logging.getLogger(__name__)
+
+CompactionResult = namedtuple('CompactionResult', ['expired', 'merged', 'dropped', 'trimmed'])
+
+
+def create_history_indexes(cursor):
+    """
+        Creates the indexes used by compaction and by the history queries
+        of autocomplete.
+
+        :param cursor: cursor of the database holding user_history
+    """
+    cursor.execute('''CREATE INDEX IF NOT EXISTS user_history_user_accessed
+                        ON user_history (user, date_last_accessed)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS user_history_accessed
+                        ON user_history (date_last_accessed)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS user_history_url
+                        ON user_history (url)''')
+
+
+def create_compaction_table(cursor):
+    """
+        Creates the table holding the time of the last compaction.
+
+        :param cursor: cursor of the database holding user_history
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS history_compaction (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        last_run REAL NOT NULL
+    )''')
+
+
+def claim_compaction(database, interval, now=None):
+    """
+        Records a compaction as started if none was within the interval.
+        Workers sharing the database race for the same row, so exactly one
+        of them gets to compact. The first claim only records the time, a
+        compaction waits for a full interval after the database is set up.
+
+        :param str database: the path of the database holding user_history
+        :param int interval: the seconds between two compactions
+        :param float now: the current time, defaults to the clock
+
+        :returns: whether the caller is to compact
+    """
+    now = time.time() if now is None else now
+    conn = sqlite3.connect(database)
+    try:
+        with conn:
+            conn.execute('''INSERT OR IGNORE INTO history_compaction (id, last_run)
+                            VALUES (1, ?)''', (now,))
+            return conn.execute('''UPDATE history_compaction SET last_run = ?
+                                    WHERE id = 1 AND last_run <= ?''', (now, now - interval)).rowcount == 1
+    finally:
+        conn.close()
+
+
+def delete_batched(conn, query, args, batch):
+    """
+        Runs a delete in batches until nothing is left to delete.
+
+        :param conn: connection to the database
+        :param str query: selects the ids of the rows to delete, must end
+            with a ``LIMIT ?`` that is bound to the batch size
+        :param tuple args: the arguments of the query
+        :param int batch: the number of rows deleted per transaction
+
+        :returns: the number of deleted rows
+    """
+    deleted = 0
+    while True:
+        with conn:
+            count = conn.execute('DELETE FROM user_history WHERE id IN (%s)' % query,
+                                 args + (batch,)).rowcount
+        deleted += count
+        if count < batch:
+            return deleted
+
+
+def expire_history(conn, cutoff, batch):
+    """
+        Removes the entries that were last accessed before a cutoff.
+
+        :param conn: connection to the database
+        :param datetime cutoff: the oldest access that is kept
+        :param int batch: the number of rows deleted per transaction
+
+        :returns: the number of removed entries
+    """
+    return delete_batched(conn, '''SELECT id FROM user_history
+                                    WHERE date_last_accessed < ? LIMIT ?''', (str(cutoff),), batch)
+
+
+def trim_history(conn, keep, batch):
+    """
+        Removes all but the most recently accessed entries of every user.
+
+        :param conn: connection to the database
+        :param int keep: the number of entries kept per user
+        :param int batch: the number of rows deleted per transaction
+
+        :returns: the number of removed entries
+    """
+    return delete_batched(conn, '''SELECT id FROM (
+                                        SELECT id, ROW_NUMBER() OVER (
+                                            PARTITION BY user ORDER BY date_last_accessed DESC, id DESC) AS position
+                                        FROM user_history)
+                                    WHERE position > ? LIMIT ?''', (keep,), batch)
+
+
+def resolve_title(conn, title, titles):
+    """
+        Finds the current title of a page that was once called title, from
+        the stored versions of the pages. The newest version with that
+        title decides, as urls of versions follow the page when it moves.
+
+        :param conn: connection to the database
+        :param str title: the old title
+        :param dict titles: the current title of every page by url
+
+        :returns: the current title, None if the page no longer exists
+    """
+    pattern = 'title:%' + title.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    rows = conn.execute('''SELECT url, content FROM wiki_pages
+                            WHERE content LIKE ? ESCAPE '\\'
+                            ORDER BY id DESC''', (pattern,))
+    for url, content in rows:
+        meta, _ = split_meta(content)
+        if meta.get('title') == title and url in titles:
+            return titles[url]
+    return None
+
+
+def merge_history(conn, titles, batch):
+    """
+        Moves the entries of titles that no longer exist to the current
+        title of their page and drops those of deleted pages. Entries of
+        a user for the same title are then merged into one, adding up the
+        access counts and keeping the latest access.
+
+        :param conn: connection to the database
+        :param dict titles: the current title of every page by url
+        :param int batch: the number of titles handled per transaction
+
+        :returns: the number of merged and dropped entries
+    """
+    current = set(titles.values())
+    orphans = [title for title, in conn.execute('SELECT DISTINCT url FROM user_history')
+               if title not in current]
+    # each title is a scan of the versions, done before any write so the
+    # transactions below only hold the write lock for their updates
+    resolved = [(title, resolve_title(conn, title, titles)) for title in orphans]
+    dropped = 0
+    for start in range(0, len(resolved), batch):
+        with conn:
+            for title, new_title in resolved[start:start + batch]:
+                if new_title is None:
+                    dropped += conn.execute('DELETE FROM user_history WHERE url = ?', (title,)).rowcount
+                else:
+                    conn.execute('UPDATE user_history SET url = ? WHERE url = ?', (new_title, title))
+
+    merged = 0
+    while True:
+        duplicates = conn.execute('''SELECT user, url, MIN(id), SUM(count_accessed), MAX(date_last_accessed)
+                                        FROM user_history
+                                        GROUP BY user, url
+                                        HAVING COUNT(*) > 1
+                                        LIMIT ?''', (batch,)).fetchall()
+        if not duplicates:
+            return merged, dropped
+        with conn:
+            for user, url, keep_id, count, accessed in duplicates:
+                conn.execute('''UPDATE user_history SET count_accessed = ?, date_last_accessed = ?
+                                WHERE id = ?''', (count, accessed, keep_id))
+                merged += conn.execute('''DELETE FROM user_history
+                                            WHERE user = ? AND url = ? AND id != ?''',
+                                       (user, url, keep_id)).rowcount
+
+
+def compact_history(database, titles, retention_days=None, keep=None, batch=None, now=None):
+    """
+        Expires, merges and trims the entries of user_history.
+
+        :param str database: the path of the database holding user_history
+        :param dict titles: the current title of every page by url
+        :param int retention_days: how long unused entries are kept,
+            defaults to HISTORY_RETENTION_DAYS
+        :param int keep: the number of entries kept per user, defaults
+            to HISTORY_MAX_PER_USER
+        :param int batch: the number of rows or titles handled per
+            transaction, defaults to HISTORY_COMPACT_BATCH
+        :param datetime now: the current time, defaults to the clock
+
+        :rtype: CompactionResult
+    """
+    retention_days = config.HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+    keep = config.HISTORY_MAX_PER_USER if keep is None else keep
+    batch = config.HISTORY_COMPACT_BATCH if batch is None else batch
+    now = datetime.now() if now is None else now
+    conn = sqlite3.connect(database)
+    try:
+        expired = expire_history(conn, now - timedelta(days=retention_days), batch)
+        merged, dropped = merge_history(conn, titles, batch)
+        trimmed = trim_history(conn, keep, batch)
+    finally:
+        conn.close()
+    return CompactionResult(expired, merged, dropped, trimmed)
+
+
+class HistoryCompactor(object):
+    """
+        Runs the compaction of a database in the background every
+        HISTORY_COMPACT_INTERVAL seconds, on the first request after the
+        interval has passed. A compaction never runs twice at a time in
+        one process, and only runs in the process that claims it in the
+        database, see :func:`claim_compaction`.
+
+        :param str database: the path of the database holding user_history
+    """
+
+    _compactors = {}
+    _compactors_lock = threading.Lock()
+
+    @classmethod
+    def for_database(cls, database):
+        """
+            Returns the shared compactor of a database, so the interval
+            holds across requests.
+
+            :param str database: the path of the database holding user_history
+        """
+        with cls._compactors_lock:
+            compactor = cls._compactors.get(database)
+            if compactor is None:
+                compactor = cls._compactors[database] = cls(database)
+            return compactor
+
+    def __init__(self, database):
+        self.database = database
+        # the first compaction waits for a full interval after start up
+        self.last_run = time.monotonic()
+        self.result = None
+        self._lock = threading.Lock()
+
+    def is_due(self):
+        interval = config.HISTORY_COMPACT_INTERVAL
+        return bool(interval) and time.monotonic() - self.last_run >= interval
+
+    def run(self, titles):
+        """
+            Compacts the database unless a compaction is already running
+            or another process compacted it within the interval.
+
+            :param titles: callable returning the current title of every
+                page by url
+
+            :returns: the result, None if nothing was compacted
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            self.last_run = time.monotonic()
+            try:
+                claimed = claim_compaction(self.database, config.HISTORY_COMPACT_INTERVAL)
+            except sqlite3.OperationalError as error:
+                # e.g. locked, the next interval tries again
+                logger.warning('Cannot claim the history compaction of %s: %s', self.database, error)
+                return None
+            if not claimed:
+                return None
+            self.result = compact_history(self.database, titles())
+            return self.result
+        finally:
+            self._lock.release()
+
+    def maybe_run(self, titles):
+        """
+            Starts a compaction in a background thread if one is due.
+
+            :param titles: callable returning the current title of every
+                page by url
+        """
+        if self.is_due() and not self._lock.locked():
+            self.last_run = time.monotonic()
+            threading.Thread(target=self.run, args=(titles,), daemon=True).start()
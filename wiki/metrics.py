@@ -0,0 +1,307 @@
+"""
+    Metrics
+    ~~~~~~~
+
+    A small instrumentation layer exposing where requests spend their
+    time, in the Prometheus text format at ``/metrics``:
+
+    * the latency of every route,
+    * the time spent in each stage of :meth:`wiki.core.Processor.process`,
+    * the number and duration of the queries of every request made
+      through :func:`wiki.core.connect_to_db`,
+    * the hits and misses of the caches.
+
+    Nothing is measured unless METRICS_ENABLED is set, every instrumented
+    spot only checks :attr:`Registry.enabled` then.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+import sqlite3
+
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import request
+
+#: default buckets for durations in seconds
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#: buckets for the number of queries of a request
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, escape_label(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+        Base of the metrics, a value per combination of label values.
+
+        :param str name: the name of the metric
+        :param str documentation: the help text
+        :param tuple labels: the names of the labels
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return ['# HELP %s %s' % (self.name, self.documentation),
+                '# TYPE %s %s' % (self.name, self.type)]
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    """
+        A value that only goes up.
+    """
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append('%s%s %s' % (self.name, format_labels(self.labels, key), format_value(value)))
+        return lines
+
+
+class Histogram(Metric):
+    """
+        Counts observations in cumulative buckets, with their sum.
+
+        :param tuple buckets: the upper bounds of the buckets
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket, then +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        counts = self.values.get(tuple(labels[name] for name in self.labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            for key, counts in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (
+                        self.name, format_labels(self.labels, key, 'le="%s"' % format_value(bound)), cumulative))
+                lines.append('%s_sum%s %s' % (self.name, format_labels(self.labels, key), format_value(counts[-1])))
+                lines.append('%s_count%s %d' % (self.name, format_labels(self.labels, key), cumulative))
+        return lines
+
+
+class Registry(object):
+    """
+        Holds the metrics and the collectors of values that are only
+        computed when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        """
+            Registers a function returning ``(name, type, documentation,
+            samples)`` tuples, samples being ``(labels, value)`` pairs.
+        """
+        self.collectors.append(function)
+        return function
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        """
+            Returns every metric in the Prometheus text format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append('# HELP %s %s' % (name, documentation))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for labels, value in samples:
+                    lines.append('%s%s %s' % (name, format_labels(list(labels), list(labels.values())),
+                                              format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    'riki_request_duration_seconds', 'Time to handle a request.', ('endpoint', 'method')))
+RENDER_STAGE_DURATION = registry.register(Histogram(
+    'riki_render_stage_duration_seconds', 'Time spent in each stage of rendering a page.', ('stage',)))
+REQUEST_QUERIES = registry.register(Histogram(
+    'riki_request_queries', 'Database queries issued per request.', ('endpoint',), COUNT_BUCKETS))
+REQUEST_QUERY_DURATION = registry.register(Histogram(
+    'riki_request_query_duration_seconds', 'Time spent in database queries per request.', ('endpoint',)))
+QUERIES = registry.register(Counter(
+    'riki_queries_total', 'Database queries issued.'))
+CACHE_REQUESTS = registry.register(Counter(
+    'riki_cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result')))
+
+
+@registry.collector
+def cache_hit_ratios():
+    samples = []
+    caches = sorted({key[0] for key in CACHE_REQUESTS.values})
+    for cache in caches:
+        hits = CACHE_REQUESTS.get(cache=cache, result='hit')
+        total = hits + CACHE_REQUESTS.get(cache=cache, result='miss')
+        samples.append(({'cache': cache}, hits / total if total else 0.0))
+    return [('riki_cache_hit_ratio', 'gauge', 'Share of cache lookups that were hits.', samples)]
+
+
+def cache_lookup(cache, hit):
+    """
+        Counts a lookup of a cache, if metrics are enabled.
+
+        :param str cache: the name of the cache
+        :param bool hit: whether the lookup was a hit
+    """
+    if registry.enabled:
+        CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+def record_query(seconds):
+    QUERIES.inc()
+    if has_request_context():
+        stats = g.get('_query_stats')
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += seconds
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+        A cursor recording the duration of every statement it executes.
+    """
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursor, self).execute(*args)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursor, self).executemany(*args)
+        finally:
+            record_query(time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+        A connection whose cursors are :class:`TimedCursor`.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super(TimedConnection, self).cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+
+def start_request():
+    if registry.enabled:
+        g._request_started = time.perf_counter()
+        g._query_stats = [0, 0.0]
+
+
+def finish_request(response):
+    started = g.get('_request_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_DURATION.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        count, seconds = g._query_stats
+        REQUEST_QUERIES.observe(count, endpoint=endpoint)
+        REQUEST_QUERY_DURATION.observe(seconds, endpoint=endpoint)
+    return response
+
+
+def metrics_view():
+    return current_app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """
+        Enables the metrics if METRICS_ENABLED is set in the config of the
+        app and serves them at ``/metrics``.
+    """
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    registry.enabled = True
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
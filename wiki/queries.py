@@ -0,0 +1,128 @@
+"""
+    Query recorder
+    ~~~~~~~~~~~~~~
+
+    Records every SQL statement the current thread issues, whichever
+    module opens the connection, so tests can hold routes to a query
+    budget and catch statements repeated once per item of a loop::
+
+        with record_queries() as queries:
+            client.get('/lions/')
+        queries.check(max_queries=6)
+
+    Transaction control statements are not counted, nor are statements on
+    connections opened before the block and kept open, e.g. the lookup of
+    the latest generation on the change log connection of
+    :class:`~wiki.coherence.CacheCoherence` before every request.
+"""
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from unittest.mock import patch
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_spaces = re.compile(r'\s+')
+_transaction = re.compile(r'^\s*(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+
+
+def statement_shape(statement):
+    """
+        Returns a statement without its literal values and with its
+        whitespace collapsed, the same for every execution of a query.
+    """
+    return _spaces.sub(' ', _literals.sub('?', statement)).strip()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder(object):
+    """
+        The statements and connections recorded in a thread.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.connections = 0
+        self.thread = threading.get_ident()
+
+    def __len__(self):
+        return len(self.statements)
+
+    def trace(self, statement):
+        if not _transaction.match(statement):
+            self.statements.append(statement)
+
+    def shapes(self):
+        """
+            Returns how often each statement shape was issued.
+        """
+        return Counter(statement_shape(statement) for statement in self.statements)
+
+    def repeated(self, threshold=2):
+        """
+            Returns the shapes issued at least threshold times, the sign of
+            a query run once per item instead of once for all items.
+        """
+        return {shape: count for shape, count in self.shapes().items() if count >= threshold}
+
+    def report(self):
+        lines = ['%d statements on %d connections:' % (len(self.statements), self.connections)]
+        lines.extend('  %s' % statement_shape(statement) for statement in self.statements)
+        for shape, count in sorted(self.repeated().items()):
+            lines.append('repeated %d times: %s' % (count, shape))
+        return '\n'.join(lines)
+
+    def check(self, max_queries=None, max_connections=None, allow_repeated=False):
+        """
+            Raises :class:`QueryBudgetExceeded` when more statements or
+            connections than allowed were recorded or, unless allowed, a
+            statement shape was repeated.
+
+            :param int max_queries: the maximum number of statements
+            :param int max_connections: the maximum number of connections
+            :param bool allow_repeated: whether repeated shapes are fine
+        """
+        if max_queries is not None and len(self.statements) > max_queries:
+            raise QueryBudgetExceeded('More than %d statements issued.\n%s' % (max_queries, self.report()))
+        if max_connections is not None and self.connections > max_connections:
+            raise QueryBudgetExceeded('More than %d connections opened.\n%s' % (max_connections, self.report()))
+        if not allow_repeated and self.repeated():
+            raise QueryBudgetExceeded('Statements repeated, likely once per item.\n%s' % self.report())
+
+
+@contextmanager
+def record_queries():
+    """
+        Records the statements issued by the current thread on the
+        connections it opens until the block ends.
+
+        :returns: the recorder, filled as statements are issued
+        :rtype: QueryRecorder
+    """
+    recorder = QueryRecorder()
+    connect = sqlite3.connect
+    connections = []
+
+    def recording_connect(*args, **kwargs):
+        connection = connect(*args, **kwargs)
+        # background workers run their own queries meanwhile
+        if threading.get_ident() == recorder.thread:
+            recorder.connections += 1
+            connection.set_trace_callback(recorder.trace)
+            connections.append(connection)
+        return connection
+
+    try:
+        with patch.object(sqlite3, 'connect', recording_connect):
+            yield recorder
+    finally:
+        # connections kept open, e.g. per thread, stop recording
+        for connection in connections:
+            try:
+                connection.set_trace_callback(None)
+            except sqlite3.ProgrammingError:
+                pass
@@ -0,0 +1,281 @@
+"""
+    Page records
+    ~~~~~~~~~~~~
+
+    Compact records of the url, title and tags of every page, for the
+    listings, the tag pages and autocomplete, which never need the content
+    of a page. A :class:`~wiki.core.Page` holds the raw content, the body,
+    the rendered html and its meta data, a record only what is listed, in
+    slots: the index of a wiki of 200k pages takes tens of megabytes
+    instead of gigabytes. The name of every tag is stored once per index,
+    records refer to their tags by number.
+
+    The records are also kept in a tree of namespaces, the folders of the
+    urls, each knowing how many pages it holds, so a namespace is listed
+    without looking at the rest of the wiki.
+"""
+import sys
+from collections import namedtuple
+
+from wiki.search import RootIndex
+
+
+class TagTable(object):
+    """
+        Numbers the tag names of an index. Numbers are never reused, tags
+        no longer used by any page keep theirs.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def id(self, name):
+        number = self.ids.get(name)
+        if number is None:
+            number = self.ids[name] = len(self.names)
+            self.names.append(sys.intern(name))
+        return number
+
+
+def split_tags(tags):
+    """
+        Returns the distinct tags of the comma separated tags of a page, in
+        their order.
+
+        :param str tags: the ``tags`` meta data of a page
+    """
+    names = []
+    for tag in tags.split(','):
+        tag = tag.strip()
+        if tag and tag not in names:
+            names.append(tag)
+    return names
+
+
+class PageRecord(object):
+    """
+        What the listings need of a page. Templates use it like a
+        :class:`~wiki.core.Page`, call :meth:`promote` for the rest.
+
+        :param str url: the url of the page
+        :param str title: the title of the page
+        :param tuple tag_ids: the numbers of its tags in the table
+        :param TagTable table: the tags of the index the record belongs to
+    """
+
+    __slots__ = ('url', 'title', 'tag_ids', 'table')
+
+    def __init__(self, url, title, tag_ids, table):
+        self.url = url
+        self.title = title
+        self.tag_ids = tag_ids
+        self.table = table
+
+    def __repr__(self):
+        return "<PageRecord: {}>".format(self.url)
+
+    @property
+    def tag_names(self):
+        return tuple(self.table.names[number] for number in self.tag_ids)
+
+    @property
+    def tags(self):
+        """
+            The tags joined like the ``tags`` meta data of a page.
+        """
+        return ', '.join(self.tag_names)
+
+    def promote(self, wiki):
+        """
+            Loads and renders the full page of the record.
+
+            :param wiki: the :class:`~wiki.core.Wiki` of the record
+
+            :returns: the page, None if it was deleted meanwhile
+            :rtype: :class:`~wiki.core.Page`
+        """
+        return wiki.get(self.url)
+
+
+#: a page or namespace directly in a namespace, with the number of pages in
+#: it if it is a namespace; a page may have the url of a namespace too
+NamespaceEntry = namedtuple('NamespaceEntry', ['name', 'url', 'page', 'count'])
+
+
+class Namespace(object):
+    """
+        A folder of pages.
+    """
+
+    __slots__ = ('folders', 'pages', 'count')
+
+    def __init__(self):
+        self.folders = {}
+        self.pages = {}
+        #: the number of pages in the namespace and the namespaces below
+        self.count = 0
+
+
+def join_url(prefix, name):
+    return '%s/%s' % (prefix, name) if prefix else name
+
+
+class PageIndex(RootIndex):
+    """
+        The records of every page of a content directory, kept sorted by
+        title. It is built from the page headers, nothing is rendered.
+    """
+
+    def __init__(self, root):
+        super(PageIndex, self).__init__(root)
+        self.table = TagTable()
+        self.sorted = None
+        self.tree = None
+
+    def load(self):
+        self.tree = Namespace()
+        super(PageIndex, self).load()
+
+    def add(self, url):
+        meta, _ = self.read(url)
+        tag_ids = tuple(self.table.id(tag) for tag in split_tags(meta.get('tags', '')))
+        url = sys.intern(url)
+        record = self.docs[url] = PageRecord(url, meta.get('title') or url, tag_ids, self.table)
+        self.sorted = None
+        *folders, name = url.split('/')
+        namespace = self.tree
+        namespace.count += 1
+        for folder in folders:
+            namespace = namespace.folders.setdefault(folder, Namespace())
+            namespace.count += 1
+        namespace.pages[name] = record
+
+    def remove(self, url):
+        if self.docs.pop(url, None) is None:
+            return
+        self.sorted = None
+        *folders, name = url.split('/')
+        namespace = self.tree
+        namespace.count -= 1
+        for folder in folders:
+            parent, namespace = namespace, namespace.folders[folder]
+            namespace.count -= 1
+            if not namespace.count:
+                # the namespace holds nothing else, drop it whole
+                del parent.folders[folder]
+                return
+        del namespace.pages[name]
+
+    def records(self):
+        """
+            Returns the record of every page sorted by title.
+
+            :rtype: list of :class:`PageRecord`
+        """
+        with self._lock:
+            if self.docs is None:
+                self.load()
+            if self.sorted is None:
+                self.sorted = sorted(self.docs.values(), key=lambda record: record.title.lower())
+            return list(self.sorted)
+
+    def get(self, url):
+        """
+            Returns the record of a page, None if it does not exist.
+        """
+        with self._lock:
+            if self.docs is None:
+                self.load()
+            return self.docs.get(url)
+
+    def exists(self, url):
+        """
+            Tells whether a page exists without touching the disk, e.g. for
+            every wikilink of a rendered page.
+        """
+        with self._lock:
+            if self.docs is None:
+                self.load()
+            return url in self.docs
+
+    def namespace(self, prefix):
+        """
+            Returns the namespace of a prefix, None if there is no page in
+            it. The empty prefix is the namespace of the whole wiki.
+
+            :param str prefix: the url of the namespace
+        """
+        with self._lock:
+            if self.docs is None:
+                self.load()
+            namespace = self.tree
+            for folder in filter(None, prefix.split('/')):
+                namespace = namespace.folders.get(folder)
+                if namespace is None:
+                    return None
+            return namespace
+
+    def children(self, prefix):
+        """
+            Lists the pages and namespaces directly in a namespace, sorted
+            by name. Only the namespace itself is looked at.
+
+            :param str prefix: the url of the namespace
+
+            :returns: the entries, None if there is no such namespace
+            :rtype: list of :class:`NamespaceEntry`
+        """
+        prefix = prefix.strip('/')
+        with self._lock:
+            namespace = self.namespace(prefix)
+            if namespace is None:
+                return None
+            entries = [NamespaceEntry(name, join_url(prefix, name), namespace.pages.get(name), folder.count)
+                       for name, folder in namespace.folders.items()]
+            entries.extend(NamespaceEntry(name, join_url(prefix, name), page, 0)
+                           for name, page in namespace.pages.items() if name not in namespace.folders)
+        return sorted(entries, key=lambda entry: (entry.name.lower(), entry.name))
+
+    def below(self, prefix):
+        """
+            Returns the urls of the page of a prefix and of every page
+            below it, only looking at that part of the tree.
+
+            :param str prefix: the url of the namespace
+        """
+        prefix = prefix.strip('/')
+        with self._lock:
+            namespace = self.namespace(prefix)
+            urls = [prefix] if prefix in self.docs else []
+            stack = [namespace] if namespace is not None else []
+            while stack:
+                namespace = stack.pop()
+                urls.extend(record.url for record in namespace.pages.values())
+                stack.extend(namespace.folders.values())
+        return urls
+
+    def tagged(self, tag):
+        """
+            Returns the records of the pages having a tag, sorted by title.
+
+            :param str tag: the name of the tag
+        """
+        records = self.records()
+        number = self.table.ids.get(tag)
+        if number is None:
+            return []
+        return [record for record in records if number in record.tag_ids]
+
+    def by_tag(self):
+        """
+            Returns the records of the pages of every used tag, each sorted
+            by title.
+
+            :rtype: dict
+        """
+        tags = {}
+        for record in self.records():
+            for name in record.tag_names:
+                tags.setdefault(name, []).append(record)
+        return tags
@@ -0,0 +1,99 @@
+"""
+    Regex search worker
+    ~~~~~~~~~~~~~~~~~~~
+
+    Searches pages for a regular expression in a process of its own, so
+    the web server can kill it when it takes too long. It is started as a
+    script by :class:`wiki.search.RegexSearch` and must not import the
+    wiki package, which would make every search pay for importing flask
+    and markdown.
+
+    The job is read from stdin as json, with the ``pattern``, its
+    ``flags``, the ``max_page_size``, the snippet ``width`` and the
+    content directory ``root``. Pages are read one at a time while walking
+    the directory and every matching page is written to stdout as one json
+    line as soon as it is found, so the first results arrive long before
+    a large wiki has been searched.
+"""
+import itertools
+import json
+import os
+import re
+import sys
+
+
+def walk(root):
+    """
+        Yields the url and path of every page, the same way as
+        :meth:`wiki.core.Wiki.walk`.
+    """
+    root = os.path.abspath(root)
+    for cur_dir, _, files in os.walk(root):
+        cur_dir_url = cur_dir[len(root)+1:]
+        for cur_file in files:
+            if cur_file.endswith('.md'):
+                url = os.path.join(cur_dir_url, cur_file[:-3])
+                url = re.sub('[ ]{2,}', ' ', url).strip().lower().replace(' ', '_')
+                url = url.replace('\\\\', '/').replace('\\', '/')
+                yield url, os.path.join(cur_dir, cur_file)
+
+
+def split_meta(text):
+    """
+        Splits raw page content into its meta data and markdown body, the
+        same way as :func:`wiki.core.split_meta`.
+    """
+    meta_raw, _, body = text.replace('\r\n', '\n').partition('\n\n')
+    meta = {}
+    for line in meta_raw.split('\n'):
+        key, sep, value = line.partition(':')
+        if sep:
+            meta[key.strip().lower()] = value.strip()
+    return meta, body
+
+
+def clip(text, position, width):
+    """
+        Chooses a window of about width characters of text around a
+        position, the same way as :func:`wiki.search.clip`.
+    """
+    start = max(0, position - width // 3)
+    if start > 0:
+        space = text.rfind(' ', 0, start)
+        start = space + 1 if space != -1 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.find(' ', end)
+        end = space if space != -1 else end
+    return start, end
+
+
+def scan(job, output):
+    """
+        Searches the pages of a job and writes every match to output.
+    """
+    regex = re.compile(job['pattern'], job['flags'])
+    max_page_size = job['max_page_size']
+    width = job['width']
+    for url, path in walk(job['root']):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                meta, body = split_meta(f.read(max_page_size + 4096))
+        except (IOError, UnicodeDecodeError):
+            continue
+        title = meta.get('title') or url
+        for text in (title, meta.get('tags', ''), body[:max_page_size]):
+            match = regex.search(text)
+            if match:
+                start, end = clip(text, match.start(), width)
+                spans = [(m.start() - start, m.end() - start)
+                         for m in itertools.islice(regex.finditer(text, start, end), 20)
+                         if m.end() > m.start()]
+                output.write(json.dumps([url, title, text[start:end], spans,
+                                         start > 0, end < len(text)]) + '\n')
+                output.flush()
+                break
+
+
+if __name__ == '__main__':
+    scan(json.load(sys.stdin), sys.stdout)
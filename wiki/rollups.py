@@ -0,0 +1,313 @@
+"""
+    Popularity rollups
+    ~~~~~~~~~~~~~~~~~~
+
+    Page views are counted into small rollup tables while they are
+    recorded: per hour, per day, in total and per user, where only the
+    USER_VIEWS_KEEP most viewed pages of every user are kept. The most viewed
+    pages of a time window are answered from these counters instead of
+    from user_history, and the rankings are kept in memory between
+    refreshes, so asking for them costs the same however many views and
+    pages there are.
+"""
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import config
+from wiki.core import connect_to_db
+from wiki.core import tree_range
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+#: the windows that can be ranked, with the rollup table, its time
+#: column, the length of its buckets and how many buckets are summed
+WINDOWS = {
+    'hour': ('page_views_hourly', 'hour', HOUR, 1),
+    'day': ('page_views_hourly', 'hour', HOUR, 24),
+    'week': ('page_views_daily', 'day', DAY, 7),
+    'month': ('page_views_daily', 'day', DAY, 30),
+    'all': ('page_views_total', None, None, None),
+}
+
+#: how many buckets are kept before they are pruned
+KEEP_HOURS = 48
+KEEP_DAYS = 31
+
+PopularPage = namedtuple('PopularPage', ['url', 'views'])
+
+
+def create_rollup_tables(cursor):
+    """
+        Creates the rollup tables if they do not exist yet.
+
+        :param cursor: cursor of the wiki database
+    """
+    cursor.execute('''CREATE TABLE IF NOT EXISTS page_views_hourly (
+                        hour INTEGER NOT NULL,
+                        url TEXT NOT NULL,
+                        views INTEGER NOT NULL,
+                        PRIMARY KEY (hour, url)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS page_views_daily (
+                        day INTEGER NOT NULL,
+                        url TEXT NOT NULL,
+                        views INTEGER NOT NULL,
+                        PRIMARY KEY (day, url)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS page_views_total (
+                        url TEXT PRIMARY KEY,
+                        views INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS page_views_total_views
+                        ON page_views_total (views DESC)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_page_views (
+                        user TEXT NOT NULL,
+                        url TEXT NOT NULL,
+                        views INTEGER NOT NULL,
+                        PRIMARY KEY (user, url)
+    ) WITHOUT ROWID''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS user_page_views_top
+                        ON user_page_views (user, views DESC)''')
+
+
+_pruned = {'hour': None}
+
+
+def prune_rollups(cursor, now=None):
+    """
+        Removes the hourly and daily buckets that are too old to be part
+        of any window, and all but the USER_VIEWS_KEEP most viewed pages
+        of every user.
+
+        :param cursor: cursor of the wiki database
+        :param float now: the current time, defaults to the clock
+    """
+    now = time.time() if now is None else now
+    cursor.execute('DELETE FROM page_views_hourly WHERE hour <= ?',
+                   (int(now // HOUR) - KEEP_HOURS,))
+    cursor.execute('DELETE FROM page_views_daily WHERE day <= ?',
+                   (int(now // DAY) - KEEP_DAYS,))
+    cursor.execute('''DELETE FROM user_page_views WHERE (user, url) IN (
+                        SELECT user, url FROM (
+                            SELECT user, url, ROW_NUMBER() OVER (
+                                PARTITION BY user ORDER BY views DESC, url) AS position
+                            FROM user_page_views)
+                        WHERE position > ?)''', (config.USER_VIEWS_KEEP,))
+
+
+def count_view(cursor, url, user, now=None):
+    """
+        Counts a view of a page in every rollup, without committing, so
+        it can share a transaction with other writes of the request. Old
+        buckets are pruned once an hour.
+
+        :param cursor: cursor of the wiki database
+        :param str url: the url of the viewed page
+        :param str user: the name of the viewing user
+        :param float now: the time of the view, defaults to the clock
+    """
+    now = time.time() if now is None else now
+    hour = int(now // HOUR)
+    cursor.execute('''INSERT INTO page_views_hourly (hour, url, views) VALUES (?, ?, 1)
+                        ON CONFLICT (hour, url) DO UPDATE SET views = views + 1''', (hour, url))
+    cursor.execute('''INSERT INTO page_views_daily (day, url, views) VALUES (?, ?, 1)
+                        ON CONFLICT (day, url) DO UPDATE SET views = views + 1''', (int(now // DAY), url))
+    cursor.execute('''INSERT INTO page_views_total (url, views) VALUES (?, 1)
+                        ON CONFLICT (url) DO UPDATE SET views = views + 1''', (url,))
+    cursor.execute('''INSERT INTO user_page_views (user, url, views) VALUES (?, ?, 1)
+                        ON CONFLICT (user, url) DO UPDATE SET views = views + 1''', (user, url))
+    if _pruned['hour'] != hour:
+        prune_rollups(cursor, now)
+        _pruned['hour'] = hour
+
+
+def record_view(url, user, now=None):
+    """
+        Counts a view of a page in every rollup, in a single transaction,
+        see :func:`count_view`.
+
+        :param str url: the url of the viewed page
+        :param str user: the name of the viewing user
+        :param float now: the time of the view, defaults to the clock
+    """
+    conn, cursor = connect_to_db()
+    try:
+        count_view(cursor, url, user, now)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def move_views(url, newurl):
+    """
+        Moves the views counted for a page to its new url, adding them to
+        any views already counted there.
+
+        :param str url: the old url of the page
+        :param str newurl: the new url of the page
+    """
+    conn, cursor = connect_to_db()
+    try:
+        for table, key in (('page_views_hourly', 'hour'), ('page_views_daily', 'day'),
+                           ('page_views_total', None), ('user_page_views', 'user')):
+            if key:
+                columns, source = key + ', url', key + ', ?'
+            else:
+                columns, source = 'url', '?'
+            cursor.execute('''INSERT INTO %s (%s, views)
+                                SELECT %s, views FROM %s WHERE url = ?
+                                ON CONFLICT (%s) DO UPDATE SET views = views + excluded.views'''
+                           % (table, columns, source, table, columns), (newurl, url))
+            cursor.execute('DELETE FROM %s WHERE url = ?' % table, (url,))
+        conn.commit()
+    except sqlite3.OperationalError:
+        # no views recorded yet
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def move_tree_views(cursor, prefix, newprefix):
+    """
+        Moves the views counted for a page and every page below it, like
+        :func:`move_views` does for a single page, without committing.
+
+        :param cursor: cursor of the transaction moving the pages
+        :param str prefix: the url of the namespace being moved
+        :param str newprefix: the url the namespace is moved to
+    """
+    low, high = tree_range(prefix)
+    below = 'url = ? OR (url >= ? AND url < ?)'
+    for table, key in (('page_views_hourly', 'hour'), ('page_views_daily', 'day'),
+                       ('page_views_total', None), ('user_page_views', 'user')):
+        if key:
+            columns, source = key + ', url', key + ', ? || substr(url, ?)'
+        else:
+            columns, source = 'url', '? || substr(url, ?)'
+        try:
+            cursor.execute('''INSERT INTO %s (%s, views)
+                                SELECT %s, views FROM %s WHERE %s
+                                ON CONFLICT (%s) DO UPDATE SET views = views + excluded.views'''
+                           % (table, columns, source, table, below, columns),
+                           (newprefix, len(prefix) + 1, prefix, low, high))
+        except sqlite3.OperationalError:
+            # no views recorded yet
+            continue
+        cursor.execute('DELETE FROM %s WHERE %s' % (table, below), (prefix, low, high))
+
+
+def top_pages(cursor, window, limit, now=None):
+    """
+        Ranks the pages by their views in a window, from the rollups.
+
+        :param cursor: cursor of the wiki database
+        :param str window: one of :data:`WINDOWS`
+        :param int limit: the maximum number of pages
+        :param float now: the current time, defaults to the clock
+
+        :rtype: list of :class:`PopularPage`
+    """
+    table, column, length, buckets = WINDOWS[window]
+    if column is None:
+        cursor.execute('''SELECT url, views FROM page_views_total
+                            ORDER BY views DESC, url LIMIT ?''', (limit,))
+    else:
+        now = time.time() if now is None else now
+        cursor.execute('''SELECT url, SUM(views) FROM %s
+                            WHERE %s > ?
+                            GROUP BY url
+                            ORDER BY SUM(views) DESC, url LIMIT ?''' % (table, column),
+                       (int(now // length) - buckets, limit))
+    return [PopularPage(url, views) for url, views in cursor.fetchall()]
+
+
+def user_top_pages(user, limit=10):
+    """
+        Returns the pages a user has viewed most, from the per user
+        counters.
+
+        :param str user: the name of the user
+        :param int limit: the maximum number of pages
+
+        :rtype: list of :class:`PopularPage`
+    """
+    conn, cursor = connect_to_db()
+    try:
+        cursor.execute('''SELECT url, views FROM user_page_views
+                            WHERE user = ?
+                            ORDER BY views DESC LIMIT ?''', (user, limit))
+        return [PopularPage(url, views) for url, views in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+class PopularPages(object):
+    """
+        The rankings of every window of a database, kept in memory and
+        refreshed from the rollups at most every POPULAR_REFRESH seconds.
+        Only the top POPULAR_TOP pages of each window are kept.
+
+        :param str database: the path of the wiki database
+    """
+
+    _rankings = {}
+    _rankings_lock = threading.Lock()
+
+    @classmethod
+    def for_database(cls, database):
+        """
+            Returns the shared rankings of a database, so the refresh
+            interval holds across requests.
+
+            :param str database: the path of the wiki database
+        """
+        with cls._rankings_lock:
+            rankings = cls._rankings.get(database)
+            if rankings is None:
+                rankings = cls._rankings[database] = cls(database)
+            return rankings
+
+    def __init__(self, database):
+        self.database = database
+        self.windows = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, window):
+        """
+            Reloads the ranking of a window from the rollups.
+            The new ranking is swapped in as a whole.
+
+            :param str window: one of :data:`WINDOWS`
+        """
+        conn = sqlite3.connect(self.database)
+        try:
+            pages = top_pages(conn.cursor(), window, config.POPULAR_TOP)
+        except sqlite3.OperationalError:
+            # no views recorded yet
+            pages = []
+        finally:
+            conn.close()
+        self.windows[window] = (pages, time.monotonic())
+        return pages
+
+    def get(self, window, limit):
+        """
+            Returns the most viewed pages of a window.
+
+            :param str window: one of :data:`WINDOWS`
+            :param int limit: the maximum number of pages
+
+            :raises ValueError: if the window is unknown
+        """
+        if window not in WINDOWS:
+            raise ValueError('Unknown window: %s' % window)
+        pages, loaded_at = self.windows.get(window, (None, None))
+        if pages is None or time.monotonic() - loaded_at >= config.POPULAR_REFRESH:
+            with self._lock:
+                pages, loaded_at = self.windows.get(window, (None, None))
+                if pages is None or time.monotonic() - loaded_at >= config.POPULAR_REFRESH:
+                    pages = self.refresh(window)
+        return pages[:limit]
@@ -0,0 +1,617 @@
+"""
+    Search
+    ~~~~~~
+"""
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from abc import ABCMeta
+from abc import abstractmethod
+from collections import Counter
+from collections import defaultdict
+from collections import namedtuple
+from io import open
+from queue import Empty
+from queue import Queue
+
+from markupsafe import Markup
+from markupsafe import escape
+
+import config
+from wiki.core import Wiki
+from wiki.core import split_meta
+from wiki.signals import page_changed
+from wiki.signals import pages_reset
+
+TOKEN_RE = re.compile(r'\w+', re.U)
+
+#: the ways a search term can be interpreted
+MODES = (
+    ('word', 'Words'),
+    ('literal', 'Exact text'),
+    ('regex', 'Regular expression'),
+)
+
+#: fields of a page that are searched, in the order of the term frequencies
+FIELDS = ('title', 'tags', 'body')
+
+SearchHit = namedtuple('SearchHit', ['url', 'title', 'score', 'snippet'])
+
+
+def tokenize(text):
+    """
+        Splits text into lowercase word tokens.
+
+        :param str text: the text to split
+
+        :returns: the tokens in order of appearance
+        :rtype: list
+    """
+    return TOKEN_RE.findall(text.lower())
+
+
+def clip(text, position, width):
+    """
+        Chooses a window of about width characters of text around a
+        position, without cutting words in half.
+
+        :param str text: the text to clip
+        :param int position: the position that has to be inside the window
+        :param int width: the approximate length of the window
+
+        :returns: the start and end of the window
+        :rtype: tuple
+    """
+    start = max(0, position - width // 3)
+    if start > 0:
+        space = text.rfind(' ', 0, start)
+        start = space + 1 if space != -1 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.find(' ', end)
+        end = space if space != -1 else end
+    return start, end
+
+
+def highlight(excerpt, spans, clipped_left=False, clipped_right=False):
+    """
+        Escapes an excerpt and wraps the given spans in ``<strong>``.
+
+        :param str excerpt: the text to highlight
+        :param list spans: sorted ``(start, end)`` offsets into excerpt
+        :param bool clipped_left: whether text was cut before the excerpt
+        :param bool clipped_right: whether text was cut after the excerpt
+
+        :returns: the highlighted excerpt
+        :rtype: Markup
+    """
+    parts = []
+    position = 0
+    for start, end in spans:
+        if start < position:
+            continue
+        parts.append(escape(excerpt[position:start]))
+        parts.append(Markup('<strong>%s</strong>') % excerpt[start:end])
+        position = end
+    parts.append(escape(excerpt[position:]))
+    snippet = Markup('').join(parts)
+    if clipped_left:
+        snippet = Markup('&hellip;') + snippet
+    if clipped_right:
+        snippet = snippet + Markup('&hellip;')
+    return snippet
+
+
+def make_snippet(text, pattern, width=160):
+    """
+        Extracts a short excerpt of raw markdown around the first match
+        of pattern and highlights every match inside it. Only use this
+        with patterns built by the wiki, never with user regexes.
+
+        :param str text: the raw markdown body of a page
+        :param pattern: the compiled pattern of the terms to highlight
+        :param int width: the approximate length of the snippet
+
+        :returns: the escaped snippet with matches wrapped in ``<strong>``
+        :rtype: Markup
+    """
+    match = pattern.search(text)
+    start, end = clip(text, match.start() if match else 0, width)
+    spans = [(m.start() - start, m.end() - start)
+             for m in pattern.finditer(text, start, end) if m.end() > m.start()]
+    return highlight(text[start:end], spans, start > 0, end < len(text))
+
+
+def terms_pattern(terms):
+    """
+        Compiles a pattern matching any of the terms as a whole word.
+
+        :param list terms: the lowercase terms
+    """
+    if not terms:
+        # matches nothing
+        return re.compile(r'(?!)')
+    return re.compile(r'\b(%s)\b' % '|'.join(re.escape(term) for term in terms),
+                      re.IGNORECASE | re.U)
+
+
+class SearchResults(object):
+    """
+        One page of search results.
+
+        :param list hits: the :class:`SearchHit` of this page of results
+        :param int total: the number of matching pages overall, None if
+            the search stopped before finding all of them
+        :param int offset: the position of the first hit in all results
+        :param int limit: the maximum number of hits per page
+        :param bool partial: whether the search ran out of time
+        :param bool more: whether there are hits after this page, only
+            needed when the total is unknown
+    """
+
+    def __init__(self, hits, total, offset, limit, partial=False, more=False):
+        self.hits = hits
+        self.total = total
+        self.offset = offset
+        self.limit = limit
+        self.partial = partial
+        self.more = more
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __getitem__(self, index):
+        return self.hits[index]
+
+    @property
+    def has_prev(self):
+        return self.offset > 0
+
+    @property
+    def has_next(self):
+        if self.total is None:
+            return self.more
+        return self.offset + len(self.hits) < self.total
+
+
+class RootIndex(metaclass=ABCMeta):
+    """
+        Base of the in-memory indexes over the pages of a content
+        directory. Indexes are shared by all requests of a process and
+        kept up to date page by page from the
+        :data:`~wiki.signals.page_changed` signal.
+    """
+
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    @classmethod
+    def for_root(cls, root):
+        """
+            Returns the shared index of a content directory, it is only
+            built once per process.
+
+            :param str root: the content directory of the wiki
+        """
+        key = (cls, os.path.abspath(root))
+        with cls._indexes_lock:
+            index = cls._indexes.get(key)
+            if index is None:
+                index = cls._indexes[key] = cls(key[1])
+            return index
+
+    def __init__(self, root):
+        self.root = root
+        self.docs = None
+        self._lock = threading.RLock()
+
+    def read(self, url):
+        with open(Wiki(self.root).path(url), 'r', encoding='utf-8') as f:
+            return split_meta(f.read())
+
+    def load(self):
+        """
+            Indexes every page of the wiki.
+        """
+        self.docs = {}
+        for url, _ in Wiki(self.root).walk():
+            self.add(url)
+
+    @abstractmethod
+    def add(self, url):
+        """
+            Indexes a page that is not indexed yet.
+
+            :param str url: the url of the page
+        """
+
+    @abstractmethod
+    def remove(self, url):
+        """
+            Drops a page from the index, if it is indexed.
+
+            :param str url: the url of the page
+        """
+
+    def update(self, url):
+        """
+            Reindexes a page after it was created, modified or deleted.
+
+            :param str url: the url of the page
+        """
+        with self._lock:
+            if self.docs is None:
+                return
+            self.remove(url)
+            if Wiki(self.root).exists(url):
+                self.add(url)
+
+
+class SearchIndex(RootIndex):
+    """
+        An inverted index over the title, tags and body of every page,
+        ranking matches with BM25. It is built from the raw page files,
+        no page is ever rendered.
+    """
+
+    #: weight of a term occurring in each of :data:`FIELDS`
+    WEIGHTS = (3.0, 2.0, 1.0)
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, root):
+        super(SearchIndex, self).__init__(root)
+        self.postings = defaultdict(dict)
+        self.total_lengths = [0] * len(FIELDS)
+
+    def load(self):
+        self.postings = defaultdict(dict)
+        self.total_lengths = [0] * len(FIELDS)
+        super(SearchIndex, self).load()
+
+    def add(self, url):
+        """
+            Indexes a single page.
+
+            :param str url: the url of the page
+        """
+        meta, body = self.read(url)
+        title = meta.get('title') or url
+        tags = meta.get('tags', '')
+        counts = [Counter(tokenize(field)) for field in (title, tags, body)]
+        lengths = tuple(sum(count.values()) for count in counts)
+        terms = set()
+        for count in counts:
+            terms.update(count)
+        for term in terms:
+            self.postings[term][url] = tuple(count[term] for count in counts)
+        for i, length in enumerate(lengths):
+            self.total_lengths[i] += length
+        self.docs[url] = (title, lengths, terms)
+
+    def remove(self, url):
+        """
+            Removes a single page from the index.
+
+            :param str url: the url of the page
+        """
+        doc = self.docs.pop(url, None)
+        if doc is None:
+            return
+        _, lengths, terms = doc
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(url, None)
+            if not postings:
+                del self.postings[term]
+        for i, length in enumerate(lengths):
+            self.total_lengths[i] -= length
+
+    def score(self, term, url, frequencies, idf, averages):
+        """
+            The BM25 score of a single term for a page, with the term
+            frequency of each field normalized by the field length and
+            weighted so title matches count most.
+        """
+        _, lengths, _ = self.docs[url]
+        tf = 0.0
+        for weight, frequency, length, average in zip(self.WEIGHTS, frequencies, lengths, averages):
+            if frequency:
+                tf += weight * frequency / (1 - self.B + self.B * length / average)
+        return idf * tf * (self.K1 + 1) / (tf + self.K1)
+
+    def search(self, query, offset=0, limit=20):
+        """
+            Ranks all pages containing any term of the query and returns
+            a single page of the results.
+
+            :param str query: the words to search for
+            :param int offset: the number of best hits to skip
+            :param int limit: the maximum number of hits to return
+
+            :returns: the requested page of the ranked results
+            :rtype: SearchResults
+        """
+        # unique terms, in the order they were typed
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if self.docs is None:
+                self.load()
+            count = len(self.docs)
+            averages = [max(total / count, 1.0) if count else 1.0
+                        for total in self.total_lengths]
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                for url, frequencies in postings.items():
+                    scores[url] += self.score(term, url, frequencies, idf, averages)
+            # only the requested page of results has to be fully sorted
+            best = heapq.nlargest(offset + limit, scores.items(),
+                                  key=lambda item: item[1])[offset:]
+            titles = [self.docs[url][0] for url, _ in best]
+
+        hits = []
+        pattern = terms_pattern(terms)
+        for (url, score), title in zip(best, titles):
+            try:
+                _, body = self.read(url)
+            except IOError:
+                body = ''
+            hits.append(SearchHit(url, title, score, make_snippet(body, pattern)))
+        return SearchResults(hits, len(scores), offset, limit)
+
+
+class SubstringIndex(RootIndex):
+    """
+        Finds pages containing a literal text. The title, tags and body of
+        all pages are joined into one string, so a search is a handful of
+        :meth:`str.find` calls over the whole wiki instead of a Python loop
+        over every field of every page.
+    """
+
+    #: separates fields and pages in the joined text, never searched for
+    SEPARATOR = '\x00'
+
+    def __init__(self, root):
+        super(SubstringIndex, self).__init__(root)
+        self.corpora = {}
+
+    def add(self, url):
+        meta, body = self.read(url)
+        self.docs[url] = (meta.get('title') or url, meta.get('tags', ''), body)
+        self.corpora = {}
+
+    def remove(self, url):
+        if self.docs.pop(url, None) is not None:
+            self.corpora = {}
+
+    def corpus(self, ignore_case):
+        """
+            Returns the joined text of all pages along with the url of every
+            page and the offsets where its text starts, its title ends and
+            its tags end. The joined text is
+            only rebuilt on the first search after a page has changed.
+
+            :param bool ignore_case: whether to join the lowercased fields
+        """
+        corpus = self.corpora.get(ignore_case)
+        if corpus is None:
+            urls = sorted(self.docs, key=lambda url: self.docs[url][0].lower())
+            parts = []
+            starts = []
+            position = 0
+            for url in urls:
+                fields = self.docs[url]
+                if ignore_case:
+                    fields = [field.lower() for field in fields]
+                starts.append((position,
+                               position + len(fields[0]),
+                               position + len(fields[0]) + len(fields[1]) + 1))
+                parts.extend(fields)
+                position += sum(len(field) + 1 for field in fields)
+            corpus = self.corpora[ignore_case] = (self.SEPARATOR.join(parts), urls, starts)
+        return corpus
+
+    def search(self, term, ignore_case=True, offset=0, limit=20):
+        """
+            Finds all pages containing term in their title, tags or body.
+            Title matches come first, then tag matches, then body matches.
+
+            :param str term: the text to search for
+            :param bool ignore_case: whether to ignore the case of term
+            :param int offset: the number of hits to skip
+            :param int limit: the maximum number of hits to return
+
+            :returns: the requested page of the results
+            :rtype: SearchResults
+        """
+        term = term.replace(self.SEPARATOR, '')
+        needle = term.lower() if ignore_case else term
+        found = []
+        with self._lock:
+            if self.docs is None:
+                self.load()
+            text, urls, starts = self.corpus(ignore_case)
+            firsts = [start[0] for start in starts]
+            position = text.find(needle) if needle else -1
+            while position != -1:
+                page = bisect.bisect_right(firsts, position) - 1
+                _, title_end, tags_end = starts[page]
+                field = 0 if position < title_end else 1 if position < tags_end else 2
+                found.append((field, page))
+                # one hit per page is enough, continue with the next page
+                if page + 1 == len(starts):
+                    break
+                position = text.find(needle, starts[page + 1][0])
+            found.sort()
+            selected = [(urls[page], self.docs[urls[page]]) for _, page in found[offset:offset + limit]]
+
+        pattern = re.compile(re.escape(term), re.IGNORECASE if ignore_case else 0)
+        hits = [SearchHit(url, title, None, make_snippet(body, pattern))
+                for url, (title, _, body) in selected]
+        return SearchResults(hits, len(found), offset, limit)
+
+
+class RegexSearch(object):
+    """
+        Searches the pages for a regular expression in a worker process
+        with a hard time budget, so a pathological expression can never
+        block the web server. Iterating yields a :class:`SearchHit` for
+        every matching page as soon as it is found. If the budget runs out
+        the worker is killed and :attr:`partial` is set.
+
+        Nothing is searched before iterating, and the worker walks and reads
+        the pages one at a time while only a few hits wait to be consumed,
+        so memory use does not grow with the size of the wiki.
+
+        :param str root: the content directory of the wiki
+        :param str pattern: the regular expression
+        :param bool ignore_case: whether to ignore the case
+        :param float budget: the number of seconds the search may take
+        :param int max_page_size: how many characters of a page body are
+            searched at most
+
+        :raises re.error: if the pattern is not a valid expression
+    """
+
+    #: the script run by the worker processes
+    WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regex_worker.py')
+    #: how many hits are read ahead of the consumer, the worker blocks
+    #: on writing further hits until they are taken
+    READ_AHEAD = 64
+
+    def __init__(self, root, pattern, ignore_case=True, budget=None, max_page_size=None):
+        self.root = root
+        self.pattern = pattern
+        self.flags = re.IGNORECASE if ignore_case else 0
+        # compiling is cheap, but fails early for invalid expressions
+        re.compile(pattern, self.flags)
+        self.budget = config.SEARCH_REGEX_BUDGET if budget is None else budget
+        self.max_page_size = config.SEARCH_REGEX_MAX_PAGE_SIZE \
+            if max_page_size is None else max_page_size
+        self.partial = False
+        self.more = False
+
+    def job(self):
+        return json.dumps({
+            'pattern': self.pattern,
+            'flags': self.flags,
+            'max_page_size': self.max_page_size,
+            'width': 160,
+            'root': os.path.abspath(self.root),
+        })
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.budget
+        # -I and -S keep the interpreter from loading anything it does not need
+        worker = subprocess.Popen(
+            [sys.executable, '-I', '-S', self.WORKER],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            encoding='utf-8')
+        lines = Queue(self.READ_AHEAD)
+
+        def read():
+            for line in worker.stdout:
+                lines.put(line)
+            lines.put(None)
+
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+        try:
+            try:
+                worker.stdin.write(self.job())
+                worker.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    line = lines.get(timeout=max(remaining, 0))
+                except Empty:
+                    self.partial = True
+                    return
+                if line is None:
+                    # a worker killed by the system did not search everything
+                    self.partial = worker.wait() != 0
+                    return
+                url, title, excerpt, spans, clipped_left, clipped_right = json.loads(line)
+                yield SearchHit(url, title, None,
+                                highlight(excerpt, spans, clipped_left, clipped_right))
+        finally:
+            if worker.poll() is None:
+                worker.kill()
+            worker.wait()
+            # the reader may be waiting for room in the queue
+            while reader.is_alive():
+                try:
+                    lines.get_nowait()
+                except Empty:
+                    reader.join(0.01)
+            worker.stdout.close()
+
+    def stream(self, limit=None):
+        """
+            Yields the matching pages as they are found, for rendering
+            them while the search is still running. If there are more than
+            limit hits, searching stops and :attr:`more` is set.
+
+            :param int limit: the maximum number of hits to yield
+        """
+        hits = iter(self)
+        try:
+            for count, hit in enumerate(hits):
+                if limit is not None and count >= limit:
+                    self.more = True
+                    return
+                yield hit
+        finally:
+            hits.close()
+
+    def search(self, offset=0, limit=20):
+        """
+            Returns a single page of the matching pages, in the order they
+            were found. Searching stops as soon as the page is complete.
+
+            :param int offset: the number of hits to skip
+            :param int limit: the maximum number of hits to return
+
+            :rtype: SearchResults
+        """
+        hits = list(itertools.islice(iter(self), offset + limit + 1))
+        more = len(hits) > offset + limit
+        total = None if more or self.partial else len(hits)
+        return SearchResults(hits[offset:offset + limit], total, offset, limit,
+                             partial=self.partial, more=more)
+
+
+@page_changed.connect
+def update_indexes(sender, url, event):
+    """
+        Keeps every loaded search index in sync with page changes.
+    """
+    for index in list(RootIndex._indexes.values()):
+        index.update(url)
+
+
+@pages_reset.connect
+def drop_indexes(sender):
+    """
+        Drops every loaded search index, they are built again on next use.
+    """
+    with RootIndex._indexes_lock:
+        RootIndex._indexes.clear()
@@ -0,0 +1,18 @@
+"""
+    Signals
+    ~~~~~~~
+"""
+from blinker import Namespace
+
+_signals = Namespace()
+
+#: Sent whenever a page appears, changes or disappears. Receivers are called
+#: with the ``url`` of the page and the ``event``, one of ``'created'``,
+#: ``'modified'`` or ``'deleted'``. A move is sent as the deletion of the
+#: old url followed by the creation of the new one.
+page_changed = _signals.signal('page-changed')
+
+#: Sent when pages may have changed without ``page_changed`` being sent for
+#: each of them. Receivers drop everything they cached about pages, to be
+#: loaded again when it is next needed.
+pages_reset = _signals.signal('pages-reset')
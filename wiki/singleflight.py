@@ -0,0 +1,79 @@
+"""
+    Single flight
+    ~~~~~~~~~~~~~
+
+    Coalesces concurrent calls doing the same work: the first caller of a
+    key runs the function, callers of the same key arriving meanwhile wait
+    for it and get its result, or its exception, instead of running the
+    function again. Right after a popular page changed, every request for
+    it would otherwise render it at the same time.
+
+    Calls are only coalesced between the threads of a process.
+"""
+import threading
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+        Runs at most one call per key at a time.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def waiting(self, key):
+        """
+            Returns the number of callers waiting for the call of a key in
+            flight, None if none is in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            return None if call is None else call.waiters
+
+    def do(self, key, function, timeout=None):
+        """
+            Returns the result of function, run by this caller if no call
+            of the key is in flight, else by the caller that started it.
+
+            :param key: what identifies the work, must be hashable
+            :param function: called without arguments
+            :param float timeout: how long to wait for a call in flight,
+                forever if None
+
+            :raises TimeoutError: if the call in flight took longer than
+                the timeout, it is not cancelled
+            :raises: whatever function raised, for every waiting caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if leader:
+            try:
+                call.result = function()
+            except BaseException as error:
+                call.error = error
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+        if not call.done.wait(timeout):
+            raise TimeoutError('Waited %s seconds for %r.' % (timeout, key))
+        if call.error is not None:
+            raise call.error
+        return call.result
@@ -0,0 +1,319 @@
+"""
+    Content watcher
+    ~~~~~~~~~~~~~~~
+
+    Notices pages that are added, modified or deleted directly on disk,
+    for example by pulling the content directory from git, and sends
+    :data:`~wiki.signals.page_changed` for each of them, exactly like
+    edits made through the wiki do. Every in-process cache that listens
+    to the signal stays up to date without knowing about the watcher.
+
+    The watcher keeps the modification time and size of every page file.
+    It polls the content directory with :func:`os.scandir` every
+    CONTENT_WATCH_INTERVAL seconds, or, where inotify is available, waits
+    for the kernel to report changes and only rescans the directories
+    they happened in. Only the pages whose files changed are announced.
+    Hidden directories are not watched.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+from collections import namedtuple
+
+import config
+from wiki.core import clean_url
+from wiki.signals import page_changed
+
+ContentEvent = namedtuple('ContentEvent', ['event', 'url'])
+
+
+class Inotify(object):
+    """
+        A minimal inotify binding on top of the C library, reporting the
+        directories something happened in.
+
+        :raises OSError: if inotify is not available
+    """
+
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = init(self.IN_CLOEXEC | self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+
+    def watch(self, directory):
+        """
+            Starts watching a directory, not its subdirectories.
+
+            :raises OSError: if the directory cannot be watched, for
+                example because the limit of watches is reached
+        """
+        wd = self._add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed: %s' % directory)
+        self.directories[wd] = directory
+
+    def read(self, timeout):
+        """
+            Waits up to timeout seconds for changes.
+
+            :returns: the directories that changed and whether the kernel
+                dropped events, in which case everything must be rescanned
+        """
+        changed, overflow = set(), False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed, overflow
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed, overflow
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+            elif wd in self.directories:
+                changed.add(self.directories[wd])
+                if mask & self.IN_IGNORED:
+                    del self.directories[wd]
+        return changed, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ContentWatcher(object):
+    """
+        Watches the page files of a content directory.
+
+        :param str root: the content directory of the wiki
+        :param float interval: seconds between polls, defaults to
+            CONTENT_WATCH_INTERVAL
+        :param bool use_inotify: whether to use inotify if available
+    """
+
+    _watchers = {}
+    _watchers_lock = threading.Lock()
+
+    @classmethod
+    def for_root(cls, root):
+        """
+            Returns the shared watcher of a content directory, so there is
+            only one per process.
+
+            :param str root: the content directory of the wiki
+        """
+        root = os.path.abspath(root)
+        with cls._watchers_lock:
+            watcher = cls._watchers.get(root)
+            if watcher is None:
+                watcher = cls._watchers[root] = cls(root)
+            return watcher
+
+    def __init__(self, root, interval=None, use_inotify=True):
+        self.root = os.path.abspath(root)
+        self.interval = config.CONTENT_WATCH_INTERVAL if interval is None else interval
+        self.use_inotify = use_inotify
+        self.inotify = None
+        #: the files and subdirectories of every watched directory
+        self.snapshot = {}
+        self.thread = None
+        self._stop = threading.Event()
+        self._lock = threading.RLock()
+        page_changed.connect(self.on_page_changed)
+
+    def url(self, path):
+        return clean_url(os.path.relpath(path, self.root)[:-3])
+
+    def stat(self, path):
+        info = os.stat(path)
+        return info.st_mtime_ns, info.st_size
+
+    def scan_directory(self, directory, events):
+        """
+            Compares a directory with its snapshot, collecting an event
+            for every page file that was added, modified or deleted. New
+            subdirectories are scanned completely, removed ones forgotten.
+
+            :param str directory: the directory to scan
+            :param list events: the list collecting the events
+
+            :returns: the subdirectories that were already known
+        """
+        known = directory in self.snapshot
+        old_files, old_subdirs = self.snapshot.get(directory, ({}, set()))
+        files, subdirs = {}, set()
+        if not known and self.inotify is not None:
+            # watch first, so nothing changing during the scan is missed
+            self.watch(directory)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.'):
+                                subdirs.add(entry.path)
+                        elif entry.name.endswith('.md') and entry.is_file():
+                            info = entry.stat()
+                            files[entry.name] = (info.st_mtime_ns, info.st_size)
+                    except FileNotFoundError:
+                        # removed while scanning, the next scan notices
+                        pass
+        except (FileNotFoundError, NotADirectoryError):
+            self.forget(directory, events)
+            return set()
+        for name, state in files.items():
+            if name not in old_files:
+                events.append(ContentEvent('created', self.url(os.path.join(directory, name))))
+            elif old_files[name] != state:
+                events.append(ContentEvent('modified', self.url(os.path.join(directory, name))))
+        for name in old_files:
+            if name not in files:
+                events.append(ContentEvent('deleted', self.url(os.path.join(directory, name))))
+        self.snapshot[directory] = (files, subdirs)
+        for subdir in subdirs - old_subdirs:
+            self.scan_tree(subdir, events)
+        for subdir in old_subdirs - subdirs:
+            self.forget(subdir, events)
+        return subdirs & old_subdirs
+
+    def scan_tree(self, directory, events):
+        for subdir in self.scan_directory(directory, events):
+            self.scan_tree(subdir, events)
+
+    def forget(self, directory, events):
+        """
+            Drops a removed directory from the snapshot, every page that
+            was in it is deleted.
+        """
+        files, subdirs = self.snapshot.pop(directory, ({}, set()))
+        for name in files:
+            events.append(ContentEvent('deleted', self.url(os.path.join(directory, name))))
+        for subdir in subdirs:
+            self.forget(subdir, events)
+
+    def watch(self, directory):
+        try:
+            self.inotify.watch(directory)
+        except OSError as error:
+            if error.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            # out of watches, polling still finds every change
+            self.inotify.close()
+            self.inotify = None
+
+    def announce(self, events):
+        for event in events:
+            page_changed.send(self, url=event.url, event=event.event)
+
+    def scan(self, directories=None):
+        """
+            Rescans the content directory, or only some of its directories,
+            and announces every change.
+
+            :param directories: the directories to rescan, all if None
+
+            :returns: the changes found
+            :rtype: list of :class:`ContentEvent`
+        """
+        events = []
+        with self._lock:
+            if directories is None:
+                self.scan_tree(self.root, events)
+            else:
+                for directory in directories:
+                    if directory in self.snapshot or directory == self.root:
+                        self.scan_directory(directory, events)
+        self.announce(events)
+        return events
+
+    def on_page_changed(self, sender, url, event):
+        """
+            Takes changes made through the wiki into the snapshot, so they
+            are not announced a second time.
+        """
+        if sender is self:
+            return
+        path = os.path.join(self.root, url + '.md')
+        directory = os.path.dirname(path)
+        with self._lock:
+            if directory not in self.snapshot:
+                return
+            files = self.snapshot[directory][0]
+            name = os.path.basename(path)
+            try:
+                files[name] = self.stat(path)
+            except OSError:
+                files.pop(name, None)
+
+    def run(self):
+        while not self._stop.is_set():
+            if self.inotify is not None:
+                directories, overflow = self.inotify.read(self.interval)
+                if overflow:
+                    self.scan()
+                elif directories:
+                    self.scan(directories)
+            else:
+                if self._stop.wait(self.interval):
+                    break
+                self.scan()
+
+    def start(self):
+        """
+            Takes the first snapshot and starts watching in a background
+            thread. Does nothing if the watcher is already running or the
+            interval is 0.
+        """
+        if self.thread is not None:
+            return
+        with self._lock:
+            if self.thread is not None or not self.interval:
+                return
+            if self.use_inotify:
+                try:
+                    self.inotify = Inotify()
+                except OSError:
+                    self.inotify = None
+            # the first snapshot is taken silently
+            self.scan_tree(self.root, [])
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
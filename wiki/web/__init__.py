@@ -1,45 +1,79 @@
 import os
 import sqlite3
+import threading
 from datetime import datetime
 
 from flask import current_app
 from flask import Flask
-from flask import g
 from flask_login import LoginManager
 from werkzeug.local import LocalProxy
 
 import config
+from wiki import metrics
+from wiki.attachments import AttachmentStore
+from wiki.attachments import attachment_dir
+from wiki.attachments import create_attachment_table
+from wiki.coherence import create_change_log
 from wiki.core import Wiki
+from wiki.core import create_version_index
+from wiki.history import create_compaction_table
+from wiki.history import create_history_indexes
+from wiki.rollups import create_rollup_tables
+from wiki.web.assets import StaticAssets
+from wiki.web.cache import PageCache
 from wiki.web.user import UserManager
 
 
+#: the bytes a request may hold on top of ATTACHMENT_MAX_SIZE, for the
+#: other fields of the upload form
+FORM_ALLOWANCE = 64 * 1024
+
+
 class WikiError(Exception):
     pass
 
 
+_app_scoped_lock = threading.Lock()
+
+
+def app_scoped(name, factory, path):
+    """
+    Returns the object of the app built by factory for path, shared by
+    every request and thread of the app, so it keeps its caches between
+    requests. It is built again when the configured path changes.
+    """
+    scoped = current_app.extensions.get(name)
+    if scoped is None or scoped[0] != path:
+        with _app_scoped_lock:
+            scoped = current_app.extensions.get(name)
+            if scoped is None or scoped[0] != path:
+                scoped = current_app.extensions[name] = (path, factory(path))
+    return scoped[1]
+
+
 def get_wiki():
-    wiki = getattr(g, '_wiki', None)
-    if wiki is None:
-        wiki = g._wiki = Wiki(current_app.config['CONTENT_DIR'])
-    return wiki
+    return app_scoped('wiki', Wiki, current_app.config['CONTENT_DIR'])
 
 
 current_wiki = LocalProxy(get_wiki)
 
 
 def get_users():
-    users = getattr(g, '_users', None)
-    if users is None:
-        users = g._users = UserManager(current_app.config['USER_DIR'])
-    return users
+    return app_scoped('users', UserManager, current_app.config['USER_DIR'])
 
 
 current_users = LocalProxy(get_users)
 
 
+def get_attachments():
+    return app_scoped('attachments', AttachmentStore, attachment_dir(current_app.config))
+
+
 def create_app(directory):
     app = Flask(__name__)
     app.config['CONTENT_DIR'] = directory
+    # the directory of config.py, e.g. for worker processes to set up the app
+    app.config['APP_DIR'] = directory
     app.config['TITLE'] = 'wiki'
     try:
         app.config.from_pyfile(
@@ -48,12 +82,25 @@ def create_app(directory):
     except IOError:
         msg = "You need to place a config.py in your content directory."
         raise WikiError(msg)
+    # content directories set up before attachments have no ATTACHMENT_DIR
+    app.config.setdefault('ATTACHMENT_DIR', config.ATTACHMENT_DIR)
+    # Werkzeug reads a whole request body before the view sees it, bodies
+    # larger than an attachment and its form are refused up front
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = config.ATTACHMENT_MAX_SIZE + FORM_ALLOWANCE
 
     loginmanager.init_app(app)
 
     from wiki.web.routes import bp
     app.register_blueprint(bp)
 
+    from wiki.web import commands
+    commands.init_app(app)
+
+    StaticAssets(app.static_folder).init_app(app)
+    app.extensions['page_cache'] = PageCache(config.PAGE_CACHE_SIZE)
+    metrics.init_app(app)
+
     initialize_db(app)
 
     return app
@@ -68,12 +115,22 @@ def load_user(name):
     return current_users.get_user(name)
 
 
+#: the version of the tables created by initialize_db, raise it whenever
+#: a table or an index is added there
+SCHEMA_VERSION = 3
+
+
 def initialize_db(app):
     """
     This method initializes the SQLite database to store Wiki page history.
+    A database already set up by this version is left as it is, so starting
+    the app only costs a single query.
     """
     conn = sqlite3.connect(app.config['DATABASE'])
     cursor = conn.cursor()
+    if cursor.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
 
     cursor.execute('''CREATE TABLE IF NOT EXISTS wiki_pages (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -85,7 +142,8 @@ def initialize_db(app):
                         approved BOOLEAN DEFAULT FALSE
     )''')
 
-    if not page_exists("home"):
+    cursor.execute("SELECT 1 FROM wiki_pages WHERE url = 'home'")
+    if cursor.fetchone() is None:
         home_page = (
         1, 'home', 1, 'title: Main tags: interesting World [[hello|abc]] [[world|world]] aaa bruh', datetime.now(),
         'sam', True)
@@ -95,6 +153,9 @@ def initialize_db(app):
         cursor.execute('''INSERT INTO wiki_pages VALUES (?, ?, ?, ?, ?, ?, ?)''', home_page)
         cursor.execute('''INSERT INTO wiki_pages VALUES (?, ?, ?, ?, ?, ?, ?)''', test_page)
 
+    # Full-text index over all page versions
+    create_version_index(cursor)
+
     # Init User History Table
     cursor.execute('''CREATE TABLE IF NOT EXISTS user_history (
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -103,7 +164,19 @@ def initialize_db(app):
                             count_accessed INTEGER NOT NULL,
                             user TEXT NOT NULL
         )''')
+    create_history_indexes(cursor)
+    create_compaction_table(cursor)
+
+    # Page view rollups
+    create_rollup_tables(cursor)
+
+    # Page changes for the caches of other workers
+    create_change_log(cursor)
+
+    # Names of the uploaded files
+    create_attachment_table(cursor)
 
+    cursor.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
     conn.commit()
     conn.close()
 
@@ -0,0 +1,184 @@
+"""
+    Static assets
+    ~~~~~~~~~~~~~
+
+    Serves the static files under urls containing a hash of their content,
+    so browsers and proxies may keep them forever: a changed file gets a
+    new url. Every file is compressed once at start up, with gzip and,
+    if the brotli package is installed, with brotli, and clients get the
+    best variant they accept without anything being compressed per
+    request. The same helpers send rendered pages precompressed.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import namedtuple
+
+from flask import abort
+from flask import current_app
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#: the encodings in order of preference
+ENCODINGS = ('br', 'gzip')
+
+#: bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+Asset = namedtuple('Asset', ['fingerprint', 'mimetype', 'data'])
+
+
+def compress(data, best=False):
+    """
+        Returns the body in every available encoding that makes it
+        smaller, ``identity`` being the uncompressed body.
+
+        :param bytes data: the body
+        :param bool best: whether to compress as small as possible, for
+            bodies compressed once and sent many times
+    """
+    bodies = {'identity': data}
+    if len(data) < MIN_COMPRESS_SIZE:
+        return bodies
+    candidates = {'gzip': gzip.compress(data, 9 if best else 6, mtime=0)}
+    if brotli is not None:
+        candidates['br'] = brotli.compress(data, quality=11 if best else 5)
+    for encoding, body in candidates.items():
+        if len(body) < len(data):
+            bodies[encoding] = body
+    return bodies
+
+
+def choose_encoding(bodies):
+    """
+        Returns the preferred encoding of the current request among the
+        available bodies.
+    """
+    accepted = request.accept_encodings
+    for encoding in ENCODINGS:
+        if encoding in bodies and accepted[encoding]:
+            return encoding
+    return 'identity'
+
+
+def encoded_response(bodies, mimetype, etag=None):
+    """
+        Builds a response from precompressed bodies for the encoding the
+        client accepts. Every encoding gets its own strong ETag, made from
+        the given one and the encoding.
+
+        :param dict bodies: the body by encoding, see :func:`compress`
+        :param str mimetype: the mimetype of the body
+        :param str etag: the ETag of the uncompressed body
+    """
+    encoding = choose_encoding(bodies)
+    response = current_app.response_class(bodies[encoding], mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    if len(bodies) > 1:
+        response.vary.add('Accept-Encoding')
+    if etag is not None:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+def encoded_etag(etag, encoding):
+    return etag if encoding == 'identity' else '%s-%s' % (etag, encoding)
+
+
+def etag_matches(etag):
+    """
+        Returns whether If-None-Match of the current request matches the
+        ETag of any encoding of a body.
+
+        :param str etag: the ETag of the uncompressed body
+    """
+    return any(request.if_none_match.contains(encoded_etag(etag, encoding))
+               for encoding in ('identity',) + ENCODINGS)
+
+
+class StaticAssets(object):
+    """
+        The fingerprinted and precompressed static files of an app.
+
+        :param str folder: the folder holding the static files
+    """
+
+    #: how long clients may keep an asset, a year
+    MAX_AGE = 365 * 24 * 3600
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.assets = {}
+        self.bodies = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+            Reads and fingerprints every static file, they are compressed
+            by :meth:`get_bodies` to keep start up fast.
+        """
+        assets = {}
+        for directory, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(directory, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                assets[filename] = Asset(hashlib.sha1(data).hexdigest()[:12], mimetype, data)
+        with self._lock:
+            self.assets = assets
+            self.bodies = {}
+
+    def get_bodies(self, asset):
+        """
+            Returns the compressed bodies of an asset, compressing it on
+            its first request.
+        """
+        bodies = self.bodies.get(asset.fingerprint)
+        if bodies is None:
+            bodies = compress(asset.data, best=True)
+            with self._lock:
+                self.bodies[asset.fingerprint] = bodies
+        return bodies
+
+    def init_app(self, app):
+        app.extensions['assets'] = self
+        app.add_url_rule('/assets/<fingerprint>/<path:filename>', 'asset', self.serve)
+        app.url_defaults(self.add_fingerprint)
+
+    def add_fingerprint(self, endpoint, values):
+        """
+            Fills in the fingerprint when building the url of an asset, so
+            templates only name the file:
+            ``url_for('asset', filename='bootstrap.css')``.
+        """
+        if endpoint == 'asset' and 'fingerprint' not in values:
+            asset = self.assets.get(values.get('filename'))
+            values['fingerprint'] = asset.fingerprint if asset else 'missing'
+
+    def serve(self, fingerprint, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+        if etag_matches(asset.fingerprint):
+            response = current_app.response_class(status=304)
+            response.set_etag(asset.fingerprint)
+        else:
+            response = encoded_response(self.get_bodies(asset), asset.mimetype, asset.fingerprint)
+        if fingerprint == asset.fingerprint:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            # an outdated url, the content behind it changed
+            response.cache_control.no_cache = True
+        return response
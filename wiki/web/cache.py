@@ -0,0 +1,148 @@
+"""
+    Page cache
+    ~~~~~~~~~~
+
+    Keeps the most recently sent pages, already rendered and compressed,
+    so the next reader of a page gets it without markdown, template or
+    compression work. Entries are keyed by the url and the ETag of the
+    page, which covers everything that changes what a reader sees, so a
+    stale entry is never sent; pages are also evicted as soon as they
+    change to free their memory.
+
+    Pages show their links to missing pages differently, so the cache
+    knows which urls each cached page links to: when a page is created or
+    deleted, only the cached pages linking to it are evicted along with it.
+    Likewise a page changing evicts the cached pages including it.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+from wiki.metrics import cache_lookup
+from wiki.signals import page_changed
+from wiki.signals import pages_reset
+
+
+class PageCache(object):
+    """
+        A least recently used cache of rendered pages.
+
+        :param int size: the maximum number of entries
+    """
+
+    _caches = weakref.WeakSet()
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        #: the urls the cached pages link to, and the other way round
+        self.links = {}
+        self.linked_from = {}
+        #: the urls the cached pages include, and the other way round
+        self.includes = {}
+        self.included_from = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        PageCache._caches.add(self)
+
+    def get(self, url, etag):
+        """
+            Returns the cached bodies of a page by encoding, None if the
+            page is not cached.
+        """
+        with self._lock:
+            bodies = self.entries.get((url, etag))
+            if bodies is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end((url, etag))
+        cache_lookup('page', bodies is not None)
+        return bodies
+
+    def put(self, url, etag, bodies, links=(), includes=()):
+        """
+            Caches the bodies of a page.
+
+            :param links: the urls the page links to
+            :param includes: the urls of the pages the page includes
+        """
+        with self._lock:
+            self.entries[(url, etag)] = bodies
+            self.entries.move_to_end((url, etag))
+            self.forget_links(url)
+            for targets, sources, urls in ((self.links, self.linked_from, links),
+                                           (self.includes, self.included_from, includes)):
+                targets[url] = tuple(urls)
+                for target in targets[url]:
+                    sources.setdefault(target, set()).add(url)
+            while len(self.entries) > self.size:
+                (old, _), _ = self.entries.popitem(last=False)
+                if not any(key[0] == old for key in self.entries):
+                    self.forget_links(old)
+
+    def forget_links(self, url):
+        for targets, sources in ((self.links, self.linked_from), (self.includes, self.included_from)):
+            for target in targets.pop(url, ()):
+                urls = sources.get(target)
+                if urls is not None:
+                    urls.discard(url)
+                    if not urls:
+                        del sources[target]
+
+    def evict(self, url):
+        """
+            Removes every cached copy of a page.
+        """
+        with self._lock:
+            for key in [key for key in self.entries if key[0] == url]:
+                del self.entries[key]
+            self.forget_links(url)
+
+    def evict_linking(self, url):
+        """
+            Removes every cached page linking to a url.
+        """
+        with self._lock:
+            sources = list(self.linked_from.get(url, ()))
+        for source in sources:
+            self.evict(source)
+
+    def evict_including(self, url):
+        """
+            Removes every cached page including a page.
+        """
+        with self._lock:
+            sources = list(self.included_from.get(url, ()))
+        for source in sources:
+            self.evict(source)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            for dependencies in (self.links, self.linked_from, self.includes, self.included_from):
+                dependencies.clear()
+
+
+@page_changed.connect
+def evict_pages(sender, url, event):
+    """
+        Evicts a changed page from every cache, along with the pages
+        including it, and the pages linking to it if it was created or
+        deleted.
+    """
+    for cache in list(PageCache._caches):
+        cache.evict(url)
+        cache.evict_including(url)
+        if event != 'modified':
+            cache.evict_linking(url)
+
+
+@pages_reset.connect
+def clear_pages(sender):
+    """
+        Empties every cache.
+    """
+    for cache in list(PageCache._caches):
+        cache.clear()
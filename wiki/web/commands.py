@@ -0,0 +1,105 @@
+"""
+    Commands
+    ~~~~~~~~
+
+    Maintenance commands for the flask command line, run them with
+    ``flask --app Riki <command>`` from the content directory.
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from wiki.bulk import approve_pending
+from wiki.bulk import delete_pages
+from wiki.bulk import retag_pages
+from wiki.bulk import select_pages
+from wiki.export import export_site
+from wiki.history import compact_history
+from wiki.web import get_wiki
+from wiki.web.search.Manifest import TitleManifest
+
+
+@click.command('compact-history')
+@click.option('--retention-days', type=int, default=None,
+              help='Days unused entries are kept, defaults to HISTORY_RETENTION_DAYS.')
+@click.option('--keep', type=int, default=None,
+              help='Entries kept per user, defaults to HISTORY_MAX_PER_USER.')
+@with_appcontext
+def compact_history_command(retention_days, keep):
+    """Expires, merges and trims the entries of user_history."""
+    titles = TitleManifest.for_root(current_app.config['CONTENT_DIR']).by_url()
+    result = compact_history(current_app.config['DATABASE'], titles, retention_days, keep)
+    click.echo('Expired %d, merged %d, dropped %d and trimmed %d entries.' % result)
+
+
+@click.command('export')
+@click.argument('output', type=click.Path(file_okay=False))
+@click.option('--versions', is_flag=True, help='Also export the approved earlier versions of every page.')
+@click.option('--workers', type=int, default=None, help='Rendering processes, defaults to the number of cores.')
+@click.option('--force', is_flag=True, help='Render every page again, changed or not.')
+@with_appcontext
+def export_command(output, versions, workers, force):
+    """Exports the wiki as static html files into OUTPUT."""
+    def progress(rendered, total):
+        click.echo('Rendered %d of %d pages.' % (rendered, total))
+
+    result = export_site(current_app._get_current_object(), output, versions, workers, force, progress)
+    click.echo('Rendered %d, kept %d and removed %d pages.' % result)
+
+
+@click.group('pages')
+def pages_command():
+    """Deletes, retags or approves many pages at once."""
+
+
+def selection(command):
+    """
+        Adds the options selecting the pages of a bulk command.
+    """
+    command = click.option('--url', 'urls', multiple=True, help='Url of a page, can be repeated.')(command)
+    command = click.option('--tag', help='Selects the pages having this tag.')(command)
+    command = click.option('--prefix', help='Selects a page and every page below it.')(command)
+    return with_appcontext(command)
+
+
+def selected(urls, tag, prefix):
+    wiki = get_wiki()
+    return wiki, select_pages(wiki, urls, tag, prefix)
+
+
+def progress(done, total):
+    click.echo('%d of %d pages.' % (done, total))
+
+
+@pages_command.command('delete')
+@selection
+@click.confirmation_option(prompt='Delete the selected pages and all their versions?')
+def delete_command(urls, tag, prefix):
+    """Deletes the selected pages."""
+    wiki, urls = selected(urls, tag, prefix)
+    click.echo('Deleted %d pages, %d were missing.' % delete_pages(wiki, urls, progress))
+
+
+@pages_command.command('tag')
+@selection
+@click.option('--add', multiple=True, help='Tag to add, can be repeated.')
+@click.option('--remove', multiple=True, help='Tag to remove, can be repeated.')
+@click.option('--author', required=True, help='User the new versions are recorded for.')
+def tag_command(urls, tag, prefix, add, remove, author):
+    """Adds and removes tags of the selected pages."""
+    wiki, urls = selected(urls, tag, prefix)
+    click.echo('Retagged %d pages, %d were unchanged.' % retag_pages(wiki, urls, author, add, remove, progress))
+
+
+@pages_command.command('approve')
+@selection
+def approve_command(urls, tag, prefix):
+    """Approves every pending edit of the selected pages."""
+    wiki, urls = selected(urls, tag, prefix)
+    click.echo('Approved the edits of %d pages, %d had none pending.' % approve_pending(wiki, urls, progress))
+
+
+def init_app(app):
+    app.cli.add_command(compact_history_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(pages_command)
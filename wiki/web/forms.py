@@ -3,24 +3,32 @@
     ~~~~~
 """
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField
+from flask_wtf.file import FileRequired
 from wtforms import BooleanField
+from wtforms import SelectField
 from wtforms import StringField
 from wtforms import TextAreaField
 from wtforms import PasswordField
 from wtforms.validators import InputRequired
 from wtforms.validators import ValidationError
 
+from wiki.attachments import attachment_name
 from wiki.core import clean_url
+from wiki.search import MODES
 from wiki.web import current_wiki
 from wiki.web import current_users
 
 
 class URLForm(FlaskForm):
     url = StringField('', [InputRequired()])
+    subpages = BooleanField('Move the pages below it too')
 
     def validate_url(form, field):
         if current_wiki.exists(field.data):
             raise ValidationError('The URL "%s" exists already.' % field.data)
+        if form.subpages.data and current_wiki.children(field.data) is not None:
+            raise ValidationError('There are pages below "%s" already.' % field.data)
 
     def clean_url(self, url):
         return clean_url(url)
@@ -28,12 +36,22 @@ class URLForm(FlaskForm):
 
 class SearchForm(FlaskForm):
     term = StringField('', [InputRequired()])
+    mode = SelectField('', choices=MODES, default='word')
     ignore_case = BooleanField(
         description='Ignore Case',
         # FIXME: default is not correctly populated
         default=True)
 
 
+class AttachmentForm(FlaskForm):
+    file = FileField('', [FileRequired()])
+    name = StringField('')
+
+    def validate_name(form, field):
+        if field.data and not attachment_name(field.data):
+            raise ValidationError('"%s" is not a valid file name.' % field.data)
+
+
 class EditorForm(FlaskForm):
     title = StringField('', [InputRequired()])
     body = TextAreaField('', [InputRequired()])
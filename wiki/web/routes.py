@@ -2,13 +2,25 @@
     Routes
     ~~~~~~
 """
+import hashlib
+import os
+import re
 import sqlite3
+from datetime import datetime
+from datetime import timezone
 
 from flask import Blueprint, jsonify
+from flask import abort
+from flask import current_app
 from flask import flash
+from flask import get_flashed_messages
+from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
+from flask import send_file
+from flask import session
+from flask import stream_template
 from flask import url_for
 from flask_login import current_user
 from flask_login import login_required
@@ -16,14 +28,27 @@ from flask_login import login_user
 from flask_login import logout_user
 
 import config
-from wiki.core import Processor, delete_from_db
+from wiki.attachments import attachment_digests, attachment_name, find_attachments, guess_mimetype, is_image
+from wiki.attachments import save_attachment, thumbnails
+from wiki.coherence import CacheCoherence
+from wiki.core import Processor, delete_from_db, included_pages, link_targets, missing_targets, search_versions
+from wiki.core import connect_to_db
+from wiki.history import HistoryCompactor
+from wiki.metrics import cache_lookup
+from wiki.rollups import WINDOWS, count_view, user_top_pages
+from wiki.watcher import ContentWatcher
+from wiki.web.forms import AttachmentForm
 from wiki.web.forms import EditorForm
 from wiki.web.forms import LoginForm
 from wiki.web.forms import SearchForm
 from wiki.web.forms import URLForm
 from wiki.web import current_wiki
 from wiki.web import current_users
+from wiki.web import get_attachments
+from wiki.web.assets import StaticAssets, compress, encoded_response, etag_matches
 from wiki.web.search.Dropdown import *
+from wiki.web.search.DropdownSearch import HistorySearch
+from wiki.web.search.Manifest import TitleManifest
 from wiki.web.user import protect
 
 bp = Blueprint('wiki', __name__)
@@ -45,13 +70,63 @@ def index():
     return render_template('index.html', pages=pages)
 
 
+@bp.route('/browse/', defaults={'prefix': ''})
+@bp.route('/browse/<path:prefix>/')
+@protect
+def browse(prefix):
+    """
+    Lists one namespace of the wiki with the number of pages of each
+    namespace in it.
+    """
+    entries = current_wiki.children(prefix)
+    if entries is None:
+        if prefix:
+            abort(404)
+        entries = []
+    folders = [folder for folder in prefix.split('/') if folder]
+    parents = [(folder, '/'.join(folders[:i + 1])) for i, folder in enumerate(folders)]
+    return render_template('browse.html', entries=entries, prefix=prefix, parents=parents)
+
+
 @bp.route('/<path:url>/')
 @protect
 def display(url):
-    page = current_wiki.get_or_404(url)
-    is_author = page.get_author() == current_user.name
+    """
+    Shows a page. Browsers revalidate their copy with the ETag or
+    Last-Modified and get a 304 without the page being rendered while
+    neither the page nor what the current user sees of it has changed.
+    Rendered pages are kept compressed in the page cache, under the same
+    ETag, for the next reader.
+    """
+    page = current_wiki.get_unrendered_or_404(url)
+    revision = page.get_revision()
+    is_author = revision.author == current_user.name
     update_user_sql(page)
-    return render_template('page.html', page=page, author=is_author)
+    included = included_pages(page.content)
+    etag, last_modified = page_validators(page, revision, is_author, included)
+    # pending flash messages have to be shown, so the page is sent again
+    if '_flashes' in session:
+        page.render()
+        response = make_response(render_template('page.html', page=page, author=is_author, revision=revision))
+        response.set_etag(etag)
+    elif not_modified(etag, last_modified):
+        cache_lookup('conditional', True)
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+    else:
+        cache_lookup('conditional', False)
+        cache = current_app.extensions['page_cache']
+        bodies = cache.get(page.url, etag)
+        if bodies is None:
+            page.render()
+            bodies = compress(render_template('page.html', page=page, author=is_author, revision=revision).encode('utf-8'))
+            links = link_targets('\n'.join([page.content] + list(included.values())))
+            cache.put(page.url, etag, bodies, links, included)
+        response = encoded_response(bodies, 'text/html', etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @bp.route('/display_version/<path:url>/<int:page_id>')
@@ -144,8 +219,16 @@ def move(url):
     form = URLForm(obj=page)
     if form.validate_on_submit():
         newurl = form.url.data
-        current_wiki.move(url, newurl)
-        return redirect(url_for('wiki.display', url=newurl))
+        try:
+            if form.subpages.data:
+                current_wiki.move_tree(url, newurl)
+            else:
+                current_wiki.move(url, newurl)
+        except (ValueError, FileExistsError, RuntimeError) as error:
+            # e.g. a target inside the moved namespace, or an empty folder
+            flash(str(error), 'error')
+        else:
+            return redirect(url_for('wiki.display', url=newurl))
     return render_template('move.html', form=form, page=page)
 
 
@@ -171,6 +254,87 @@ def delete(url):
     return redirect(url_for('wiki.home'))
 
 
+@bp.route('/attachments/', methods=['GET', 'POST'])
+@login_required
+def attachments():
+    """
+    Lists the attachments and uploads new ones. The upload is streamed
+    into the store, images get their variants made in the background.
+    """
+    form = AttachmentForm()
+    if form.validate_on_submit():
+        upload = form.file.data
+        name = attachment_name(form.name.data or upload.filename or '')
+        store = get_attachments()
+        try:
+            if not name:
+                raise ValueError('"%s" is not a valid file name.' % upload.filename)
+            digest, size = store.store(upload.stream, config.ATTACHMENT_MAX_SIZE)
+        except ValueError as error:
+            flash(str(error), 'error')
+        else:
+            mimetype = guess_mimetype(name)
+            save_attachment(name, digest, size, mimetype, current_user.name)
+            if is_image(mimetype):
+                for width in config.THUMBNAIL_WIDTHS:
+                    thumbnails.submit(store, digest, width)
+            flash('"%s" was uploaded, embed it with ![[%s]].' % (name, name), 'success')
+            return redirect(url_for('wiki.attachments'))
+    return render_template('attachments.html', form=form, attachments=find_attachments().values())
+
+
+@bp.route('/attachments/<digest>/<path:name>')
+@protect
+def attachment(digest, name):
+    return send_attachment(get_attachments().path(check_digest(digest)), name, immutable=True)
+
+
+@bp.route('/attachments/<digest>/<int:width>/<path:name>')
+@protect
+def attachment_variant(digest, width, name):
+    """
+    Sends a variant of an image. Until it is made the original is sent,
+    for the client to ask again next time.
+    """
+    if width not in config.THUMBNAIL_WIDTHS:
+        abort(404)
+    store = get_attachments()
+    path = thumbnails.variant(store, check_digest(digest), width)
+    if path is None:
+        return send_attachment(store.path(digest), name, immutable=False)
+    return send_attachment(path, name, immutable=True)
+
+
+def check_digest(digest):
+    if not re.fullmatch('[0-9a-f]{64}', digest):
+        abort(404)
+    return digest
+
+
+def send_attachment(path, name, immutable):
+    """
+    Sends a stored file, streamed from disk in chunks, with support for
+    conditional and range requests. Stored files never change, so their
+    urls may be cached forever. Uploaded files are sandboxed, so an html
+    file cannot run scripts as the wiki.
+    """
+    if not os.path.isfile(path):
+        abort(404)
+    response = send_file(path, mimetype=guess_mimetype(name), download_name=name, conditional=True,
+                         etag=os.path.basename(path), max_age=StaticAssets.MAX_AGE if immutable else None)
+    if immutable:
+        response.cache_control.immutable = True
+        if current_app.config.get('PRIVATE'):
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+    else:
+        response.cache_control.no_cache = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    return response
+
+
 @bp.route('/tags/')
 @protect
 def tags():
@@ -185,26 +349,125 @@ def tag(name):
     return render_template('tag.html', pages=tagged, tag=name)
 
 
+@bp.route('/popular/')
+@protect
+def popular():
+    """
+    Shows the most viewed pages of a time window and the pages the current
+    user has viewed most, both answered from the view rollups.
+    """
+    window = request.args.get('window', 'week')
+    if window not in WINDOWS:
+        abort(404)
+    manifest = TitleManifest.for_root(current_wiki.root)
+    pages = [(manifest.title(page.url), page) for page in current_wiki.popular(window, config.POPULAR_LIMIT)]
+    mine = []
+    if current_user.is_authenticated:
+        mine = [(manifest.title(page.url), page) for page in user_top_pages(current_user.name, config.POPULAR_LIMIT)
+                if current_wiki.exists(page.url)]
+    return render_template('popular.html', window=window, windows=WINDOWS, pages=pages, mine=mine)
+
+
 @bp.route('/search/', methods=['GET', 'POST'])
 @protect
 def search():
+    """
+    Searches the wiki and shows one page of results.
+    Further pages of results are requested with the term, mode, case and
+    page number in the query string.
+    Regex searches scan every page, so their results are streamed to the
+    browser while the search is still running instead of being paged.
+    """
     form = SearchForm()
+    term = None
     if form.validate_on_submit():
-        results = current_wiki.search(form.term.data, form.ignore_case.data)
-        return render_template('search.html', form=form,
-                               results=results, search=form.term.data)
+        term = form.term.data
+    elif request.args.get('term'):
+        term = form.term.data = request.args['term']
+        form.mode.data = request.args.get('mode', 'word')
+        form.ignore_case.data = request.args.get('ignore_case', 1, type=int) == 1
+    if term and form.mode.data == 'regex':
+        try:
+            results = current_wiki.search_stream(term, form.ignore_case.data)
+        except re.error as error:
+            flash('Invalid regular expression: %s' % error, 'error')
+            return render_template('search.html', form=form, search=None)
+        # flashes are taken from the session before the headers are sent
+        get_flashed_messages(with_categories=True)
+        response = current_app.response_class(stream_template(
+            'search.html', form=form, results=results, search=term,
+            streamed=True, limit=config.SEARCH_STREAM_LIMIT))
+        # keep proxies from holding back the results until the end
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    if term:
+        page = max(request.args.get('page', 1, type=int), 1)
+        try:
+            results = current_wiki.search(
+                term, form.mode.data, form.ignore_case.data,
+                offset=(page - 1) * config.SEARCH_PAGE_SIZE,
+                limit=config.SEARCH_PAGE_SIZE)
+        except re.error as error:
+            flash('Invalid regular expression: %s' % error, 'error')
+            return render_template('search.html', form=form, search=None)
+        return render_template('search.html', form=form, results=results,
+                               search=term, page=page)
     return render_template('search.html', form=form, search=None)
 
 
+@bp.route('/search_versions/')
+@protect
+def version_search():
+    """
+    Searches the content of every stored version of every page for a phrase,
+    showing the url, version, author and date of each matching version.
+    """
+    term = request.args.get('term', '').strip()
+    url = request.args.get('url', '').strip() or None
+    page = max(request.args.get('page', 1, type=int), 1)
+    hits, total = [], 0
+    if term:
+        hits, total = search_versions(term, url, offset=(page - 1) * config.SEARCH_PAGE_SIZE,
+                                      limit=config.SEARCH_PAGE_SIZE)
+    return render_template('version_search.html', term=term, url=url, hits=hits, total=total, page=page,
+                           has_next=page * config.SEARCH_PAGE_SIZE < total)
+
+
 @bp.route('/search_autocomplete', methods=['GET', 'POST'])
 @protect
 def search_autocomplete():
     """
     Method for handling /search_autocomplete requests
     Calls upon autocompleter to return valid json response
+    With scope=history only the user's history is searched, browsers match
+    everything else locally against the title manifest
+    """
+    manifest = TitleManifest.for_root(current_wiki.root)
+    pages = manifest.entries()
+    query = request.args.get('query', '')
+    if request.args.get('scope') == 'history':
+        history = HistorySearch(pages, current_user.name, config.DATABASE)
+        return jsonify(history.render(query))
+    autocomplete = Dropdown(pages, config.DATABASE, current_user.name,
+                            limit=config.AUTOCOMPLETE_LIMIT, manifest=manifest)
+    return autocomplete.render(query)
+
+
+@bp.route('/search_manifest')
+@protect
+def search_manifest():
     """
-    autocomplete = Dropdown(current_wiki.index(),  config.DATABASE, current_user.name,)
-    return autocomplete.render(request.args.get('query', ''))
+    Method for handling /search_manifest requests
+    Returns the title and url of every page for client side autocomplete
+    The version is sent as ETag, browsers revalidate it and get a 304
+    while no page has been created, renamed or deleted
+    """
+    body, version = TitleManifest.for_root(current_wiki.root).serialize()
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(version)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 
@@ -260,14 +523,113 @@ def page_not_found(error):
     return render_template('404.html'), 404
 
 
+"""
+   Conditional Requests
+   ~~~~~~~~~~~~~~~~~~~~
+"""
+
+
+def template_version():
+    """
+    Returns a hash of all templates, so pages are sent again after the
+    templates changed. It is computed once per process and the same in
+    every worker
+    """
+    version = getattr(current_app, '_template_version', None)
+    if version is None:
+        digest = hashlib.sha1()
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        for directory, _, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    digest.update(f.read())
+        version = current_app._template_version = digest.hexdigest()
+    return version
+
+
+def not_modified(etag, last_modified):
+    """
+    Returns whether the browser's copy of a page is still current,
+    If-None-Match taking precedence over If-Modified-Since
+    """
+    if request.if_none_match:
+        return etag_matches(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified.replace(microsecond=0) <= since
+
+
+def page_validators(page, revision, is_author, included):
+    """
+    Returns the strong ETag and the Last-Modified date of a page as the
+    current user sees it. The ETag covers the content of the page and of
+    the pages it includes, its stored versions and pending edits, whether
+    the user is its author, who is logged in, which of its links point to
+    missing pages and which files it embeds, as all of them change what
+    is shown. The page is as old as the newest of it and the pages it
+    includes
+    """
+    pending = revision.pending if is_author else []
+    shown = '\n'.join([page.content] + list(included.values()))
+    digest = hashlib.sha1(page.content.encode('utf-8'))
+    for part in (revision.approved, revision.count, pending, is_author,
+                 getattr(current_user, 'name', None), template_version(), missing_targets(shown),
+                 list(included.items()), attachment_digests(shown)):
+        digest.update(b'\0' + repr(part).encode('utf-8'))
+    modified = [os.path.getmtime(page.path)]
+    for url in included:
+        try:
+            modified.append(os.path.getmtime(current_wiki.path(url)))
+        except OSError:
+            # deleted since it was read, which changes the ETag
+            pass
+    last_modified = datetime.fromtimestamp(max(modified), timezone.utc)
+    if revision.created:
+        # versions are stored in local time
+        last_modified = max(last_modified, datetime.fromisoformat(str(revision.created)).astimezone(timezone.utc))
+    return digest.hexdigest(), last_modified
+
+
 """
    User SQL Access
    ~~~~~~~~~~~~~~~
 """
 
 
+@bp.before_app_request
+def sync_caches():
+    """
+    Evicts the pages other workers changed since the last request from the
+    caches of this worker
+    """
+    CacheCoherence.for_database(config.DATABASE).sync()
+
+
+@bp.before_app_request
+def watch_content():
+    """
+    Starts watching the content directory for pages changed on disk, once
+    per process, so caches are invalidated for edits made outside the wiki
+    """
+    ContentWatcher.for_root(current_wiki.root).start()
+
+
+@bp.before_app_request
+def schedule_history_compaction():
+    """
+    Compacts user_history in the background once every
+    HISTORY_COMPACT_INTERVAL seconds
+    """
+    root = current_wiki.root
+    HistoryCompactor.for_database(config.DATABASE).maybe_run(
+        lambda: TitleManifest.for_root(root).by_url())
+
+
 def update_user_sql(page):
-    if current_user.has_visited_page(page.title):
-        current_user.increment_visits_to_db(page.title)
-    else:
-        current_user.add_page_user_history(page.title)
+    # the visit and the view are written in one transaction
+    conn, cursor = connect_to_db()
+    try:
+        current_user.record_visit(page.title, cursor)
+        count_view(cursor, page.url, current_user.name)
+        conn.commit()
+    finally:
+        conn.close()
@@ -2,6 +2,7 @@ from flask import jsonify
 
 import wiki.web
 from wiki.web.search.DropdownSearch import SuggestionSearch, HistorySearch
+from wiki.web.search.Popularity import PopularityTable
 
 
 class Dropdown:
@@ -13,8 +14,11 @@ class Dropdown:
     classes required to create optimal autocomplete
     """
 
-    def __init__(self, pages, database=None, user=None):
-        self.suggestions = SuggestionSearch(pages)
+    def __init__(self, pages, database=None, user=None, limit=None, manifest=None):
+        popularity = PopularityTable.for_database(database) if database else None
+        # the manifest of the pages keeps its matcher between requests
+        matcher = manifest.matcher(popularity) if manifest is not None else None
+        self.suggestions = SuggestionSearch(pages, popularity, limit, matcher)
         self.history = HistorySearch(pages, user, database)
         self.database = database
     def render(self, query):
@@ -1,6 +1,9 @@
 import sqlite3
 from abc import ABCMeta, abstractmethod
+
+import config
 from wiki.web.search.DropdownItem import SuggestionItem, HistoryItem
+from wiki.web.search.FuzzyMatcher import FuzzyMatcher
 
 
 class DropdownSearch(metaclass=ABCMeta):
@@ -53,14 +56,26 @@ class SuggestionSearch(DropdownSearch):
     Class dedicated to creating SuggestionSearch class
     Used for Searching for results on system related to query provided
     To locate search results for autocomplete
+    Tolerates typos and ranks results by match quality and popularity
     """
 
-    def __init__(self, index):
+    def __init__(self, index, popularity=None, limit=None, matcher=None):
         """
         Inits SuggestionSearch
         Inits pages index for searching
+        Inits fuzzy matcher over the page titles, unless one is given
+
+        Args:
+            index (list): Pages to search
+            popularity (PopularityTable): Optional popularity used for ranking
+            limit (int): Maximum number of results, None for all
+            matcher (FuzzyMatcher): Optional matcher over the titles of index
         """
         self.index = index
+        self.limit = limit
+        if matcher is None:
+            matcher = FuzzyMatcher([page.title for page in index], popularity)
+        self.matcher = matcher
 
     def render(self, query):
         """
@@ -86,6 +101,7 @@ class SuggestionSearch(DropdownSearch):
         Easy conversion from pages to usable data needed for search
 
         Will only return results unrelated to user history
+        Best matches come first
 
         Args:
             query (str): Query to be searched for to find matching pages
@@ -93,9 +109,8 @@ class SuggestionSearch(DropdownSearch):
         """
 
         items = []
-        for page in self.index:
-            if query.lower() in page.title.lower():
-                items.append(SuggestionItem(page.title))
+        for title in self.matcher.match(query, self.limit):
+            items.append(SuggestionItem(title))
         return items
 
 
@@ -165,14 +180,17 @@ class HistorySearch(DropdownSearch):
         """
         Retrieve's user history from database
 
-        Returns a list of all user's found history
+        Returns a list of the user's most recently accessed history,
+        at most HISTORY_QUERY_LIMIT entries
         """
         conn = sqlite3.connect(self.database)
         cursor = conn.cursor()
         db_query = '''SELECT url, date_last_accessed
                     FROM user_history
-                    WHERE user = ?'''
-        cursor.execute(db_query, (self.user,))
+                    WHERE user = ?
+                    ORDER BY date_last_accessed DESC
+                    LIMIT ?'''
+        cursor.execute(db_query, (self.user, config.HISTORY_QUERY_LIMIT))
         result = cursor.fetchall()
         conn.close()
         return result
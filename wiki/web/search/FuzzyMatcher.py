@@ -0,0 +1,220 @@
+import heapq
+import math
+from collections import defaultdict
+
+
+def trigrams(word):
+    """
+    Returns the set of trigrams of a single word
+
+    The word is padded with two leading and one trailing space so that
+    short words and word starts still produce distinctive trigrams
+
+    Args:
+        word (str): Lowercased word to split into trigrams
+    """
+    padded = '  ' + word + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(a, b, bound):
+    """
+    Computes the edit distance between two strings, giving up early
+
+    Only the diagonal band of width 2 * bound + 1 is evaluated, so the
+    cost is O(len(a) * bound) instead of O(len(a) * len(b))
+
+    Args:
+        a (str): First string
+        b (str): Second string
+        bound (int): Largest distance of interest
+
+    Returns bound + 1 when the distance is larger than bound
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    if len(a) > len(b):
+        a, b = b, a
+    too_far = bound + 1
+    previous = [j if j <= bound else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= bound:
+            current[0] = i
+        low = max(1, i - bound)
+        high = min(len(b), i + bound)
+        for j in range(low, high + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1,
+                             current[j - 1] + 1,
+                             previous[j - 1] + cost,
+                             too_far)
+        if min(current[low - 1:high + 1]) > bound:
+            return too_far
+        previous = current
+    return previous[len(b)]
+
+
+def max_distance(query):
+    """
+    Returns the number of typos tolerated for a query of this length
+    Very short queries must match exactly, otherwise everything matches
+
+    Args:
+        query (str): Query being matched
+    """
+    if len(query) <= 2:
+        return 0
+    if len(query) <= 5:
+        return 1
+    return 2
+
+
+class FuzzyMatcher:
+    """
+    FuzzyMatcher Class
+
+    Typo tolerant matcher over page titles
+    Candidates are generated from a trigram index over the title words and
+    then verified with a bounded edit distance, so only a small fraction of
+    the titles is ever compared character by character.
+    Results are ranked by match quality blended with page popularity
+    """
+
+    # How much popularity may contribute to the score of a match, the
+    # weakest substring match still beats the best fuzzy match
+    POPULARITY_WEIGHT = 0.3
+
+    def __init__(self, titles, popularity=None):
+        """
+        Constructor for FuzzyMatcher Class
+
+        Args:
+            titles (list): Titles of the pages to match against
+            popularity (PopularityTable): Optional table of page popularity
+        """
+        self.titles = list(titles)
+        self.lowered = [title.lower() for title in self.titles]
+        self.words = [lowered.split() for lowered in self.lowered]
+        self.popularity = popularity
+        self.grams = defaultdict(set)
+        for position, words in enumerate(self.words):
+            for word in words:
+                for gram in trigrams(word):
+                    self.grams[gram].add(position)
+
+    def candidates(self, query, distance):
+        """
+        Returns the positions of titles sharing enough trigrams with query
+        A single edit changes at most three trigrams of a word, and a title
+        containing the query verbatim contains all of its inner trigrams
+
+        Args:
+            query (str): Lowercased query
+            distance (int): Number of tolerated typos
+        """
+        query_grams = set()
+        inner_grams = set()
+        for word in query.split():
+            query_grams |= trigrams(word)
+            inner_grams |= {word[i:i + 3] for i in range(len(word) - 2)}
+        shared = defaultdict(int)
+        inner = defaultdict(int)
+        for gram in query_grams:
+            for position in self.grams.get(gram, ()):
+                shared[position] += 1
+                if gram in inner_grams:
+                    inner[position] += 1
+        required = max(1, len(query_grams) - 3 * distance)
+        return [position for position, count in shared.items()
+                if count >= required or inner[position] == len(inner_grams)]
+
+    def quality(self, query, position, distance):
+        """
+        Returns how well a title matches the query, between 0 and 1
+        Returns None if the title does not match at all
+
+        Args:
+            query (str): Lowercased query
+            position (int): Position of the title to verify
+            distance (int): Number of tolerated typos
+        """
+        title = self.lowered[position]
+        if title == query:
+            return 1.0
+        if title.startswith(query):
+            return 0.9
+        if any(word.startswith(query) for word in self.words[position]):
+            return 0.8
+        if query in title:
+            return 0.7
+        if distance == 0:
+            return None
+        # compare against whole words as well as word prefixes of about
+        # the query length, since the user may not have finished typing
+        targets = [title] + self.words[position]
+        best = distance + 1
+        for target in targets:
+            for length in range(len(query) - distance, len(query) + distance + 1):
+                if length <= 0 or length > len(target):
+                    continue
+                best = min(best, bounded_levenshtein(query, target[:length], distance))
+                if best == 1:
+                    break
+        if best > distance:
+            return None
+        return 0.6 * (1 - best / (distance + 1))
+
+    def score(self, position, quality):
+        """
+        Blends match quality with popularity of the title
+
+        Args:
+            position (int): Position of the matched title
+            quality (float): Match quality of the title
+        """
+        if self.popularity is None:
+            return quality
+        return quality + self.POPULARITY_WEIGHT * self.popularity.get(self.titles[position])
+
+    def match(self, query, limit=None):
+        """
+        Returns the titles matching query, best matches first
+
+        Args:
+            query (str): Query typed by the user
+            limit (int): Maximum number of titles returned, None for all
+        """
+        query = ' '.join(query.lower().split())
+        if not query:
+            return []
+        distance = max_distance(query)
+        if max(len(word) for word in query.split()) < 3:
+            # too short for trigrams to be selective, scan the titles
+            positions = range(len(self.titles))
+        else:
+            positions = self.candidates(query, distance)
+
+        scored = []
+        for position in positions:
+            quality = self.quality(query, position, distance)
+            if quality is not None:
+                scored.append((self.score(position, quality), -position))
+        if limit is None:
+            limit = len(scored)
+        best = heapq.nlargest(limit, scored, key=lambda item: (item[0], item[1]))
+        return [self.titles[-position] for _, position in best]
+
+
+def normalize_count(count, max_count):
+    """
+    Maps an access count onto 0..1 on a logarithmic scale, so one runaway
+    page does not flatten the popularity of all others
+
+    Args:
+        count (int): Access count of the page
+        max_count (int): Highest access count of any page
+    """
+    if count <= 0 or max_count <= 0:
+        return 0.0
+    return math.log1p(count) / math.log1p(max_count)
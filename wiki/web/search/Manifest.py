@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from io import open
+
+from wiki.core import Wiki, split_meta
+from wiki.signals import page_changed
+from wiki.signals import pages_reset
+from wiki.web.search.FuzzyMatcher import FuzzyMatcher
+
+ManifestEntry = namedtuple('ManifestEntry', ['title', 'url'])
+
+
+class TitleManifest:
+    """
+    TitleManifest Class
+
+    Compact list of the title and url of every page, served to the browser
+    so autocomplete can match locally instead of asking the server on every
+    keystroke. Only page headers are read to build it, nothing is rendered.
+
+    The version is a hash of the serialized entries, so it only changes when
+    pages are created, renamed or deleted, and is the same in every worker
+    The fuzzy matcher over the titles is kept along with the manifest, so
+    server side autocomplete does not index every title per request
+    """
+
+    _manifests = {}
+    _manifests_lock = threading.Lock()
+
+    @classmethod
+    def for_root(cls, root):
+        """
+        Returns the shared manifest of a content directory
+        Manifests are shared between requests and kept up to date from
+        the page_changed signal
+
+        Args:
+            root (str): Content directory of the wiki
+        """
+        root = os.path.abspath(root)
+        with cls._manifests_lock:
+            manifest = cls._manifests.get(root)
+            if manifest is None:
+                manifest = cls._manifests[root] = cls(root)
+            return manifest
+
+    def __init__(self, root):
+        """
+        Constructor for TitleManifest Class
+
+        Args:
+            root (str): Content directory of the wiki
+        """
+        self.root = root
+        self.titles = None
+        self.serialized = None
+        self.fuzzy = None
+        self._lock = threading.RLock()
+
+    def read_title(self, url, path):
+        """
+        Returns the title of a page from its header, the url if it has none
+
+        Args:
+            url (str): Url of the page
+            path (str): Path of the page file
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            meta, _ = split_meta(f.read())
+        return meta.get('title') or url
+
+    def load(self):
+        """
+        Takes the title of every page of the wiki from its page records,
+        sharing their strings
+        """
+        from wiki.records import PageIndex
+        self.titles = {record.url: record.title for record in PageIndex.for_root(self.root).records()}
+        self.serialized = None
+        self.fuzzy = None
+
+    def update(self, url):
+        """
+        Refreshes the entry of a single page after it has changed
+
+        Args:
+            url (str): Url of the changed page
+        """
+        with self._lock:
+            if self.titles is None:
+                return
+            path = Wiki(self.root).path(url)
+            if os.path.exists(path):
+                title = self.read_title(url, path)
+            else:
+                title = None
+            if self.titles.get(url) == title:
+                return
+            if title is None:
+                self.titles.pop(url, None)
+            else:
+                self.titles[url] = title
+            self.serialized = None
+            self.fuzzy = None
+
+    def title(self, url):
+        """
+        Returns the title of a page, the url if it does not exist
+
+        Args:
+            url (str): Url of the page
+        """
+        with self._lock:
+            if self.titles is None:
+                self.load()
+            return self.titles.get(url, url)
+
+    def by_url(self):
+        """
+        Returns a copy of the title of every page by url
+        """
+        with self._lock:
+            if self.titles is None:
+                self.load()
+            return dict(self.titles)
+
+    def entries(self):
+        """
+        Returns the entries of the manifest sorted by title
+        """
+        with self._lock:
+            if self.titles is None:
+                self.load()
+            return sorted((ManifestEntry(title, url) for url, title in self.titles.items()),
+                          key=lambda entry: (entry.title.lower(), entry.url))
+
+    def serialize(self):
+        """
+        Returns the manifest as compact json along with its version
+        The result is kept until the next change of a title or url
+        """
+        with self._lock:
+            if self.titles is None:
+                self.load()
+            if self.serialized is None:
+                pages = [list(entry) for entry in self.entries()]
+                body = json.dumps(pages, separators=(',', ':'), ensure_ascii=False)
+                version = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+                self.serialized = (
+                    '{"version":"%s","pages":%s}' % (version, body),
+                    version
+                )
+            return self.serialized
+
+    def matcher(self, popularity=None):
+        """
+        Returns the fuzzy matcher over the titles of the manifest
+        The matcher is kept until the next change of a title or url
+
+        Args:
+            popularity (PopularityTable): Optional table of page popularity
+        """
+        with self._lock:
+            if self.fuzzy is None or self.fuzzy.popularity is not popularity:
+                self.fuzzy = FuzzyMatcher([entry.title for entry in self.entries()], popularity)
+            return self.fuzzy
+
+
+@page_changed.connect
+def update_manifests(sender, url, event):
+    """
+    Keeps every loaded manifest in sync with page changes
+
+    Args:
+        sender: Object that changed the page
+        url (str): Url of the changed page
+        event (str): 'created', 'modified' or 'deleted'
+    """
+    for manifest in list(TitleManifest._manifests.values()):
+        manifest.update(url)
+
+
+@pages_reset.connect
+def drop_manifests(sender):
+    """
+    Drops every loaded manifest, they are read again on next use
+
+    Args:
+        sender: Object that reset the pages
+    """
+    with TitleManifest._manifests_lock:
+        TitleManifest._manifests.clear()
@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+import time
+
+import config
+from wiki.web.search.FuzzyMatcher import normalize_count
+
+
+class PopularityTable:
+    """
+    PopularityTable Class
+
+    In-memory table of how often each page has been accessed by all users
+    Aggregated from the count_accessed column of user_history and only
+    refreshed every POPULARITY_REFRESH seconds, so ranking autocomplete
+    results never queries the database per keystroke
+    """
+
+    _tables = {}
+    _tables_lock = threading.Lock()
+
+    @classmethod
+    def for_database(cls, database):
+        """
+        Returns the shared table of a database, creating it on first use
+        Tables are shared between requests so the refresh interval holds
+
+        Args:
+            database (str): Path of the database holding user_history
+        """
+        with cls._tables_lock:
+            table = cls._tables.get(database)
+            if table is None:
+                table = cls._tables[database] = cls(database)
+            return table
+
+    def __init__(self, database, refresh=None):
+        """
+        Constructor for PopularityTable Class
+
+        Args:
+            database (str): Path of the database holding user_history
+            refresh (int): Seconds between refreshes, defaults to config
+        """
+        self.database = database
+        self.refresh_interval = config.POPULARITY_REFRESH if refresh is None else refresh
+        self.table = ({}, 0)
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        """
+        Returns True if the table has never been loaded or has expired
+        """
+        return self.loaded_at is None or \
+            time.monotonic() - self.loaded_at >= self.refresh_interval
+
+    def refresh(self):
+        """
+        Reloads the aggregate access counts from the database
+        The new table is swapped in as a whole, readers never see a partial one
+        """
+        try:
+            conn = sqlite3.connect(self.database)
+            try:
+                rows = conn.execute('''SELECT LOWER(url), SUM(count_accessed)
+                                    FROM user_history
+                                    GROUP BY LOWER(url)''').fetchall()
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            # no history recorded yet
+            rows = []
+        counts = dict(rows)
+        self.table = (counts, max(counts.values(), default=0))
+        self.loaded_at = time.monotonic()
+
+    def get(self, title):
+        """
+        Returns the popularity of a page between 0 and 1
+        Only a single thread refreshes a stale table, the others keep
+        using the previous one in the meantime
+
+        Args:
+            title (str): Title of the page, history is recorded by title
+        """
+        if self.is_stale() and self._lock.acquire(blocking=self.loaded_at is None):
+            try:
+                if self.is_stale():
+                    self.refresh()
+            finally:
+                self._lock.release()
+        counts, max_count = self.table
+        return normalize_count(counts.get(title.lower(), 0), max_count)
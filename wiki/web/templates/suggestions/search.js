@@ -5,14 +5,35 @@
 
 <script>
     $(document).ready(function() {
-      // Retrieve autofill results
+      var AUTOCOMPLETE_LIMIT = 10;
+      // Title manifest as [[title, url], ...], matched locally on every keystroke
+      var manifest = null;
+      var resultsHistory = [];
+      var historyTimer = null;
+
+      // Retrieve the title manifest, the browser revalidates it with its ETag
+      function loadManifest() {
+        $.ajax({
+          url: '/search_manifest',
+          method: 'GET',
+          dataType: 'json',
+          success: function(data) {
+            manifest = data.pages;
+          },
+          error: function(err) {
+            console.error('Error fetching manifest:', err);
+          }
+        });
+      }
+
+      // Retrieve autofill results, only used while the manifest is unavailable
       function fetchData() {
         $.ajax({
           url: '/search_autocomplete',
           method: 'GET',
           data: { query: $('#term').val() },
           success: function(data) {
-            populateAutocomplete(data);
+            populateAutocomplete(data[0], data[1]);
           },
           error: function(err) {
             console.error('Error fetching data:', err);
@@ -20,14 +41,120 @@
         });
       }
 
-      // Function to populate the autocomplete suggestions
-      function populateAutocomplete(data) {
-        var results = data[0].map(function(suggestion) {
-          return suggestion;
+      // Retrieve the personalized history results, the only part needing the server
+      function fetchHistory(query) {
+        $.ajax({
+          url: '/search_autocomplete',
+          method: 'GET',
+          data: { query: query, scope: 'history' },
+          success: function(data) {
+            resultsHistory = data;
+            if ($('#term').val() === query) {
+              populateAutocomplete(matchLocally(query), resultsHistory);
+            }
+          },
+          error: function(err) {
+            console.error('Error fetching history:', err);
+          }
+        });
+      }
+
+      // Number of typos tolerated for a query, mirrors FuzzyMatcher.py
+      function maxDistance(query) {
+        if (query.length <= 2) {
+          return 0;
+        }
+        return query.length <= 5 ? 1 : 2;
+      }
+
+      // Edit distance of two strings, giving up once it exceeds bound
+      function editDistance(a, b, bound) {
+        if (Math.abs(a.length - b.length) > bound) {
+          return bound + 1;
+        }
+        var previous = [];
+        for (let j = 0; j <= b.length; j++) {
+          previous.push(j);
+        }
+        for (let i = 1; i <= a.length; i++) {
+          var current = [i];
+          var best = i;
+          for (let j = 1; j <= b.length; j++) {
+            var cost = a[i - 1] === b[j - 1] ? 0 : 1;
+            current.push(Math.min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost));
+            best = Math.min(best, current[j]);
+          }
+          if (best > bound) {
+            return bound + 1;
+          }
+          previous = current;
+        }
+        return previous[b.length];
+      }
+
+      // How well a title matches the query between 0 and 1, -1 for no match
+      function quality(query, title) {
+        var words = title.split(/\s+/);
+        if (title === query) {
+          return 1;
+        }
+        if (title.indexOf(query) === 0) {
+          return 0.9;
+        }
+        if (words.some(function(word) { return word.indexOf(query) === 0; })) {
+          return 0.8;
+        }
+        if (title.indexOf(query) !== -1) {
+          return 0.7;
+        }
+        var distance = maxDistance(query);
+        var best = distance + 1;
+        [title].concat(words).forEach(function(target) {
+          for (let length = query.length - distance; length <= query.length + distance; length++) {
+            if (length > 0 && length <= target.length) {
+              best = Math.min(best, editDistance(query, target.substring(0, length), distance));
+            }
+          }
+        });
+        if (best > distance) {
+          return -1;
+        }
+        return 0.6 * (1 - best / (distance + 1));
+      }
+
+      // Match the query against the manifest, best matches first
+      function matchLocally(query) {
+        query = query.toLowerCase().trim().replace(/\s+/g, ' ');
+        if (!query) {
+          return [];
+        }
+        var scored = [];
+        manifest.forEach(function(entry) {
+          var score = quality(query, entry[0].toLowerCase());
+          if (score >= 0) {
+            scored.push([score, entry[0]]);
+          }
         });
-        var results_history = data[1].map(function(hist) {
-          return hist;
+        // the manifest is sorted by title, sort keeps that order for ties
+        scored.sort(function(a, b) { return b[0] - a[0]; });
+        return scored.slice(0, AUTOCOMPLETE_LIMIT).map(function(item) {
+          return item[1];
         });
+      }
+
+      function onInput() {
+        var query = $('#term').val();
+        if (manifest === null) {
+          fetchData();
+          return;
+        }
+        populateAutocomplete(matchLocally(query), resultsHistory);
+        clearTimeout(historyTimer);
+        historyTimer = setTimeout(function() { fetchHistory(query); }, 150);
+      }
+
+      // Function to populate the autocomplete suggestions
+      function populateAutocomplete(results, results_history) {
 
         var results_fixed = [];
         for (let i = 0; i < results.length; i++) {
@@ -42,7 +169,10 @@
             }
         };
         $('#term').autocomplete({
-          source: results_fixed
+          // results are already matched, keep jQuery UI from filtering them again
+          source: function(request, response) {
+            response(results_fixed);
+          }
         }).autocomplete('instance')._renderItem = function(ul, item) {
             var string = '<a ' + checkHistory(item, results_history) + '>' + item.label + '</a>';
             return $('<li>')
@@ -59,8 +189,11 @@
         }
             return '';
         }
-      // Fetch data on input
-      $('#term').on('input', fetchData);
+      // Match on input
+      if ($('#term').length) {
+        loadManifest();
+      }
+      $('#term').on('input', onInput);
     });
 
 </script>
\ No newline at end of file
@@ -2,8 +2,10 @@
     User classes & helpers
     ~~~~~~~~~~~~~~~~~~~~~~
 """
+import copy
 import os
 import json
+import threading
 import binascii
 import hashlib
 import sqlite3
@@ -18,10 +20,16 @@ from wiki.core import connect_to_db
 
 
 class UserManager(object):
-    """A very simple user Manager, that saves it's data as json."""
+    """A very simple user Manager, that saves it's data as json.
+
+    One manager is shared by the requests of an app, it keeps the parsed
+    file until the file changes, so loading the user of a request does
+    not read and parse it every time."""
 
     def __init__(self, path):
         self.file = os.path.join(path, 'users.json')
+        self._cache = (None, {})
+        self._lock = threading.Lock()
 
     def read(self):
         if not os.path.exists(self.file):
@@ -30,6 +38,22 @@ class UserManager(object):
             data = json.loads(f.read())
         return data
 
+    def read_cached(self):
+        """Return the parsed file, read again only once it changed.
+        Callers must not change the returned data."""
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return {}
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._cache[0] == key:
+                return self._cache[1]
+        data = self.read()
+        with self._lock:
+            self._cache = (key, data)
+        return data
+
     def write(self, data):
         with open(self.file, 'w') as f:
             f.write(json.dumps(data, indent=2))
@@ -62,11 +86,11 @@ class UserManager(object):
         return User(self, name, userdata)
 
     def get_user(self, name):
-        users = self.read()
+        users = self.read_cached()
         userdata = users.get(name)
         if not userdata:
             return None
-        return User(self, name, userdata)
+        return User(self, name, copy.deepcopy(userdata))
 
     def delete_user(self, name):
         users = self.read()
@@ -147,6 +171,26 @@ class User(object):
         cursor.close()
         conn.close()
 
+    def record_visit(self, query, cursor=None):
+        """
+        Counts a visit to a page in the history of the user, adding the
+        page on the first visit, on a single connection. Given a cursor,
+        the visit is written on it and left to the caller to commit.
+        """
+        if cursor is None:
+            conn = sqlite3.connect(config.DATABASE)
+            self.record_visit(query, conn.cursor())
+            conn.commit()
+            conn.close()
+            return
+        now = datetime.now()
+        cursor.execute('''UPDATE user_history
+                        SET date_last_accessed = ?, count_accessed = count_accessed + 1
+                        WHERE user = ? AND url = ?''', (now, self.name, query))
+        if cursor.rowcount == 0:
+            cursor.execute('''INSERT INTO user_history (url, date_last_accessed, count_accessed, user)
+                            VALUES (?, ?, ?, ?)''', (query, now, 1, self.name))
+
     def has_visited_page(self, query):
         conn = sqlite3.connect(config.DATABASE)
         cursor = conn.cursor()